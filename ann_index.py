@@ -0,0 +1,100 @@
+import math
+import os
+import faiss
+import numpy as np
+from index_meta import IndexMismatchError
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+
+# Build parameters per index type; ef_search and nprobe are search-time and can be
+# overridden when loading (RAG_EF_SEARCH, RAG_NPROBE). nlist None = sized from the corpus.
+DEFAULT_INDEX_PARAMS = {
+    "flat": {},
+    "hnsw": {"m": 32, "ef_construction": 200, "ef_search": 64},
+    "ivf_flat": {"nlist": None, "nprobe": 16},
+    "ivf_pq": {"nlist": None, "nprobe": 16, "pq_m": 32, "nbits": 8}
+}
+
+# k-means wants this many training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+
+
+def index_params(index_type: str, overrides: dict = None) -> dict:
+    """Default parameters for index_type with overrides applied"""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}'. Use one of: {', '.join(INDEX_TYPES)}")
+    unknown = set(overrides or {}) - set(DEFAULT_INDEX_PARAMS[index_type])
+    if unknown:
+        raise ValueError(f"Unknown parameters for {index_type}: {', '.join(sorted(unknown))}")
+    return {**DEFAULT_INDEX_PARAMS[index_type], **(overrides or {})}
+
+
+def auto_nlist(num_vectors: int) -> int:
+    """~4 * sqrt(n) inverted lists, with enough vectors to train every centroid"""
+    return max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // MIN_POINTS_PER_CENTROID))
+
+
+def build_ann_index(vectors: np.ndarray, index_type: str = "flat", params: dict = None) -> tuple:
+    """Build and fill a FAISS L2 index of index_type; returns (index, params actually used).
+
+    Positions match the input rows, so a LangChain FAISS store can swap its
+    flat index for this one without touching its docstore mapping. Corpora too
+    small to train an IVF-PQ quantizer fall back to IVF-Flat.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    num_vectors, dim = vectors.shape
+    params = index_params(index_type, params)
+
+    if index_type == "ivf_pq" and num_vectors < MIN_POINTS_PER_CENTROID * 2 ** params["nbits"]:
+        print(f"⚠️ {num_vectors} vectors are too few to train IVF-PQ with {params['nbits']}-bit codes, using IVF-Flat")
+        index_type = "ivf_flat"
+        params = index_params(index_type, {"nlist": params["nlist"], "nprobe": params["nprobe"]})
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dim)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, params["m"])
+        index.hnsw.efConstruction = params["ef_construction"]
+    else:
+        params["nlist"] = params["nlist"] or auto_nlist(num_vectors)
+        quantizer = faiss.IndexFlatL2(dim)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, params["nlist"])
+        else:
+            if dim % params["pq_m"]:
+                raise ValueError(f"pq_m={params['pq_m']} must divide the embedding dimension {dim}")
+            index = faiss.IndexIVFPQ(quantizer, dim, params["nlist"], params["pq_m"], params["nbits"])
+        index.train(vectors)
+
+    index.add(vectors)
+    if index_type in ("ivf_flat", "ivf_pq"):
+        # Retrieval reconstructs candidate vectors by id (MMR)
+        index.make_direct_map()
+    configure_search(index, {"index_type": index_type, "index_params": params})
+    return index, {"index_type": index_type, "index_params": params}
+
+
+def index_type_of(index) -> str:
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def configure_search(index, index_meta: dict):
+    """Apply the recorded search parameters (overridable by RAG_EF_SEARCH / RAG_NPROBE) to a loaded index"""
+    index_type = index_meta.get("index_type", "flat")
+    if index_type_of(index) != index_type:
+        raise IndexMismatchError(
+            f"Index metadata records a {index_type} index but the FAISS file holds {index_type_of(index)}"
+        )
+    params = index_meta.get("index_params") or {}
+    if index_type == "hnsw":
+        index.hnsw.efSearch = int(os.getenv("RAG_EF_SEARCH", params.get("ef_search", 64)))
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        index.nprobe = int(os.getenv("RAG_NPROBE", params.get("nprobe", 16)))
+        if index.direct_map.type == faiss.DirectMap.NoMap:
+            index.make_direct_map()
@@ -0,0 +1,129 @@
+import json
+import os
+from datetime import datetime, timezone
+import numpy as np
+from index_registry import file_sha256
+from single_flight import normalize_text
+
+ANSWER_BANK_FILE = "answer_bank.json"
+ANSWER_BANK_VECTORS = "answer_bank.npy"
+
+
+def index_identity(index_dir: str, index_meta: dict) -> str:
+    """What an answer bank is tied to: the build version, or the index file's checksum for legacy indexes"""
+    return index_meta.get("version") or file_sha256(os.path.join(index_dir, "index.faiss"))[:16]
+
+
+class AnswerBank:
+    """Precomputed first-turn answers for one index build, looked up per (category, role).
+
+    Entries are {"question", "category", "role", "rewritten_query", "answer"};
+    vectors holds the question embeddings (same model as the index), one row per entry.
+    A question matches an entry when its normalised text is identical or its
+    cosine similarity reaches min_similarity.
+    """
+
+    def __init__(self, index_version: str, entries: list, vectors: np.ndarray, built_at: str = None):
+        self.index_version = index_version
+        self.entries = entries
+        self.built_at = built_at or datetime.now(timezone.utc).isoformat()
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(entries), -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.vectors = vectors / np.where(norms == 0, 1, norms)
+        self._rows = {}
+        self._exact = {}
+        for row, entry in enumerate(entries):
+            scope = (entry["category"], entry["role"])
+            self._rows.setdefault(scope, []).append(row)
+            self._exact[scope + (normalize_text(entry["question"]),)] = row
+
+    def __len__(self):
+        return len(self.entries)
+
+    def covers(self, category: str, role: str) -> bool:
+        return (category, role) in self._rows
+
+    def questions(self) -> list:
+        """Distinct (question, category) pairs, in build order"""
+        seen = []
+        for entry in self.entries:
+            if (entry["question"], entry["category"]) not in seen:
+                seen.append((entry["question"], entry["category"]))
+        return [{"question": question, "category": category} for question, category in seen]
+
+    def roles(self) -> list:
+        return sorted({entry["role"] for entry in self.entries})
+
+    def match(self, query: str, category: str, role: str, embed, min_similarity: float = 0.95):
+        """Return (entry, similarity) for a confident match or None; embed is only called without an exact match"""
+        rows = self._rows.get((category, role))
+        if not rows:
+            return None
+        row = self._exact.get((category, role, normalize_text(query)))
+        if row is not None:
+            return self.entries[row], 1.0
+        if min_similarity >= 1.0:
+            return None
+        vector = np.asarray(embed(query), dtype=np.float32)
+        if vector.shape[0] != self.vectors.shape[1]:
+            return None
+        similarities = self.vectors[rows] @ (vector / (np.linalg.norm(vector) or 1.0))
+        best = int(np.argmax(similarities))
+        if similarities[best] < min_similarity:
+            return None
+        return self.entries[rows[best]], float(similarities[best])
+
+    def rewrite_keys(self, cache) -> dict:
+        """Rewrite cache key -> banked first-turn rewrite"""
+        return {cache.make_key(entry["question"], None, []): entry["rewritten_query"]
+                for entry in self.entries if entry.get("rewritten_query")}
+
+    def warm_rewrite_cache(self, cache) -> int:
+        """Seed the rewrite cache with the banked first-turn rewrites"""
+        rewrites = self.rewrite_keys(cache)
+        for key, rewritten in rewrites.items():
+            cache.set(key, rewritten)
+        return len(rewrites)
+
+    def release_rewrite_cache(self, cache, keep=None) -> int:
+        """Drop the rewrites this bank warmed, except those the bank in keep warmed too"""
+        kept = keep.rewrite_keys(cache) if keep is not None else {}
+        return cache.discard(key for key in self.rewrite_keys(cache) if key not in kept)
+
+    def save(self, index_dir: str):
+        np.save(os.path.join(index_dir, ANSWER_BANK_VECTORS), self.vectors)
+        with open(os.path.join(index_dir, ANSWER_BANK_FILE), "w", encoding="utf-8") as f:
+            json.dump({"index_version": self.index_version, "built_at": self.built_at,
+                       "entries": self.entries}, f, indent=2, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, index_dir: str):
+        """The bank saved in an index directory, or None when there is none"""
+        path = os.path.join(index_dir, ANSWER_BANK_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        vectors = np.load(os.path.join(index_dir, ANSWER_BANK_VECTORS))
+        return cls(data["index_version"], data["entries"], vectors, built_at=data.get("built_at"))
+
+
+def load_answer_bank(index_dir: str, index_meta: dict):
+    """Load the bank built for this index, ignoring one left over from another build"""
+    try:
+        bank = AnswerBank.load(index_dir)
+    except Exception as e:
+        print(f"\n⚠️ Could not load the answer bank in {index_dir}: {str(e)}")
+        return None
+    if bank is None:
+        return None
+    identity = index_identity(index_dir, index_meta)
+    if bank.index_version != identity:
+        print(f"\n⚠️ Ignoring answer bank built for index {bank.index_version} (index is {identity}); "
+              f"rebuild it with build_answer_bank.py")
+        return None
+    if len(bank) and bank.vectors.shape[1] != index_meta["dimensions"]:
+        print(f"\n⚠️ Ignoring answer bank with {bank.vectors.shape[1]}-dimensional vectors "
+              f"(index has {index_meta['dimensions']})")
+        return None
+    return bank
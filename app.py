@@ -1,7 +1,11 @@
 import streamlit as st
+import hmac
 import os
+import time
 from dotenv import load_dotenv
 from main import MedicalQuerySystem
+from session_store import get_session_store
+from memory_monitor import format_report, get_memory_monitor
 
 # Load environment variables at startup
 if os.path.exists(".env"):
@@ -11,6 +15,78 @@ if os.path.exists(".env"):
 if "OPENAI_API_KEY" in st.secrets:
     os.environ["OPENAI_API_KEY"] = st.secrets["OPENAI_API_KEY"]
 
+# Messages drawn per rerun; older ones are loaded from the session store on demand
+CHAT_WINDOW = int(os.getenv("CHAT_WINDOW", "30"))
+MODE_COMMANDS = {"General": "switch gen", "IOLs": "switch iols", "CTR": "switch ctr"}
+
+def add_message(role: str, content: str):
+    """Record a transcript message in the session store and the rendered window"""
+    message = {"role": role, "content": content}
+    if "session_id" in st.session_state:
+        message["id"] = get_session_store().append_message(st.session_state.session_id, role, content)
+    st.session_state.messages.append(message)
+    # Keep the rendered window bounded; older messages stay in the store
+    if len(st.session_state.messages) > st.session_state.window_size:
+        st.session_state.messages = st.session_state.messages[-st.session_state.window_size:]
+
+def older_message_count() -> int:
+    """Messages of this session stored before the rendered window"""
+    if "session_id" not in st.session_state or not st.session_state.messages:
+        return 0
+    first_id = st.session_state.messages[0].get("id")
+    if first_id is None:
+        return 0
+    return get_session_store().count_messages(st.session_state.session_id, before_id=first_id)
+
+def load_earlier_messages():
+    st.session_state.window_size += CHAT_WINDOW
+    st.session_state.messages = get_session_store().recent_messages(
+        st.session_state.session_id, st.session_state.window_size
+    )
+
+def restore_session(session_id: str, state: dict):
+    """Bring back a saved conversation (transcript window, histories, mode) without re-running it"""
+    store = get_session_store()
+    st.session_state.session_id = session_id
+    st.session_state.medical_system.attach_session(store, session_id)
+    mode = state.get("mode", "General")
+    st.session_state.medical_system.switch_category(MODE_COMMANDS.get(mode, "switch gen"))
+    st.session_state.current_mode = mode
+    if state.get("mode_info"):
+        st.session_state.mode_info = state["mode_info"]
+    if state.get("name"):
+        st.session_state.name = state["name"]
+    if state.get("role"):
+        st.session_state.role = state["role"]
+    st.session_state.user_initialized = state.get("user_initialized", False)
+    st.session_state.messages = store.recent_messages(session_id, st.session_state.window_size)
+
+def show_memory_admin(monitor):
+    """Memory report for operators, at ?memory_admin=<MEMORY_ADMIN_TOKEN>.
+
+    Shows the latest report (the sampler's, with MEMORY_REPORT_FILE set); a fresh
+    one walks every session and takes seconds, so it is only made on request.
+    """
+    with st.sidebar.expander("Memory", expanded=True):
+        if st.button("Reset growth baseline", key="memory_baseline"):
+            monitor.mark_baseline()
+        if st.button("Generate report", key="memory_report"):
+            with st.spinner("Measuring..."):
+                monitor.report()
+        report = monitor.last_report
+        if report is None:
+            st.caption("No report yet. Generate one, or set MEMORY_REPORT_FILE for one after every sample.")
+            return
+        st.caption(f"Report from {time.time() - report['generated_at']:.0f}s ago")
+        st.code(format_report(report))
+
+def is_memory_admin() -> bool:
+    admin_token = os.getenv("MEMORY_ADMIN_TOKEN")
+    if not admin_token:
+        return False
+    given = st.query_params.get("memory_admin", "")
+    return hmac.compare_digest(given.encode("utf-8"), admin_token.encode("utf-8"))
+
 def initialize_chat():
     try:
         if "medical_system" not in st.session_state:
@@ -23,13 +99,22 @@ def initialize_chat():
                 st.error("Invalid OpenAI API key format. Key should start with 'sk-' or 'sk-proj-'")
                 return
                 
-            st.session_state.medical_system = MedicalQuerySystem(debug=False)
+            st.session_state.medical_system = MedicalQuerySystem(
+                debug=False, answer_bank=os.getenv("ANSWER_BANK", "true").lower() == "true")
         if "messages" not in st.session_state:
             st.session_state.messages = []
+        if "window_size" not in st.session_state:
+            st.session_state.window_size = CHAT_WINDOW
         if "current_mode" not in st.session_state:
             st.session_state.current_mode = "General"
         if "user_initialized" not in st.session_state:
             st.session_state.user_initialized = False
+        # A reconnecting browser keeps ?session=<id> in the URL
+        if "session_id" not in st.session_state:
+            session_id = st.query_params.get("session")
+            state = get_session_store().load_session(session_id) if session_id else None
+            if state is not None:
+                restore_session(session_id, state)
     except Exception as e:
         st.error(f"Error initializing chat: {str(e)}")
         return
@@ -68,13 +153,18 @@ def handle_mode_change():
     # Add system message to both Streamlit and medical system chat histories
     if system_message:
         # Add to Streamlit messages
-        st.session_state.messages.append({"role": "assistant", "content": system_message})
+        add_message("assistant", system_message)
         
         # Add to medical system chat history for the current category
-        current_history = st.session_state.medical_system.get_current_history()
-        current_history.append({"role": "assistant", "content": system_message})
+        st.session_state.medical_system.add_to_history("assistant", system_message)
         
     st.session_state.current_mode = st.session_state.mode_selector
+    if "session_id" in st.session_state:
+        get_session_store().update_session(
+            st.session_state.session_id,
+            mode=st.session_state.current_mode,
+            mode_info=st.session_state.get("mode_info")
+        )
 
 def handle_start_chat():
     if st.session_state.name and st.session_state.role:
@@ -90,7 +180,21 @@ def handle_start_chat():
             "and I'm also well-versed in general ophthalmology topics. "
             "Please select your preferred mode from the dropdown menu below to begin our conversation."
         )
-        st.session_state.messages = [{"role": "assistant", "content": greeting}]
+        # Every Start Chat begins a new stored session, reachable again through the URL
+        store = get_session_store()
+        session_id = store.create_session(
+            name=st.session_state.name,
+            role=st.session_state.role,
+            mode=st.session_state.current_mode,
+            mode_info=st.session_state.get("mode_info"),
+            user_initialized=True
+        )
+        st.session_state.session_id = session_id
+        st.query_params["session"] = session_id
+        st.session_state.medical_system.attach_session(store, session_id)
+        st.session_state.window_size = CHAT_WINDOW
+        st.session_state.messages = []
+        add_message("assistant", greeting)
 
 def main():
     st.set_page_config(
@@ -217,6 +321,13 @@ def main():
     
     # Initialize chat state
     initialize_chat()
+    
+    # With MEMORY_PROFILE=true, attribute this session's rendered transcript to it
+    memory_monitor = get_memory_monitor()
+    if memory_monitor is not None and "medical_system" in st.session_state:
+        memory_monitor.track_session(st.session_state.medical_system, transcript=st.session_state.messages)
+        if is_memory_admin():
+            show_memory_admin(memory_monitor)
 
     # Sidebar for user initialization
     with st.sidebar:
@@ -254,7 +365,10 @@ def main():
         if "mode_info" in st.session_state:
             st.info(st.session_state.mode_info)
         
-        # Chat messages
+        # Chat messages (only the recent window; older ones on request)
+        older = older_message_count()
+        if older:
+            st.button(f"Load earlier messages ({older} more)", key="load_earlier", on_click=load_earlier_messages)
         for message in st.session_state.messages:
             with st.chat_message(message["role"]):
                 st.write(message["content"])
@@ -262,7 +376,7 @@ def main():
         # Chat input
         if prompt := st.chat_input("Type your query here"):
             # Add user message
-            st.session_state.messages.append({"role": "user", "content": prompt})
+            add_message("user", prompt)
             
             # Display user message
             with st.chat_message("user"):
@@ -273,7 +387,7 @@ def main():
                 with st.spinner("Thinking..."):
                     response = st.session_state.medical_system.process_query(prompt)
                     st.write(response)
-                    st.session_state.messages.append({"role": "assistant", "content": response})
+                    add_message("assistant", response)
 
         # Mode selector - small and centered
         st.markdown('<div class="mode-label">Select mode: </div>', unsafe_allow_html=True)
@@ -0,0 +1,145 @@
+"""Build time, memory, search latency and recall@k of each FAISS index type.
+
+Corpora are synthetic clustered unit vectors (embedding-like: many topics,
+many near neighbours), so sizes far beyond the current knowledge base can be
+tried without embedding anything. Recall is measured against exact flat
+search. Search-time parameters (HNSW ef_search, IVF nprobe) are swept on one
+build, and for each corpus size the fastest configuration that reaches
+--min-recall is recommended as build_index.py flags.
+
+    python -m benchmarks.bench_ann_index
+    python -m benchmarks.bench_ann_index --sizes 1000000 --dim 512 --types hnsw ivf_pq
+
+1M vectors at 1536 dimensions need ~6 GB per copy; use --dim 512 (a shortened
+text-embedding-3 size, see build_index.py --dimensions) on smaller machines.
+"""
+import argparse
+import os
+import tempfile
+import time
+import faiss
+import numpy as np
+from ann_index import INDEX_TYPES, build_ann_index, configure_search
+from calibrate_threshold import percentile
+
+
+def synthetic_vectors(num_vectors: int, dim: int, num_clusters: int, rng: np.random.Generator,
+                      centers: np.ndarray = None, spread: float = 1.5, batch: int = 100_000) -> tuple:
+    """Unit vectors scattered around random cluster centers; returns (vectors, centers)"""
+    if centers is None:
+        centers = rng.standard_normal((num_clusters, dim)).astype(np.float32)
+        centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    vectors = np.empty((num_vectors, dim), dtype=np.float32)
+    for start in range(0, num_vectors, batch):
+        end = min(num_vectors, start + batch)
+        noise = rng.standard_normal((end - start, dim)).astype(np.float32) * (spread / np.sqrt(dim))
+        chunk = centers[rng.integers(0, len(centers), size=end - start)] + noise
+        vectors[start:end] = chunk / np.linalg.norm(chunk, axis=1, keepdims=True)
+    return vectors, centers
+
+
+def index_megabytes(index) -> float:
+    with tempfile.NamedTemporaryFile(suffix=".faiss") as f:
+        faiss.write_index(index, f.name)
+        return os.path.getsize(f.name) / 2 ** 20
+
+
+def measure(index, queries: np.ndarray, truth: np.ndarray, k: int) -> dict:
+    """Single-query searches, as RAGQuery issues them"""
+    latencies, recalls = [], []
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(set(ids[0].tolist()) & set(expected.tolist())) / k)
+    return {"mean_ms": float(np.mean(latencies)), "p95_ms": percentile(latencies, 95),
+            "recall": float(np.mean(recalls))}
+
+
+def search_sweep(index_type: str, args) -> list:
+    """[(label, search params)] to try on one build of index_type"""
+    if index_type == "hnsw":
+        return [(f"ef_search={ef}", {"ef_search": ef}) for ef in args.ef_search]
+    if index_type in ("ivf_flat", "ivf_pq"):
+        return [(f"nprobe={nprobe}", {"nprobe": nprobe}) for nprobe in args.nprobe]
+    return [("exact", {})]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare FAISS index types on synthetic corpora")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10_000, 100_000])
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--types", nargs="+", choices=INDEX_TYPES, default=list(INDEX_TYPES))
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=6)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 16, 64])
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--pq-m", type=int, default=32, help="PQ sub-quantizers; must divide --dim")
+    parser.add_argument("--spread", type=float, default=1.5,
+                        help="Noise around cluster centers; higher = harder, less clustered corpus")
+    parser.add_argument("--min-recall", type=float, default=0.95, help="Recall@k a recommendation must reach")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rows, recommendations = [], {}
+    for size in args.sizes:
+        rng = np.random.default_rng(args.seed)
+        corpus, centers = synthetic_vectors(size, args.dim, max(10, size // 100), rng, spread=args.spread)
+        queries, _ = synthetic_vectors(args.queries, args.dim, 0, rng, centers=centers, spread=args.spread)
+        exact = faiss.IndexFlatL2(args.dim)
+        exact.add(corpus)
+        _, truth = exact.search(queries, args.k)
+        del exact
+        print(f"\n{size} vectors x {args.dim} dims")
+
+        candidates = []
+        for index_type in args.types:
+            build_params = {"hnsw": {"m": args.hnsw_m}, "ivf_pq": {"pq_m": args.pq_m}}.get(index_type, {})
+            start = time.perf_counter()
+            index, ann = build_ann_index(corpus, index_type, build_params)
+            build_seconds = time.perf_counter() - start
+            if ann["index_type"] != index_type:
+                print(f"  {index_type:<9}skipped: corpus too small")
+                continue
+            size_mb = index_megabytes(index)
+            for label, search_params in search_sweep(ann["index_type"], args):
+                meta = {"index_type": ann["index_type"], "index_params": {**ann["index_params"], **search_params}}
+                configure_search(index, meta)
+                result = measure(index, queries, truth, args.k)
+                row = {"size": size, "type": ann["index_type"], "search": label, "build_s": build_seconds,
+                       "size_mb": size_mb, "meta": meta, **result}
+                rows.append(row)
+                candidates.append(row)
+                print(f"  {ann['index_type']:<9}{label:<15} build {build_seconds:7.1f}s  {size_mb:8.1f} MB  "
+                      f"p95 {result['p95_ms']:7.3f} ms  recall@{args.k} {result['recall']:.3f}")
+            del index
+
+        good = [row for row in candidates if row["recall"] >= args.min_recall]
+        if good:
+            best = min(good, key=lambda row: row["p95_ms"])
+            flat = next((row for row in good if row["type"] == "flat"), None)
+            # An approximate index has to earn its recall loss and build time
+            if flat and best["p95_ms"] > 0.8 * flat["p95_ms"]:
+                best = flat
+            recommendations[size] = best
+
+    print(f"\n{'vectors':>9}  {'type':<9}{'search':<15}{'build s':>9}{'MB':>9}{'mean ms':>9}{'p95 ms':>9}"
+          f"{'recall@' + str(args.k):>10}")
+    for r in rows:
+        print(f"{r['size']:>9}  {r['type']:<9}{r['search']:<15}{r['build_s']:>9.2f}{r['size_mb']:>9.1f}"
+              f"{r['mean_ms']:>9.3f}{r['p95_ms']:>9.3f}{r['recall']:>10.3f}")
+
+    print(f"\nFastest configuration with recall@{args.k} >= {args.min_recall}:")
+    for size in args.sizes:
+        best = recommendations.get(size)
+        if best is None:
+            print(f"  {size:>9}: none reached the target; try larger --ef-search / --nprobe")
+            continue
+        flags = f"--index-type {best['meta']['index_type']}" + "".join(
+            f" --index-param {key}={value}" for key, value in best["meta"]["index_params"].items() if value is not None)
+        print(f"  {size:>9}: {best['type']} {best['search']} (p95 {best['p95_ms']:.3f} ms) -> build_index.py {flags}")
+
+
+if __name__ == "__main__":
+    main()
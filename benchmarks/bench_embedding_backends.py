@@ -0,0 +1,148 @@
+"""Query latency, throughput and retrieval recall of the embedding backends.
+
+Chunks are taken from an existing index and re-embedded with every backend
+(see embedding_backends.py). Queries come from a question set or, by default,
+the first sentence of sampled chunks, whose own chunk is then the expected
+hit. Per backend the report shows document embedding throughput, sequential
+query latency (p50/p95), query throughput with --concurrency callers (the
+local backend batches concurrent queries), hit@k and overlap@k with the first
+backend's results:
+
+    python -m benchmarks.bench_embedding_backends --index-dir vector_index/<version> --backends openai local hash
+    python -m benchmarks.bench_embedding_backends --questions questions.jsonl --model local=BAAI/bge-small-en-v1.5
+
+Without OPENAI_API_KEY the openai backend runs against the local mock API with
+--mock-latency seconds per call, so only its latency shape is meaningful.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import faiss
+import numpy as np
+from dotenv import load_dotenv
+from langchain_community.vectorstores import FAISS
+from benchmarks.mock_openai_server import MockOpenAIServer
+from calibrate_threshold import load_question_set, percentile
+from context_compression import normalize_rows, split_sentences
+from embedding_backends import EMBEDDING_BACKENDS, HashEmbeddings, make_embeddings
+
+load_dotenv()
+
+
+def load_chunks(index_dir: str) -> list:
+    """Documents of an index in FAISS id order"""
+    store = FAISS.load_local(index_dir, HashEmbeddings(), allow_dangerous_deserialization=True)
+    return [store.docstore.search(store.index_to_docstore_id[i]) for i in range(store.index.ntotal)]
+
+
+def sample_queries(docs: list, count: int, seed: int) -> list:
+    """(query, expected chunk id, expected source) from the first sentence of random chunks"""
+    rng = np.random.default_rng(seed)
+    queries = []
+    for i in rng.permutation(len(docs)):
+        spans = split_sentences(docs[i].page_content)
+        if spans:
+            start, end = spans[0]
+            queries.append((docs[i].page_content[start:end], int(i), None))
+        if len(queries) >= count:
+            break
+    return queries
+
+
+def run_backend(embeddings, texts: list, queries: list, k: int, concurrency: int) -> dict:
+    start = time.perf_counter()
+    doc_vectors = normalize_rows(embeddings.embed_documents(texts))
+    doc_seconds = time.perf_counter() - start
+
+    latencies, query_vectors = [], []
+    for query, _, _ in queries:
+        start = time.perf_counter()
+        query_vectors.append(embeddings.embed_query(query))
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(embeddings.embed_query, [query for query, _, _ in queries]))
+    concurrent_seconds = time.perf_counter() - start
+
+    index = faiss.IndexFlatL2(doc_vectors.shape[1])
+    index.add(doc_vectors)
+    _, ids = index.search(normalize_rows(query_vectors), min(k, len(texts)))
+    return {
+        "dimensions": doc_vectors.shape[1],
+        "docs_per_second": len(texts) / doc_seconds if doc_seconds else float("inf"),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "queries_per_second": len(queries) / concurrent_seconds if concurrent_seconds else float("inf"),
+        "ids": ids
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare embedding backends on latency and recall")
+    parser.add_argument("--index-dir", default=".", help="Index directory to take chunks from")
+    parser.add_argument("--questions", help="JSON lines question set with expected_source; default samples chunks")
+    parser.add_argument("--sample-queries", type=int, default=200)
+    parser.add_argument("--backends", nargs="+", choices=EMBEDDING_BACKENDS, default=["openai", "local", "hash"],
+                        help="The first one that runs is the overlap reference")
+    parser.add_argument("--model", action="append", default=[], metavar="BACKEND=MODEL",
+                        help="Model per backend, e.g. local=BAAI/bge-small-en-v1.5")
+    parser.add_argument("--k", type=int, default=6)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mock-latency", type=float, default=0.15,
+                        help="Seconds per embedding call of the mock API when OPENAI_API_KEY is unset")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    models = dict(item.split("=", 1) for item in args.model)
+
+    server = None
+    if "openai" in args.backends and not os.getenv("OPENAI_API_KEY"):
+        server = MockOpenAIServer(embedding_latency=args.mock_latency, jitter=0.2, seed=args.seed).start()
+        os.environ.update({"OPENAI_API_KEY": "sk-mock", "OPENAI_BASE_URL": server.base_url})
+        print(f"No OPENAI_API_KEY: openai backend uses the mock API ({args.mock_latency}s per call)")
+
+    docs = load_chunks(args.index_dir)
+    texts = [doc.page_content for doc in docs]
+    if args.questions:
+        queries = [(item["question"], None, os.path.basename(item.get("expected_source") or ""))
+                   for item in load_question_set(args.questions)]
+    else:
+        queries = sample_queries(docs, args.sample_queries, args.seed)
+
+    results = {}
+    try:
+        for backend in args.backends:
+            try:
+                embeddings = make_embeddings(backend, models.get(backend))
+            except (ImportError, ValueError) as e:
+                print(f"Skipping {backend}: {str(e)}")
+                continue
+            print(f"Embedding {len(texts)} chunks and {len(queries)} queries with {backend}...")
+            results[backend] = run_backend(embeddings, texts, queries, args.k, args.concurrency)
+    finally:
+        if server is not None:
+            server.stop()
+    if not results:
+        raise SystemExit("No backend could run")
+
+    reference = next(iter(results))
+    print(f"\n{len(texts)} chunks, {len(queries)} queries, k={args.k}, {args.concurrency} concurrent callers")
+    print(f"{'backend':<10}{'dims':>6}{'docs/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'q/s':>9}{'hit@k':>8}"
+          f"{'overlap':>9}")
+    for backend, result in results.items():
+        hits = []
+        for (_, chunk_id, source), ids in zip(queries, result["ids"]):
+            if chunk_id is not None:
+                hits.append(chunk_id in ids)
+            elif source:
+                hits.append(any(docs[i].metadata.get("filename") == source for i in ids if i >= 0))
+        hit_rate = f"{np.mean(hits):>8.3f}" if hits else f"{'-':>8}"
+        overlap = np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(result["ids"], results[reference]["ids"])])
+        print(f"{backend:<10}{result['dimensions']:>6}{result['docs_per_second']:>10.1f}{result['p50_ms']:>9.2f}"
+              f"{result['p95_ms']:>9.2f}{result['queries_per_second']:>9.1f}{hit_rate}{overlap:>9.3f}")
+    print(f"overlap = share of top-{args.k} chunks also returned by '{reference}'")
+
+
+if __name__ == "__main__":
+    main()
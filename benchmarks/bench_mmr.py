@@ -0,0 +1,82 @@
+"""Overhead of MMR re-ranking compared with a plain top-k FAISS search.
+
+Runs on synthetic vectors, so no API key is needed:
+
+    python -m benchmarks.bench_mmr --vectors 5000 --queries 200
+"""
+import argparse
+import time
+import faiss
+import numpy as np
+from mmr import mmr_select
+
+
+def make_corpus(n_vectors: int, dim: int, n_sources: int, seed: int = 0):
+    """Clustered random vectors; each cluster plays the part of one PDF with overlapping chunks"""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(n_sources, dim)).astype(np.float32)
+    sources = rng.integers(0, n_sources, size=n_vectors)
+    vectors = centres[sources] + 0.3 * rng.normal(size=(n_vectors, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32), sources
+
+
+def percentile_ms(samples: list, pct: float) -> float:
+    return float(np.percentile(np.array(samples) * 1000, pct))
+
+
+def run(n_vectors: int, dim: int, n_queries: int, k: int, fetch_k: int, n_sources: int,
+        lambda_mult: float, max_per_source: int):
+    vectors, sources = make_corpus(n_vectors, dim, n_sources)
+    index = faiss.IndexFlatL2(dim)
+    index.add(vectors)
+    queries, _ = make_corpus(n_queries, dim, n_sources, seed=1)
+
+    plain, mmr_total, mmr_rerank = [], [], []
+    plain_sources, mmr_sources = [], []
+    for query in queries:
+        query = query.reshape(1, -1)
+
+        start = time.perf_counter()
+        _, ids = index.search(query, k)
+        plain.append(time.perf_counter() - start)
+        plain_sources.append(len(set(sources[ids[0]])))
+
+        start = time.perf_counter()
+        _, ids = index.search(query, fetch_k)
+        candidate_ids = ids[0][ids[0] >= 0]
+        candidate_vectors = index.reconstruct_batch(candidate_ids.astype(np.int64))
+        rerank_start = time.perf_counter()
+        picks = mmr_select(query[0], candidate_vectors, k, lambda_mult=lambda_mult,
+                           sources=list(sources[candidate_ids]), max_per_source=max_per_source)
+        end = time.perf_counter()
+        mmr_total.append(end - start)
+        mmr_rerank.append(end - rerank_start)
+        mmr_sources.append(len(set(sources[candidate_ids[picks]])))
+
+    print(f"\nCorpus: {n_vectors} vectors x {dim} dims, {n_queries} queries, k={k}, fetch_k={fetch_k}")
+    print(f"{'':<28}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for label, samples in [("plain search", plain), ("search+reconstruct+MMR", mmr_total),
+                           ("  MMR selection only", mmr_rerank)]:
+        print(f"{label:<28}{np.mean(samples) * 1000:>10.3f}"
+              f"{percentile_ms(samples, 50):>10.3f}{percentile_ms(samples, 95):>10.3f}")
+    print(f"\nDistinct sources per result: plain {np.mean(plain_sources):.2f}, MMR {np.mean(mmr_sources):.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MMR re-ranking overhead")
+    parser.add_argument("--vectors", type=int, default=5000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=6)
+    parser.add_argument("--fetch-k", type=int, default=24)
+    parser.add_argument("--sources", type=int, default=50)
+    parser.add_argument("--lambda-mult", type=float, default=0.5)
+    parser.add_argument("--max-per-source", type=int, default=None)
+    args = parser.parse_args()
+    run(args.vectors, args.dim, args.queries, args.k, args.fetch_k, args.sources,
+        args.lambda_mult, args.max_per_source)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Prompt prefix cache hit rate and latency: templated prompts vs the old layout.
+
+The old prompts put the question and answer before the static instructions, so
+no two requests shared a prefix. The templates in prompt_templates.py send
+the static part first. This sends the same requests in both layouts and reports
+cached prompt tokens (usage.prompt_tokens_details.cached_tokens) and latency.
+
+By default it runs against the local mock API, which simulates prefix caching
+(prefixes of at least --cache-min-tokens, like OpenAI's 1024). Use --live to
+measure against the configured OpenAI endpoint instead.
+
+    python -m benchmarks.bench_prompt_cache --requests 40
+    python -m benchmarks.bench_prompt_cache --live --model gpt-4o-mini
+"""
+import argparse
+import os
+import random
+import time
+from dotenv import load_dotenv
+from openai import OpenAI
+from calibrate_threshold import load_question_set, percentile
+from llm_scheduler import chat_completion
+from prompt_templates import PROMPT_CACHE_MIN_TOKENS
+from query_merger import GENERAL_TEMPLATES, REFINEMENT_TEMPLATES
+from relevancy_checker import RELEVANCY_TEMPLATES
+from benchmarks.mock_openai_server import MockOpenAIServer
+
+load_dotenv()
+
+SAMPLE_QUESTIONS = [
+    "What is the RingJect 376 used for?",
+    "When should a capsular tension ring be implanted?",
+    "How does the Precizon Presbyopic NVA correct presbyopia?",
+    "What are the contraindications for a CTR?",
+    "What is the difference between CTR Model 275 and 276?",
+    "How is zonular weakness assessed before cataract surgery?",
+    "What visual outcomes can patients expect with the Precizon lens?",
+    "Can a CTR be inserted after the IOL is in the bag?"
+]
+FILLER = ("capsular bag zonular support haptic optic refractive segment diameter compression eyelet "
+          "injector cartridge centration tilt presbyopia near intermediate distance contrast").split()
+
+TEMPLATES = {
+    "relevancy/ctr": RELEVANCY_TEMPLATES[("ctr", True)],
+    "refinement/doctor": REFINEMENT_TEMPLATES["doctor"],
+    "general/doctor": GENERAL_TEMPLATES[("doctor", False)]
+}
+
+
+def legacy_messages(template, **values) -> list:
+    """The pre-template layout: per-request content first, static instructions after it"""
+    messages = [{"role": "system", "content": template.system}] if template.system else []
+    messages.append({"role": "user", "content": f"{template.request.format(**values)}\n\n{template.instructions}"})
+    return messages
+
+
+def sample_values(rng: random.Random, questions: list) -> dict:
+    answer = " ".join(rng.choice(FILLER) for _ in range(rng.randint(80, 200)))
+    question = rng.choice(questions)
+    return {"question": question, "query": question, "answer": answer, "kb_response": answer}
+
+
+def run_layout(client, model: str, layout: str, template, requests: int, questions: list, seed: int) -> dict:
+    rng = random.Random(seed)
+    latencies, prompt_tokens, cached_tokens = [], 0, 0
+    for _ in range(requests):
+        values = sample_values(rng, questions)
+        messages = template.messages(**values) if layout == "templated" else legacy_messages(template, **values)
+        start = time.perf_counter()
+        response = chat_completion(client, model=model, messages=messages, max_tokens=16, temperature=0)
+        latencies.append(time.perf_counter() - start)
+        usage = response.usage
+        details = getattr(usage, "prompt_tokens_details", None)
+        prompt_tokens += usage.prompt_tokens
+        cached_tokens += getattr(details, "cached_tokens", None) or 0
+    return {
+        "hit_rate": cached_tokens / prompt_tokens if prompt_tokens else 0.0,
+        "mean": sum(latencies) / len(latencies),
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark prompt prefix caching")
+    parser.add_argument("--requests", type=int, default=30, help="Requests per template and layout")
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--questions", help="JSON lines question set to sample questions from")
+    parser.add_argument("--live", action="store_true", help="Use the configured OpenAI API instead of the mock")
+    parser.add_argument("--cache-min-tokens", type=int, default=PROMPT_CACHE_MIN_TOKENS,
+                        help="Mock only: shortest cacheable prefix")
+    parser.add_argument("--chat-latency", type=float, default=0.4, help="Mock only: mean seconds per call")
+    args = parser.parse_args()
+
+    questions = [item["question"] for item in load_question_set(args.questions)] if args.questions else SAMPLE_QUESTIONS
+
+    print(f"\n{'template':<20}{'prefix tok':>11}{'layout':>11}{'hit rate':>10}{'mean s':>9}{'p50 s':>8}{'p95 s':>8}")
+    for name, template in TEMPLATES.items():
+        prefix_tokens = template.prefix_tokens(args.model)
+        for layout in ("legacy", "templated"):
+            # A fresh mock per run so one layout can't warm the cache for the other
+            server = None
+            if args.live:
+                client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+            else:
+                server = MockOpenAIServer(chat_latency=args.chat_latency, embedding_latency=0.0, jitter=0.1,
+                                          cache_min_tokens=args.cache_min_tokens).start()
+                client = OpenAI(api_key="sk-mock", base_url=server.base_url, max_retries=0)
+            try:
+                result = run_layout(client, args.model, layout, template, args.requests, questions, seed=0)
+            finally:
+                if server is not None:
+                    server.stop()
+            print(f"{name:<20}{prefix_tokens:>11}{layout:>11}{result['hit_rate']:>10.1%}"
+                  f"{result['mean']:>9.3f}{result['p50']:>8.3f}{result['p95']:>8.3f}")
+
+    minimum = PROMPT_CACHE_MIN_TOKENS if args.live else args.cache_min_tokens
+    short = [name for name, template in TEMPLATES.items() if template.prefix_tokens(args.model) < minimum]
+    if short:
+        print(f"\nStatic prefix shorter than the {minimum}-token caching minimum: {', '.join(short)}. "
+              f"Only prompts whose shared prefix reaches it are cached.")
+
+
+if __name__ == "__main__":
+    main()
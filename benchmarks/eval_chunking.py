@@ -0,0 +1,111 @@
+"""Compare text splitters and chunk sizes with structure-aware chunking.
+
+Reports chunk count, average chunk and prompt tokens, and retrieval hit rate
+on a labelled question set (see calibrate_threshold.load_question_set; each
+question needs "expected_source" and may give "expected_page"):
+
+    python -m benchmarks.eval_chunking questions.jsonl --pdfs-dir KB/pdfs
+    python -m benchmarks.eval_chunking questions.jsonl --strategies recursive token --chunk-sizes 400 800
+
+Extraction and embeddings go through the build cache (--cache-dir), so after
+the first run only chunks that did not exist before are embedded.
+"""
+import argparse
+import contextlib
+import io
+import os
+from langchain.schema import Document
+from langchain_community.vectorstores import FAISS
+from build_index import KnowledgeBaseBuilder
+from calibrate_threshold import load_question_set
+
+RAG_SYSTEM_PROMPT = "You are a helpful ophthalmology assistant. Answer questions based only on the following context:"
+
+
+def is_hit(doc: Document, item: dict, check_page: bool) -> bool:
+    """Whether a retrieved chunk comes from the expected source (and page, if asked)"""
+    expected_source = os.path.basename(item.get("expected_source") or "")
+    if not expected_source or doc.metadata.get("filename") != expected_source:
+        return False
+    if not check_page:
+        return True
+    page_start = doc.metadata.get("page_start")
+    page_end = doc.metadata.get("page_end")
+    if page_start is None or page_end is None:
+        return False
+    return page_start <= item["expected_page"] <= page_end
+
+
+def evaluate(label: str, builder: KnowledgeBaseBuilder, pdfs_dir: str, questions: list, k: int) -> dict:
+    # The builder logs every chunk; keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        documents_dict = builder.process_directory(pdfs_dir)
+    documents = [Document(page_content=d["page_content"], metadata=d["metadata"]) for d in documents_dict]
+    if not documents:
+        raise ValueError(f"No chunks produced from {pdfs_dir}")
+
+    chunk_tokens = [builder.num_tokens_from_string(doc.page_content) for doc in documents]
+    store = FAISS.from_documents(documents, builder.embeddings)
+
+    prompt_tokens, hits, page_hits, page_questions = [], 0, 0, 0
+    for item in questions:
+        search_kwargs = {"filter": {"category": item["category"]}} if item["category"] else {}
+        docs = store.similarity_search(item["question"], k=k, **search_kwargs)
+        context = "\n\n".join(doc.page_content for doc in docs)
+        prompt = f"{RAG_SYSTEM_PROMPT}\nContext:\n{context}\n\nQuestion: {item['question']}"
+        prompt_tokens.append(builder.num_tokens_from_string(prompt))
+
+        hits += any(is_hit(doc, item, check_page=False) for doc in docs)
+        if item.get("expected_page") is not None:
+            page_questions += 1
+            page_hits += any(is_hit(doc, item, check_page=True) for doc in docs)
+
+    return {
+        "strategy": label,
+        "chunks": len(documents),
+        "avg_chunk_tokens": sum(chunk_tokens) / len(chunk_tokens),
+        "avg_prompt_tokens": sum(prompt_tokens) / len(prompt_tokens) if prompt_tokens else 0.0,
+        "hit_rate": hits / len(questions) if questions else 0.0,
+        "page_hit_rate": page_hits / page_questions if page_questions else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate chunking strategies")
+    parser.add_argument("questions", help="JSON lines question set with expected_source")
+    parser.add_argument("--pdfs-dir", default="KB/pdfs")
+    parser.add_argument("--k", type=int, default=6)
+    parser.add_argument("--strategies", nargs="+", choices=KnowledgeBaseBuilder.CHUNKING_STRATEGIES,
+                        default=list(KnowledgeBaseBuilder.CHUNKING_STRATEGIES))
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[1000],
+                        help="Splitter chunk sizes to try (characters; tokens for 'token')")
+    parser.add_argument("--chunk-overlap", type=int, default=200, help="Capped at half the chunk size")
+    parser.add_argument("--max-chunk-tokens", type=int, default=350)
+    parser.add_argument("--cache-dir", default=".cache/kb_build")
+    args = parser.parse_args()
+
+    questions = [item for item in load_question_set(args.questions) if item.get("expected_source")]
+    if not questions:
+        raise SystemExit("No questions with 'expected_source' found")
+
+    results = []
+    for strategy in args.strategies:
+        if strategy == "structured":
+            configs = [(f"structured/{args.max_chunk_tokens}", {"max_chunk_tokens": args.max_chunk_tokens})]
+        else:
+            configs = [(f"{strategy}/{size}", {"chunk_size": size, "chunk_overlap": min(args.chunk_overlap, size // 2)})
+                       for size in args.chunk_sizes]
+        for label, kwargs in configs:
+            builder = KnowledgeBaseBuilder(chunking=strategy, cache_dir=args.cache_dir, **kwargs)
+            results.append(evaluate(label, builder, args.pdfs_dir, questions, args.k))
+
+    print(f"\n{len(questions)} questions, k={args.k}")
+    print(f"{'strategy':<18}{'chunks':>8}{'chunk tok':>11}{'prompt tok':>12}{'hit@k':>8}{'page hit@k':>12}")
+    for r in results:
+        page_hit = f"{r['page_hit_rate']:.2%}" if r["page_hit_rate"] is not None else "n/a"
+        print(f"{r['strategy']:<18}{r['chunks']:>8}{r['avg_chunk_tokens']:>11.1f}"
+              f"{r['avg_prompt_tokens']:>12.1f}{r['hit_rate']:>8.2%}{page_hit:>12}")
+
+
+if __name__ == "__main__":
+    main()
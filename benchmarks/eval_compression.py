@@ -0,0 +1,115 @@
+"""Measure prompt-token savings of sentence-level context compression against answer quality.
+
+For every knowledge base question of a labelled set (see
+calibrate_threshold.load_question_set), the chunks are retrieved once and the
+RAG answer is generated from the full chunks, from the full chunks again (the
+sampling noise floor) and from the chunks compressed at each --keep ratio.
+Per setting it reports prompt tokens (from the API usage), generation time,
+the share of sentences kept and answer quality. Quality is the embedding cosine
+similarity to the full-context answer and, for questions that have one, to a
+"reference_answer":
+
+    python -m benchmarks.eval_compression questions.jsonl --keep 0.6 0.4 0.25 --window 1
+"""
+import argparse
+import json
+import os
+import uuid
+import numpy as np
+from dotenv import load_dotenv
+from benchmarks.eval_routing import cosine_rows
+from calibrate_threshold import load_question_set
+from llm_scheduler import call_context
+from query_rewriter import expand_abbreviations
+from rag_query import RAGQuery
+from traffic_recorder import get_request_usage
+
+load_dotenv()
+
+
+def run_setting(rag: RAGQuery, retrieved: list, keep: float, window: int) -> list:
+    """Generate every answer with one compression setting (keep=None: full chunks)"""
+    usage = get_request_usage()
+    rag.compress = keep is not None
+    rag.compress_keep = keep or 1.0
+    rag.compress_window = window
+    results = []
+    for query_text, docs in retrieved:
+        request_id = uuid.uuid4().hex
+        with call_context(request=request_id):
+            context = rag.compress_context(query_text, docs)
+            answer = rag.generate(query_text, context)
+        stage = usage.pop(request_id).get("rag", {})
+        compression = rag.last_compression
+        results.append({
+            "answer": answer or "",
+            "prompt_tokens": stage.get("prompt_tokens", 0),
+            "seconds": stage.get("seconds", 0.0),
+            "sentence_share": (compression["sentences_after"] / compression["sentences_before"]
+                               if compression else 1.0)
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate context compression on a question set")
+    parser.add_argument("questions", help="JSON lines question set (see calibrate_threshold.py)")
+    parser.add_argument("--keep", type=float, nargs="+", default=[0.6, 0.4, 0.25],
+                        help="Shares of sentences to keep (RAG_COMPRESS_KEEP values)")
+    parser.add_argument("--window", type=int, default=1, help="Neighbouring sentences kept around each pick")
+    parser.add_argument("--k", type=int, default=6, help="Chunks retrieved per question")
+    parser.add_argument("--index-path", default=os.getenv("RAG_INDEX_PATH", "."))
+    parser.add_argument("--out", help="Write per-question results to this JSON file")
+    args = parser.parse_args()
+
+    questions = [item for item in load_question_set(args.questions) if item["category"]]
+    rag = RAGQuery(index_path=args.index_path, debug=False)
+    if rag.snapshot.sentence_vectors is None:
+        raise SystemExit("This index has no sentence vectors; rebuild it with build_index.py --sentence-vectors")
+
+    # Retrieve once so every setting compresses the same chunks
+    retrieved, used = [], []
+    with rag.pinned_snapshot():
+        for item in questions:
+            query_text = expand_abbreviations(item["question"])
+            scored_docs = rag.retrieve(query_text, category=item["category"], k=args.k)
+            if scored_docs:
+                retrieved.append((query_text, [doc for doc, _ in scored_docs]))
+                used.append(item)
+        print(f"\n{len(retrieved)} of {len(questions)} knowledge base questions retrieved chunks")
+        if not retrieved:
+            return
+
+        settings = [("full", None), ("full (repeat)", None)] + [(f"keep {keep:g}", keep) for keep in args.keep]
+        results = {}
+        for name, keep in settings:
+            print(f"\nGenerating {len(retrieved)} answers with {name}...")
+            results[name] = run_setting(rag, retrieved, keep, args.window)
+
+    vectors = {name: np.array(rag.embeddings.embed_documents([r["answer"] for r in rows]), dtype=np.float32)
+               for name, rows in results.items()}
+    has_reference = [i for i, item in enumerate(used) if item.get("reference_answer")]
+    references = (np.array(rag.embeddings.embed_documents([used[i]["reference_answer"] for i in has_reference]),
+                           dtype=np.float32) if has_reference else None)
+
+    full_tokens = np.mean([r["prompt_tokens"] for r in results["full"]])
+    print(f"\n{len(retrieved)} questions, window {args.window}; agreement = similarity to the full-context answer")
+    print(f"{'setting':<16}{'prompt tok':>11}{'saved':>8}{'gen s':>8}{'sentences':>11}{'agree':>8}{'vs ref':>8}")
+    for name, rows in results.items():
+        tokens = np.mean([r["prompt_tokens"] for r in rows])
+        agreement = cosine_rows(vectors[name], vectors["full"]).mean()
+        reference = (f"{cosine_rows(vectors[name][has_reference], references).mean():>8.3f}"
+                     if has_reference else f"{'-':>8}")
+        print(f"{name:<16}{tokens:>11.0f}{1 - tokens / full_tokens if full_tokens else 0.0:>8.0%}"
+              f"{np.mean([r['seconds'] for r in rows]):>8.2f}{np.mean([r['sentence_share'] for r in rows]):>11.0%}"
+              f"{agreement:>8.3f}{reference}")
+    print("A setting whose agreement is close to 'full (repeat)' loses no more than sampling noise")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"questions": used, "results": results}, f, indent=2)
+        print(f"\nWrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
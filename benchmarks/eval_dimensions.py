@@ -0,0 +1,105 @@
+"""Index size, search latency and recall@k at reduced embedding dimensions.
+
+text-embedding-3 vectors can be shortened by truncating and re-normalising,
+which is what the API's `dimensions` parameter does. By default this script
+derives every size from the full-size vectors already stored in the index,
+so only the questions are embedded. Pass --reembed to request each size from
+the API instead. Without --questions, sampled chunks serve as queries; each
+one is left out of its own neighbours so it cannot trivially retrieve itself.
+
+    python -m benchmarks.eval_dimensions --questions questions.jsonl --dims 256 512 1024 1536
+"""
+import argparse
+import os
+import time
+import faiss
+import numpy as np
+from dotenv import load_dotenv
+from langchain_openai import OpenAIEmbeddings
+from langchain_community.vectorstores import FAISS
+from calibrate_threshold import load_question_set
+from index_meta import read_index_meta
+
+load_dotenv()
+
+
+def shorten(vectors: np.ndarray, dim: int) -> np.ndarray:
+    """Truncate to dim and L2-normalise, matching the API's shortened embeddings"""
+    truncated = np.ascontiguousarray(vectors[:, :dim], dtype=np.float32)
+    norms = np.linalg.norm(truncated, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return truncated / norms
+
+
+def timed_search(index, queries: np.ndarray, k: int, exclude_ids=None):
+    """Top-k ids per query, skipping exclude_ids[i] (the query's own chunk) when given"""
+    latencies, results = [], []
+    fetch_k = k + 1 if exclude_ids is not None else k
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), fetch_k)
+        latencies.append(time.perf_counter() - start)
+        if exclude_ids is not None:
+            ids = ids[:, ids[0] != exclude_ids[i]]
+        results.append(ids[0][:k])
+    return np.array(results), np.array(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate embedding dimensionality reduction")
+    parser.add_argument("--index-dir", default=".", help="Full-size index to take chunks from")
+    parser.add_argument("--questions", help="JSON lines question set; default samples stored chunks as queries")
+    parser.add_argument("--sample-queries", type=int, default=200)
+    parser.add_argument("--dims", type=int, nargs="+", default=[256, 512, 1024, 1536])
+    parser.add_argument("--k", type=int, default=6)
+    parser.add_argument("--reembed", action="store_true", help="Embed chunks through the API at each size")
+    args = parser.parse_args()
+
+    meta = read_index_meta(args.index_dir)
+    full_dim = meta["dimensions"]
+    if max(args.dims) > full_dim:
+        raise SystemExit(f"Index has {full_dim} dimensions; cannot evaluate {max(args.dims)}")
+
+    embeddings = OpenAIEmbeddings(model=meta["embeddings_model"], openai_api_key=os.getenv("OPENAI_API_KEY"))
+    store = FAISS.load_local(args.index_dir, embeddings, allow_dangerous_deserialization=True)
+    full_vectors = store.index.reconstruct_n(0, store.index.ntotal)
+    texts = [store.docstore.search(store.index_to_docstore_id[i]).page_content for i in range(store.index.ntotal)]
+
+    picks = None
+    if args.questions:
+        questions = [item["question"] for item in load_question_set(args.questions)]
+        full_queries = np.array(embeddings.embed_documents(questions), dtype=np.float32)
+    else:
+        rng = np.random.default_rng(0)
+        picks = rng.choice(len(full_vectors), size=min(args.sample_queries, len(full_vectors)), replace=False)
+        questions = [texts[i] for i in picks]
+        full_queries = full_vectors[picks]
+
+    baseline_index = faiss.IndexFlatL2(full_dim)
+    baseline_index.add(shorten(full_vectors, full_dim))
+    baseline_ids, _ = timed_search(baseline_index, shorten(full_queries, full_dim), args.k, picks)
+
+    source = "questions" if args.questions else "sampled chunks, self-matches excluded"
+    print(f"\n{len(texts)} chunks, {len(questions)} queries ({source}), k={args.k}, baseline {full_dim} dims")
+    print(f"{'dims':>6}{'index KB':>11}{'mean ms':>10}{'p95 ms':>10}{'recall@k':>10}")
+    for dim in sorted(args.dims):
+        if args.reembed:
+            sized = OpenAIEmbeddings(model=meta["embeddings_model"], dimensions=dim,
+                                     openai_api_key=os.getenv("OPENAI_API_KEY"))
+            doc_vectors = np.array(sized.embed_documents(texts), dtype=np.float32)
+            query_vectors = np.array(sized.embed_documents(questions), dtype=np.float32)
+        else:
+            doc_vectors = shorten(full_vectors, dim)
+            query_vectors = shorten(full_queries, dim)
+
+        index = faiss.IndexFlatL2(dim)
+        index.add(doc_vectors)
+        size_kb = len(faiss.serialize_index(index)) / 1024
+        ids, latencies = timed_search(index, query_vectors, args.k, picks)
+        recall = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(ids, baseline_ids)])
+        print(f"{dim:>6}{size_kb:>11.1f}{latencies.mean() * 1000:>10.3f}"
+              f"{np.percentile(latencies, 95) * 1000:>10.3f}{recall:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
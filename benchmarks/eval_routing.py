@@ -0,0 +1,128 @@
+"""Compare model routing configurations on a labelled question set.
+
+Each configuration is a routing JSON file ({"routes": {...}, "overrides": [...]},
+see model_router.py) or "default" for the built-in routes. Every question is
+run through the full pipeline once per configuration, recording end-to-end
+latency, chat calls and tokens per model, refusals, and how close each answer
+is (embedding cosine similarity) to the first configuration's answer.
+
+    python -m benchmarks.eval_routing --questions questions.jsonl --configs default all_gpt4o.json
+"""
+import argparse
+import json
+import threading
+import time
+from collections import defaultdict
+import numpy as np
+from dotenv import load_dotenv
+from calibrate_threshold import load_question_set, percentile
+from llm_scheduler import get_scheduler
+from main import MedicalQuerySystem
+from model_router import ModelRouter, configure_router, load_routing_config
+from rewrite_cache import RewriteCache
+
+load_dotenv()
+
+REFUSAL_PREFIX = "I apologize"
+
+
+class CallRecorder:
+    """Scheduler observer collecting chat calls per model"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = defaultdict(lambda: {"calls": 0, "failed": 0, "tokens": 0})
+
+    def __call__(self, event: dict):
+        if event.get("kind") != "chat":
+            return
+        usage = getattr(event.get("response"), "usage", None)
+        with self.lock:
+            entry = self.calls[event["model"]]
+            entry["calls"] += 1
+            entry["failed"] += event["error"] is not None
+            entry["tokens"] += getattr(usage, "total_tokens", 0) or 0
+
+    def reset(self) -> dict:
+        with self.lock:
+            calls = {model: dict(entry) for model, entry in self.calls.items()}
+            self.calls.clear()
+            return calls
+
+
+def run_config(system: MedicalQuerySystem, questions: list, role: str, recorder: CallRecorder) -> dict:
+    answers, latencies = [], []
+    for item in questions:
+        system.current_category = item["category"]
+        system.current_role = role
+        for history in system.chat_histories.values():
+            history.clear()
+        start = time.perf_counter()
+        answers.append(system.process_query(item["question"]))
+        latencies.append(time.perf_counter() - start)
+    return {"answers": answers, "latencies": latencies, "calls": recorder.reset()}
+
+
+def cosine_rows(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+    b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+    return np.sum(a * b, axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate model routing configurations offline")
+    parser.add_argument("--questions", required=True, help="JSON lines question set (see calibrate_threshold.py)")
+    parser.add_argument("--configs", nargs="+", default=["default"],
+                        help="Routing JSON files, or 'default'; the first is the agreement baseline")
+    parser.add_argument("--role", default="doctor", choices=["doctor", "sales"])
+    parser.add_argument("--out", help="Write per-question results to this JSON file")
+    args = parser.parse_args()
+
+    questions = load_question_set(args.questions)
+    system = MedicalQuerySystem(debug=False)
+    recorder = CallRecorder()
+    get_scheduler().add_observer(recorder)
+
+    results = {}
+    for name in args.configs:
+        config = {} if name == "default" else load_routing_config(name)
+        router = configure_router(ModelRouter(config.get("routes"), config.get("overrides")))
+        # Fresh rewrite cache so each configuration's rewrite model is actually called
+        system.query_rewriter.cache = RewriteCache()
+        print(f"\nRunning {len(questions)} questions with routing '{name}'...")
+        results[name] = run_config(system, questions, args.role, recorder)
+        results[name]["router"] = router.stats()
+
+    baseline = args.configs[0]
+    vectors = {
+        name: np.array(system.rag.embeddings.embed_documents(result["answers"]), dtype=np.float32)
+        for name, result in results.items()
+    }
+    answerable = np.array([item["answerable"] for item in questions])
+
+    print(f"\n{len(questions)} questions, role={args.role}, agreement vs '{baseline}'")
+    print(f"{'config':<24}{'mean s':>8}{'p50 s':>8}{'p95 s':>8}{'answered':>10}{'refused*':>10}{'agree':>8}")
+    for name, result in results.items():
+        latencies = result["latencies"]
+        refused = np.array([answer.startswith(REFUSAL_PREFIX) for answer in result["answers"]])
+        answered = (~refused[answerable]).mean() if answerable.any() else float("nan")
+        refused_unanswerable = refused[~answerable].mean() if (~answerable).any() else float("nan")
+        agreement = cosine_rows(vectors[name], vectors[baseline]).mean()
+        result["agreement"] = float(agreement)
+        print(f"{name:<24}{np.mean(latencies):>8.2f}{percentile(latencies, 50):>8.2f}"
+              f"{percentile(latencies, 95):>8.2f}{answered:>10.2f}{refused_unanswerable:>10.2f}{agreement:>8.3f}")
+    print("* share of unanswerable questions that were refused")
+
+    print(f"\n{'config':<24}{'model':<16}{'calls':>7}{'failed':>8}{'tokens':>10}")
+    for name, result in results.items():
+        for model, entry in sorted(result["calls"].items()):
+            print(f"{name:<24}{model:<16}{entry['calls']:>7}{entry['failed']:>8}{entry['tokens']:>10}")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"questions": questions, "results": results}, f, indent=2)
+        print(f"\nWrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
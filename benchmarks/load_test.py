@@ -0,0 +1,290 @@
+"""Concurrent-user load test of the chat app against the mock OpenAI API.
+
+Every virtual user logs in, switches modes through the app's mode selector
+(handle_mode_change) and holds a multi-turn conversation with think time
+between turns. Users are driven through Streamlit's AppTest, which runs the
+real app.py script per interaction (--driver system calls MedicalQuerySystem
+directly instead). The load is stepped through increasing user counts and each
+step reports throughput, turn latency percentiles, errors and resident memory
+growth per session. The saturation point is the first step where throughput
+stops growing or p95 latency breaks the SLO.
+
+Runs on one Linux box with no API key or network access: the synthetic index
+is embedded with the hash backend, and without tiktoken's encoding files the
+scheduler estimates tokens from character counts. All randomness is seeded:
+
+    python -m benchmarks.load_test --users 1 5 10 20 --turns 4
+    python -m benchmarks.load_test --index-path vector_index --users 10 --chat-latency 2.0
+"""
+import argparse
+import gc
+import os
+import pickle
+import random
+import tempfile
+import threading
+import time
+from benchmarks.mock_openai_server import MockOpenAIServer
+from calibrate_threshold import percentile
+from memory_monitor import rss_bytes
+from single_flight import get_single_flight
+
+MODES = ["General", "IOLs", "CTR"]
+QUESTIONS = {
+    "General": ["What causes {condition}?", "How is {condition} treated?", "Who is at risk of {condition}?"],
+    "IOLs": ["What is the near add of the Precizon Presbyopic NVA?", "How does the Precizon lens handle {topic}?",
+             "Which patients are suited for the Precizon Presbyopic NVA?"],
+    "CTR": ["When is the RingJect {model} indicated?", "What sizes does the CTR Model {model} come in?",
+            "How is a CTR inserted in eyes with {condition}?"]
+}
+FOLLOW_UPS = ["Can you explain that in more detail?", "What are the risks?", "How does it compare to alternatives?"]
+FILL = {
+    "condition": ["glaucoma", "cataract", "zonular weakness", "pseudoexfoliation", "presbyopia", "myopia"],
+    "topic": ["dysphotopsia", "decentration", "contrast sensitivity", "night vision"],
+    "model": ["376", "375", "275 12/10", "276 13/11"]
+}
+SYNTHETIC_VOCAB = ("capsular tension ring zonular haptic optic lens implant cataract surgery bag support eyelet "
+                   "RingJect injector diameter compression presbyopia near addition Precizon refractive segment "
+                   "transitional focus visual acuity contrast glare halo centration tilt PMMA hydrophilic").split()
+
+
+def build_synthetic_index(path: str, chunks_per_category: int = 200, seed: int = 0):
+    """Small FAISS index of generated ophthalmology text, embedded with the offline hash backend.
+
+    Queries against it are embedded with the same backend, so no embedding call
+    (and no tiktoken download for OpenAIEmbeddings' length checks) needs the network.
+    """
+    from langchain_community.vectorstores import FAISS
+    from embedding_backends import DEFAULT_EMBEDDING_MODELS, make_embeddings
+    from index_meta import write_index_meta
+
+    rng = random.Random(seed)
+    texts, metadatas = [], []
+    for category in ("ctr", "iols"):
+        for i in range(chunks_per_category):
+            texts.append(" ".join(rng.choice(SYNTHETIC_VOCAB) for _ in range(rng.randint(60, 160))))
+            metadatas.append({"source": f"synthetic/{category}-{i // 20}.pdf", "category": category,
+                              "filename": f"{category}-{i // 20}.pdf"})
+    store = FAISS.from_texts(texts, make_embeddings("hash"), metadatas=metadatas)
+    store.save_local(path)
+    with open(os.path.join(path, "metadata.pkl"), "wb") as f:
+        pickle.dump(metadatas, f)
+    write_index_meta(path, {"embeddings_backend": "hash", "embeddings_model": DEFAULT_EMBEDDING_MODELS["hash"],
+                            "dimensions": store.index.d,
+                            "shortened": False, "chunking": "synthetic", "num_chunks": len(texts)})
+
+
+def user_script(rng: random.Random, turns: int, switch_probability: float) -> list:
+    """[(mode or None, question)] for one conversation; a mode means switch before asking"""
+    script, mode = [], None
+    for turn in range(turns):
+        switch = None
+        if mode is None or rng.random() < switch_probability:
+            switch = rng.choice([m for m in MODES if m != mode])
+            mode = switch
+        if turn and switch is None and rng.random() < 0.5:
+            question = rng.choice(FOLLOW_UPS)
+        else:
+            template = rng.choice(QUESTIONS[mode])
+            question = template.format(**{key: rng.choice(values) for key, values in FILL.items()})
+        script.append((switch, question))
+    return script
+
+
+class AppUser:
+    """One browser session driven through AppTest"""
+
+    # AppTest's script setup (secrets, first run) isn't safe to do concurrently
+    setup_lock = threading.Lock()
+
+    def __init__(self, name: str, role: str):
+        from streamlit.testing.v1 import AppTest
+        app_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+        with self.setup_lock:
+            self.at = AppTest.from_file(app_path, default_timeout=600)
+            self.at.secrets["LOAD_TEST"] = "1"
+            self.at.run()
+        self.at.text_input(key="name").input(name)
+        self.at.selectbox(key="role").select(role)
+        self.at.button(key="start_chat").click().run()
+        self._check()
+
+    def _check(self):
+        if self.at.exception:
+            raise RuntimeError(self.at.exception[0].message)
+
+    def switch_mode(self, mode: str):
+        self.at.selectbox(key="mode_selector").select(mode).run()
+        self._check()
+
+    def ask(self, question: str) -> str:
+        self.at.chat_input[0].set_value(question).run()
+        self._check()
+        return self.at.session_state.messages[-1]["content"]
+
+
+class SystemUser:
+    """One session calling MedicalQuerySystem directly (no Streamlit)"""
+
+    def __init__(self, name: str, role: str):
+        from main import MedicalQuerySystem
+        self.system = MedicalQuerySystem(debug=False)
+        self.system.switch_role("role sales" if role == "Sales Rep" else "role doctor")
+
+    def switch_mode(self, mode: str):
+        self.system.switch_category({"General": "switch gen", "IOLs": "switch iols", "CTR": "switch ctr"}[mode])
+
+    def ask(self, question: str) -> str:
+        return self.system.process_query(question)
+
+
+def run_user(index: int, driver, args, results: list, lock: threading.Lock, sessions: list):
+    rng = random.Random(args.seed * 100003 + index)
+    try:
+        user = driver(f"user{index}", rng.choice(["Sales Rep", "Ophthalmologist"]))
+    except Exception as e:
+        with lock:
+            results.append({"ok": False, "latency": 0.0, "error": f"login: {e}"})
+        return
+    with lock:
+        sessions.append(user)
+    for switch, question in user_script(rng, args.turns, args.switch_probability):
+        time.sleep(rng.expovariate(1 / args.think_time) if args.think_time > 0 else 0)
+        start = time.perf_counter()
+        try:
+            if switch:
+                user.switch_mode(switch)
+            answer = user.ask(question)
+            ok, error = bool(answer), None
+        except Exception as e:
+            ok, error = False, str(e)
+        with lock:
+            results.append({"ok": ok, "latency": time.perf_counter() - start, "error": error})
+
+
+def run_step(users: int, driver, args) -> dict:
+    gc.collect()
+    rss_before = rss_bytes()
+    results, sessions, lock = [], [], threading.Lock()
+    threads = [threading.Thread(target=run_user, args=(i, driver, args, results, lock, sessions), daemon=True)
+               for i in range(users)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+        time.sleep(args.ramp_seconds / max(1, users))
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    rss_after = rss_bytes()
+
+    latencies = [r["latency"] for r in results if r["ok"]]
+    errors = [r["error"] for r in results if not r["ok"]]
+    return {
+        "users": users,
+        "turns": len(results),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "rss_mb_per_session": (rss_after - rss_before) / max(1, len(sessions)) / 2 ** 20,
+        "rss_mb": rss_after / 2 ** 20
+    }
+
+
+def saturation_point(steps: list, slo_p95: float, min_gain: float = 0.1):
+    """First user count whose p95 breaks the SLO or whose throughput grows by less than min_gain"""
+    for previous, step in zip([None] + steps[:-1], steps):
+        if step["p95"] > slo_p95 or step["errors"]:
+            return step["users"], f"p95 {step['p95']:.1f}s > {slo_p95:.1f}s SLO" if step["p95"] > slo_p95 else "errors"
+        if previous and step["throughput"] < previous["throughput"] * (1 + min_gain):
+            return step["users"], "throughput stopped growing"
+    return None, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-user load test against the mock OpenAI API")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 5, 10, 20], help="Concurrent users per step")
+    parser.add_argument("--turns", type=int, default=4, help="Questions per user")
+    parser.add_argument("--think-time", type=float, default=2.0, help="Mean seconds between a user's turns")
+    parser.add_argument("--switch-probability", type=float, default=0.3, help="Chance of a mode switch per turn")
+    parser.add_argument("--ramp-seconds", type=float, default=2.0, help="Spread user starts over this long")
+    parser.add_argument("--driver", choices=["app", "system"], default="app")
+    parser.add_argument("--index-path", help="Index to query (default: a generated synthetic index)")
+    parser.add_argument("--chat-latency", type=float, default=1.5, help="Mean gpt-4o latency in seconds")
+    parser.add_argument("--mini-latency", type=float, default=0.6, help="Mean gpt-4o-mini latency in seconds")
+    parser.add_argument("--embedding-latency", type=float, default=0.15,
+                        help="Mock embedding latency (only an --index-path built with OpenAI embeddings calls it)")
+    parser.add_argument("--jitter", type=float, default=0.35, help="Log-normal sigma of mock latencies")
+    parser.add_argument("--server-rpm", type=int, default=0, help="Mock per-model request limit (0 = none)")
+    parser.add_argument("--slo-p95", type=float, default=10.0, help="p95 turn latency considered saturated")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(chat_latency=args.chat_latency, embedding_latency=args.embedding_latency,
+                              jitter=args.jitter, rpm=args.server_rpm, seed=args.seed,
+                              model_latency={"gpt-4o": args.chat_latency, "gpt-4o-mini": args.mini_latency}).start()
+    workdir = tempfile.mkdtemp(prefix="load-test-")
+    os.environ.update({
+        "OPENAI_API_KEY": "sk-mock",
+        "OPENAI_BASE_URL": server.base_url,
+        "OPENAI_API_BASE": server.base_url,
+        "SESSION_DB": os.path.join(workdir, "sessions.db"),
+        "INDEX_WATCH_INTERVAL": "0",
+        # The app answers opening questions from the answer bank; measure the pipeline instead
+        "ANSWER_BANK": "false"
+    })
+    if args.index_path:
+        os.environ["RAG_INDEX_PATH"] = args.index_path
+    else:
+        index_path = os.path.join(workdir, "index")
+        print(f"Building synthetic index in {index_path}...")
+        build_synthetic_index(index_path, seed=args.seed)
+        os.environ["RAG_INDEX_PATH"] = index_path
+        # Hashed mock embeddings are far apart; let synthetic chunks through the cutoff
+        os.environ.setdefault("RAG_MAX_DISTANCE", "2.0")
+
+    driver = AppUser if args.driver == "app" else SystemUser
+    steps = []
+    try:
+        # Imports, index load and caches are one-off costs; keep them out of the per-session numbers
+        print("Warming up...")
+        driver("warmup", "Sales Rep").ask("What is a capsular tension ring?")
+        for users in args.users:
+            print(f"\nStep: {users} concurrent users x {args.turns} turns ({args.driver} driver)...")
+            step = run_step(users, driver, args)
+            steps.append(step)
+            print(f"  {step['throughput']:.2f} turns/s, p95 {step['p95']:.2f}s, {step['errors']} errors")
+    finally:
+        server_stats = server.stats
+        server.stop()
+
+    from llm_scheduler import get_scheduler
+    scheduler_stats = get_scheduler().stats()
+
+    print(f"\n{'users':>6}{'turns':>7}{'errors':>8}{'turns/s':>9}{'p50 s':>8}{'p95 s':>8}{'p99 s':>8}"
+          f"{'MB/session':>12}{'RSS MB':>9}")
+    for s in steps:
+        print(f"{s['users']:>6}{s['turns']:>7}{s['errors']:>8}{s['throughput']:>9.2f}{s['p50']:>8.2f}"
+              f"{s['p95']:>8.2f}{s['p99']:>8.2f}{s['rss_mb_per_session']:>12.2f}{s['rss_mb']:>9.0f}")
+    for s in steps:
+        if s["first_error"]:
+            print(f"First error at {s['users']} users: {s['first_error']}")
+
+    users, reason = saturation_point(steps, args.slo_p95)
+    if users is None:
+        print(f"\nNo saturation up to {steps[-1]['users']} users")
+    else:
+        print(f"\nSaturation at {users} users: {reason}")
+    print(f"Mock API: {server_stats.get('chat', 0)} chat, {server_stats.get('embeddings', 0)} embedding requests, "
+          f"{server_stats.get('rate_limited', 0)} answered 429")
+    coalesced = get_single_flight().stats()
+    print(f"Coalesced: {coalesced['shared']} identical calls shared {coalesced['calls']} underlying ones")
+    print(f"Scheduler max queue depth: {scheduler_stats['max_queue_depth']}, waits: "
+          + ", ".join(f"{name} p95 {w['p95']:.2f}s" for name, w in scheduler_stats["wait_seconds"].items()))
+
+
+if __name__ == "__main__":
+    main()
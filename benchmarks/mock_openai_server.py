@@ -0,0 +1,287 @@
+"""Local stand-in for the OpenAI chat completions and embeddings endpoints.
+
+Responses are deterministic, latency is simulated and 429s are returned when
+a per-model request rate is exceeded (or at random with --error-rate). Repeated
+prompt prefixes are reported as cached tokens, like OpenAI's prompt caching, so
+rate-limit handling and load behaviour can be exercised without an API key:
+
+    python -m benchmarks.mock_openai_server --port 8089 --rpm 120 --error-rate 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=sk-mock streamlit run app.py
+"""
+import argparse
+import base64
+import hashlib
+import json
+import math
+import random
+import re
+import struct
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMBEDDING_DIMENSIONS = 1536
+
+
+def approx_tokens(text: str) -> int:
+    return max(1, int(len(text.split()) * 1.3))
+
+
+def hashed_embedding(tokens: list, dimensions: int) -> list:
+    """Feature-hashed bag of tokens, L2-normalised; shared words give similar vectors"""
+    vector = [0.0] * dimensions
+    for token in tokens:
+        digest = hashlib.md5(str(token).lower().encode("utf-8")).digest()
+        index = int.from_bytes(digest[:4], "little") % dimensions
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def mock_chat_content(messages: list, completion_words: int) -> str:
+    """A plausible reply for each prompt the app sends"""
+    prompt = messages[-1].get("content", "") if messages else ""
+    if any("RELEVANT: YES/NO" in m.get("content", "") for m in messages):
+        return "RELEVANT: YES"
+    if "Rewritten question" in prompt or "Expanded question" in prompt:
+        questions = re.findall(r"Question: (.*)", prompt)
+        return questions[-1].strip() if questions else prompt.strip()
+    seed = int(hashlib.md5(prompt.encode("utf-8")).hexdigest()[:8], 16)
+    rng = random.Random(seed)
+    words = re.findall(r"[A-Za-z]{4,}", prompt) or ["ophthalmology"]
+    return "Mock answer: " + " ".join(rng.choice(words) for _ in range(completion_words))
+
+
+class MockState:
+    """Server configuration, per-model request windows and counters"""
+
+    def __init__(self, chat_latency: float = 0.8, embedding_latency: float = 0.05, jitter: float = 0.3,
+                 rpm: int = 0, error_rate: float = 0.0, retry_after: float = 1.0, completion_words: int = 120,
+                 seed: int = 0, model_latency: dict = None, cache_min_tokens: int = 1024,
+                 cache_speedup: float = 0.5):
+        self.chat_latency = chat_latency
+        # Mean chat latency per model, overriding chat_latency (e.g. a slow gpt-4o)
+        self.model_latency = model_latency or {}
+        self.embedding_latency = embedding_latency
+        self.jitter = jitter
+        self.rpm = rpm
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.completion_words = completion_words
+        self.random = random.Random(seed)
+        # Prompt prefix caching like OpenAI's: prefixes from cache_min_tokens up, in 128-token steps
+        self.cache_min_tokens = cache_min_tokens
+        self.cache_speedup = cache_speedup
+        self.prefix_cache = defaultdict(set)
+        self.lock = threading.Lock()
+        self.windows = defaultdict(list)
+        self.counters = defaultdict(int)
+
+    def sample_latency(self, mean: float) -> float:
+        with self.lock:
+            if mean <= 0:
+                return 0.0
+            if self.jitter <= 0:
+                return mean
+            # Log-normal with the requested mean
+            sigma = self.jitter
+            return self.random.lognormvariate(math.log(mean) - sigma * sigma / 2, sigma)
+
+    def cached_prompt_tokens(self, model: str, messages: list) -> int:
+        """Tokens of the longest previously seen prompt prefix (words stand in for tokens)"""
+        words = []
+        for message in messages:
+            words.append(message.get("role", ""))
+            words.extend(str(message.get("content", "")).split())
+        min_words = max(1, int(self.cache_min_tokens / 1.3))
+        digest = hashlib.sha1()
+        boundaries = []
+        for i, word in enumerate(words, 1):
+            digest.update(word.encode("utf-8") + b"\0")
+            if i >= min_words and (i - min_words) % 128 == 0:
+                boundaries.append((i, digest.hexdigest()))
+        with self.lock:
+            seen = self.prefix_cache[model]
+            cached_words = max((i for i, key in boundaries if key in seen), default=0)
+            seen.update(key for _, key in boundaries)
+        return int(cached_words * 1.3)
+
+    def admit(self, model: str) -> bool:
+        """False when this request should get a 429"""
+        now = time.monotonic()
+        with self.lock:
+            self.counters["requests"] += 1
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.counters["rate_limited"] += 1
+                return False
+            if self.rpm:
+                window = [t for t in self.windows[model] if now - t < 60.0]
+                if len(window) >= self.rpm:
+                    self.windows[model] = window
+                    self.counters["rate_limited"] += 1
+                    return False
+                window.append(now)
+                self.windows[model] = window
+            return True
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict, headers: dict = None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            with self.server.state.lock:
+                self._send_json(200, dict(self.server.state.counters))
+            return
+        self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        state = self.server.state
+        model = request.get("model", "unknown")
+
+        if not state.admit(model):
+            self._send_json(429, {"error": {"message": "Rate limit reached (mock)", "type": "requests",
+                                            "code": "rate_limit_exceeded"}},
+                            headers={"retry-after": str(state.retry_after)})
+            return
+
+        if self.path.endswith("/chat/completions"):
+            self._chat(request, state)
+        elif self.path.endswith("/embeddings"):
+            self._embeddings(request, state)
+        else:
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+    def _chat(self, request: dict, state: MockState):
+        messages = request.get("messages", [])
+        prompt_tokens = sum(approx_tokens(m.get("content", "")) for m in messages)
+        cached_tokens = min(prompt_tokens, state.cached_prompt_tokens(request.get("model"), messages))
+        latency = state.sample_latency(state.model_latency.get(request.get("model"), state.chat_latency))
+        # Cached prefixes skip prefill, modelled as a proportional cut in latency
+        time.sleep(latency * (1 - state.cache_speedup * cached_tokens / prompt_tokens) if prompt_tokens else latency)
+        words = state.completion_words
+        if request.get("max_tokens"):
+            words = min(words, max(1, int(request["max_tokens"] / 1.3)))
+        content = mock_chat_content(messages, words)
+        completion_tokens = approx_tokens(content)
+        with state.lock:
+            state.counters["chat"] += 1
+            state.counters["cached_tokens"] += cached_tokens
+        self._send_json(200, {
+            "id": f"chatcmpl-mock-{state.counters['chat']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model"),
+            "choices": [{"index": 0, "finish_reason": "stop", "logprobs": None,
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens,
+                      "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+        })
+
+    def _embeddings(self, request: dict, state: MockState):
+        time.sleep(state.sample_latency(state.embedding_latency))
+        inputs = request.get("input", [])
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        dimensions = request.get("dimensions") or EMBEDDING_DIMENSIONS
+
+        data, total_tokens = [], 0
+        for i, item in enumerate(inputs):
+            # LangChain sends pre-tokenised input (lists of token ids); plain strings are split on words
+            tokens = item if isinstance(item, list) else re.findall(r"\w+", item)
+            total_tokens += len(tokens)
+            vector = hashed_embedding(tokens, dimensions)
+            if request.get("encoding_format") == "base64":
+                vector = base64.b64encode(struct.pack(f"<{len(vector)}f", *vector)).decode("ascii")
+            data.append({"object": "embedding", "index": i, "embedding": vector})
+        with state.lock:
+            state.counters["embeddings"] += 1
+        self._send_json(200, {"object": "list", "data": data, "model": request.get("model"),
+                              "usage": {"prompt_tokens": total_tokens, "total_tokens": total_tokens}})
+
+
+class MockOpenAIServer:
+    """Run the mock API in a background thread; use as a context manager"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, **state_kwargs):
+        self.httpd = ThreadingHTTPServer((host, port), MockOpenAIHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = MockState(**state_kwargs)
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def stats(self) -> dict:
+        with self.httpd.state.lock:
+            return dict(self.httpd.state.counters)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True, name="mock-openai")
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--chat-latency", type=float, default=0.8, help="Mean seconds per chat completion")
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.3, help="Log-normal sigma of the latency")
+    parser.add_argument("--rpm", type=int, default=0, help="Requests per minute per model before 429 (0 = unlimited)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with a random 429")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--cache-min-tokens", type=int, default=1024,
+                        help="Shortest prompt prefix that is cached")
+    parser.add_argument("--model-latency", nargs="*", default=[], metavar="MODEL=SECONDS",
+                        help="Mean chat latency for specific models, e.g. gpt-4o=4.0")
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(args.host, args.port, chat_latency=args.chat_latency,
+                              embedding_latency=args.embedding_latency, jitter=args.jitter, rpm=args.rpm,
+                              error_rate=args.error_rate, retry_after=args.retry_after,
+                              model_latency={model: float(seconds) for model, seconds in
+                                             (item.split("=", 1) for item in args.model_latency)},
+                              cache_min_tokens=args.cache_min_tokens)
+    print(f"Mock OpenAI API listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
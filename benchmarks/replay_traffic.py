@@ -0,0 +1,244 @@
+"""Replay a recorded traffic log (TRAFFIC_LOG) against the current build and diff the results.
+
+Each recorded session is replayed in order by its own MedicalQuerySystem, with
+queries arriving at their recorded offsets divided by --speed (0 = back to
+back). The LLM backend is the local mock API, with latencies either from flags
+(--backend mock) or per model from the recorded calls (--backend recorded).
+By default the recorded rewrites are reused instead of asking the mock, so
+retrieval differences come from the build (index, chunking, retrieval settings)
+and not from mock rewrites.
+
+The report compares end-to-end and per-stage latency percentiles, tokens per
+stage and retrieval (top-1 agreement, chunk-set overlap, score drift):
+
+    python -m benchmarks.replay_traffic traffic.jsonl --speed 5 --output replay.jsonl
+    python -m benchmarks.replay_traffic traffic.jsonl --index-path vector_index --backend recorded
+    python -m benchmarks.replay_traffic traffic.jsonl --compare replay.jsonl   # diff two logs, no replay
+"""
+import argparse
+import json
+import os
+import statistics
+import threading
+import time
+from collections import defaultdict
+from benchmarks.mock_openai_server import MockOpenAIServer
+from calibrate_threshold import percentile
+from main import MedicalQuerySystem
+from traffic_recorder import is_redacted, read_traffic_log
+
+
+class RecordedRewriter:
+    """Stands in for QueryRewriter, returning the rewrites from the log in order"""
+
+    def __init__(self):
+        self.next_rewrite = None
+
+    def rewrite_query(self, query: str, history: list, category: str = None) -> str:
+        return self.next_rewrite or query
+
+
+def recorded_latencies(records: list) -> dict:
+    """Median seconds per call for each model in the log"""
+    samples = defaultdict(list)
+    for record in records:
+        for stage in (record.get("usage") or {}).values():
+            if stage.get("calls"):
+                samples[stage["model"]].append(stage["seconds"] / stage["calls"])
+    return {model: statistics.median(values) for model, values in samples.items()}
+
+
+def arrival(record: dict) -> float:
+    """When the request arrived (records are written when it finishes)"""
+    return record["timestamp"] - (record.get("elapsed_seconds") or 0.0)
+
+
+def replay(records: list, speed: float, recorded_rewrites: bool) -> list:
+    sessions = defaultdict(list)
+    for record in records:
+        sessions[record["session"]].append(record)
+    first_arrival = min(arrival(record) for record in records)
+    results, lateness, lock = [], [], threading.Lock()
+
+    def run_session(system, session_records):
+        rewriter = RecordedRewriter()
+        if recorded_rewrites:
+            system.query_rewriter = rewriter
+        for record in session_records:
+            if speed > 0:
+                due = start + (arrival(record) - first_arrival) / speed
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    with lock:
+                        lateness.append(-delay)
+            system.current_category = record["category"]
+            system.current_role = record["role"]
+            rewriter.next_rewrite = record.get("rewritten_query")
+            try:
+                system.process_query(record["query"])
+                result = dict(system.last_request, replay_of=record["request_id"])
+            except Exception as e:
+                result = {"replay_of": record["request_id"], "error": str(e), "stages": [], "retrieval": []}
+            with lock:
+                results.append(result)
+
+    # Set every session up before the clock starts so the first arrivals are on time
+    threads = [threading.Thread(target=run_session, args=(MedicalQuerySystem(debug=False), session_records),
+                                daemon=True)
+               for session_records in sessions.values()]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if lateness:
+        print(f"\n⚠️ {len(lateness)} requests started late (max {max(lateness):.2f}s); "
+              f"the replay could not keep up with --speed {speed}")
+    return results
+
+
+def latency_table(baseline: list, candidate: list):
+    def stage_samples(records):
+        samples = defaultdict(list)
+        for record in records:
+            if record.get("elapsed_seconds") is not None:
+                samples["total"].append(record["elapsed_seconds"])
+            for stage in record.get("stages", []):
+                samples[stage["stage"]].append(stage["seconds"])
+        return samples
+
+    base, cand = stage_samples(baseline), stage_samples(candidate)
+    print(f"\n{'stage':<16}{'n':>6}{'p50 base':>10}{'p50 new':>9}{'p95 base':>10}{'p95 new':>9}"
+          f"{'p99 base':>10}{'p99 new':>9}{'Δp95':>8}")
+    for stage in ["total"] + sorted((set(base) | set(cand)) - {"total"}):
+        b, c = base.get(stage, []), cand.get(stage, [])
+        if not b or not c:
+            print(f"{stage:<16}{len(b):>3}/{len(c):<2} only in one log")
+            continue
+        delta = (percentile(c, 95) - percentile(b, 95)) / percentile(b, 95) if percentile(b, 95) else 0.0
+        print(f"{stage:<16}{len(c):>6}{percentile(b, 50):>10.2f}{percentile(c, 50):>9.2f}{percentile(b, 95):>10.2f}"
+              f"{percentile(c, 95):>9.2f}{percentile(b, 99):>10.2f}{percentile(c, 99):>9.2f}{delta:>+8.0%}")
+
+
+def token_table(baseline: list, candidate: list):
+    def totals(records):
+        result = defaultdict(int)
+        for record in records:
+            for stage, usage in (record.get("usage") or {}).items():
+                result[stage] += usage["prompt_tokens"] + usage["completion_tokens"]
+        return result
+
+    base, cand = totals(baseline), totals(candidate)
+    print(f"\n{'stage':<16}{'tokens base':>12}{'tokens new':>12}")
+    for stage in sorted(set(base) | set(cand)):
+        print(f"{stage:<16}{base.get(stage, 0):>12}{cand.get(stage, 0):>12}")
+
+
+def retrieval_diff(pairs: list):
+    compared = [(b, c) for b, c in pairs if b.get("retrieval") or c.get("retrieval")]
+    # Redacted questions embed differently from what was originally asked
+    redacted = [pair for pair in compared if is_redacted(pair[0].get("rewritten_query") or pair[0].get("query"))]
+    compared = [pair for pair in compared if pair not in redacted]
+    if redacted:
+        print(f"\nLeaving {len(redacted)} requests with redacted questions out of the retrieval diff")
+    if not compared:
+        print("\nNo retrieval in either log")
+        return
+    top1 = identical = 0
+    overlaps, score_drift, changed = [], [], []
+    for b, c in compared:
+        b_chunks = [item["chunk"] for item in b.get("retrieval", [])]
+        c_chunks = [item["chunk"] for item in c.get("retrieval", [])]
+        top1 += bool(b_chunks and c_chunks and b_chunks[0] == c_chunks[0])
+        identical += b_chunks == c_chunks
+        union = set(b_chunks) | set(c_chunks)
+        overlaps.append(len(set(b_chunks) & set(c_chunks)) / len(union) if union else 1.0)
+        b_scores = {item["chunk"]: item["score"] for item in b.get("retrieval", [])}
+        score_drift.extend(abs(item["score"] - b_scores[item["chunk"]])
+                           for item in c.get("retrieval", []) if item["chunk"] in b_scores)
+        if b_chunks != c_chunks:
+            changed.append((b.get("rewritten_query") or b.get("query"), len(b_chunks), len(c_chunks), overlaps[-1]))
+
+    n = len(compared)
+    print(f"\nRetrieval over {n} requests: top-1 agreement {top1 / n:.1%}, identical ranking {identical / n:.1%}, "
+          f"mean chunk overlap {sum(overlaps) / n:.2f}, "
+          f"mean score drift {sum(score_drift) / len(score_drift) if score_drift else 0.0:.4f}")
+    for query, b_count, c_count, overlap in sorted(changed, key=lambda item: item[3])[:10]:
+        print(f"  overlap {overlap:.2f} ({b_count} -> {c_count} chunks): {query[:90]}")
+
+
+def compare(baseline: list, candidate: list):
+    by_id = {record["request_id"]: record for record in baseline}
+    pairs = [(by_id[record["replay_of"]], record) for record in candidate if record.get("replay_of") in by_id]
+    if not pairs:
+        # Two replays of the same log: match on what they replayed
+        by_origin = {record.get("replay_of"): record for record in baseline}
+        pairs = [(by_origin[record["replay_of"]], record) for record in candidate
+                 if record.get("replay_of") in by_origin]
+    errors = [record for record in candidate if record.get("error")]
+    print(f"\n{len(baseline)} baseline and {len(candidate)} new requests, {len(pairs)} matched, {len(errors)} failed")
+    latency_table([b for b, _ in pairs], [c for _, c in pairs])
+    token_table([b for b, _ in pairs], [c for _, c in pairs])
+    retrieval_diff(pairs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded traffic and diff latency and retrieval")
+    parser.add_argument("log", help="Traffic log written with TRAFFIC_LOG (rotated files are read too)")
+    parser.add_argument("--compare", help="Diff the log against another log/replay output instead of replaying")
+    parser.add_argument("--speed", type=float, default=1.0, help="Arrival rate multiplier (0 = back to back)")
+    parser.add_argument("--backend", choices=["mock", "recorded"], default="mock",
+                        help="'recorded' takes per-model latencies from the log")
+    parser.add_argument("--rewrites", choices=["recorded", "live"], default="recorded",
+                        help="Reuse logged rewrites, or rewrite again through the backend")
+    parser.add_argument("--index-path", help="Index of the build under test (default: RAG_INDEX_PATH or .)")
+    parser.add_argument("--chat-latency", type=float, default=1.5)
+    parser.add_argument("--embedding-latency", type=float, default=0.15)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--limit", type=int, help="Replay only the first N requests")
+    parser.add_argument("--output", help="Write the replayed requests here (JSON lines)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    records = read_traffic_log(args.log)
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        raise SystemExit(f"No records in {args.log}")
+    if args.compare:
+        compare(records, read_traffic_log(args.compare))
+        return
+
+    model_latency = recorded_latencies(records) if args.backend == "recorded" else {}
+    embedding_latency = args.embedding_latency
+    if model_latency:
+        print("Recorded latency per call: " + ", ".join(f"{m} {s:.2f}s" for m, s in sorted(model_latency.items())))
+        embedding_latency = max((seconds for model, seconds in model_latency.items()
+                                 if model.startswith("text-embedding")), default=embedding_latency)
+    server = MockOpenAIServer(chat_latency=args.chat_latency, embedding_latency=embedding_latency,
+                              jitter=args.jitter, seed=args.seed, model_latency=model_latency).start()
+    os.environ.update({"OPENAI_API_KEY": "sk-mock", "OPENAI_BASE_URL": server.base_url,
+                       "OPENAI_API_BASE": server.base_url, "INDEX_WATCH_INTERVAL": "0"})
+    # Never mix replayed requests into the production log
+    os.environ.pop("TRAFFIC_LOG", None)
+    if args.index_path:
+        os.environ["RAG_INDEX_PATH"] = args.index_path
+
+    sessions = len({record["session"] for record in records})
+    print(f"Replaying {len(records)} requests from {sessions} sessions at {args.speed}x...")
+    try:
+        results = replay(records, args.speed, args.rewrites == "recorded")
+    finally:
+        server.stop()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    compare(records, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Drive the LLM scheduler against the mock server while it returns 429s.
+
+Interactive and batch callers compete for a rate-limited model. The run
+fails (exit code 1) if any call is lost or batch traffic is admitted ahead
+of interactive traffic on average:
+
+    python -m benchmarks.scheduler_harness --interactive 10 --batch 20 --server-rpm 60
+"""
+import argparse
+import sys
+import threading
+import time
+from openai import OpenAI
+from benchmarks.mock_openai_server import MockOpenAIServer
+from llm_scheduler import (LLMScheduler, configure_scheduler, chat_completion, call_context,
+                           PRIORITY_INTERACTIVE, PRIORITY_BATCH)
+
+MODEL = "gpt-4o"
+
+
+def worker(client, priority: int, calls: int, results: list, lock: threading.Lock):
+    with call_context(priority=priority, stage="harness"):
+        for i in range(calls):
+            start = time.monotonic()
+            try:
+                chat_completion(client, model=MODEL, max_tokens=50,
+                                messages=[{"role": "user", "content": f"Question {i}: what is a capsular tension ring?"}])
+                ok = True
+            except Exception as e:
+                print(f"Call failed: {type(e).__name__}: {e}")
+                ok = False
+            with lock:
+                results.append((priority, ok, time.monotonic() - start))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scheduler test harness with a 429-returning mock server")
+    parser.add_argument("--interactive", type=int, default=10, help="Interactive caller threads")
+    parser.add_argument("--batch", type=int, default=20, help="Batch caller threads")
+    parser.add_argument("--calls", type=int, default=2, help="Calls per thread")
+    parser.add_argument("--server-rpm", type=int, default=60, help="Mock server limit before 429")
+    parser.add_argument("--client-rpm", type=int, default=90,
+                        help="Scheduler's request budget; above --server-rpm to force 429s")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="Extra random 429s")
+    parser.add_argument("--latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    scheduler = configure_scheduler(LLMScheduler(
+        limits={MODEL: {"rpm": args.client_rpm, "tpm": 1000000}},
+        max_retries=8,
+        base_delay=0.2,
+        max_delay=5.0
+    ))
+
+    with MockOpenAIServer(chat_latency=args.latency, rpm=args.server_rpm, error_rate=args.error_rate,
+                          retry_after=0.5, completion_words=20) as server:
+        client = OpenAI(api_key="sk-mock", base_url=server.base_url, max_retries=0)
+        results, lock = [], threading.Lock()
+        # Batch callers start first so interactive ones have to overtake a queue
+        threads = [threading.Thread(target=worker, args=(client, PRIORITY_BATCH, args.calls, results, lock))
+                   for _ in range(args.batch)]
+        threads += [threading.Thread(target=worker, args=(client, PRIORITY_INTERACTIVE, args.calls, results, lock))
+                    for _ in range(args.interactive)]
+
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+            time.sleep(0.005)
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+        server_stats = server.stats
+
+    stats = scheduler.stats()
+    failures = sum(1 for _, ok, _ in results if not ok)
+    print(f"\n{len(results)} calls in {elapsed:.1f}s ({len(results) / elapsed:.1f}/s), {failures} failed")
+    print(f"Server: {server_stats.get('requests', 0)} requests, {server_stats.get('rate_limited', 0)} answered 429")
+    print(f"Scheduler counters: {stats['counters']}")
+    print(f"Max queue depth: {stats['max_queue_depth']}")
+    for name, waits in stats["wait_seconds"].items():
+        print(f"  {name:<12} admission wait mean {waits['mean']:.2f}s  p95 {waits['p95']:.2f}s  max {waits['max']:.2f}s")
+    for priority, name in [(PRIORITY_INTERACTIVE, "interactive"), (PRIORITY_BATCH, "batch")]:
+        latencies = sorted(latency for p, ok, latency in results if p == priority and ok)
+        if latencies:
+            print(f"  {name:<12} end-to-end p50 {latencies[len(latencies) // 2]:.2f}s  "
+                  f"p95 {latencies[int(0.95 * (len(latencies) - 1))]:.2f}s")
+
+    problems = []
+    if failures:
+        problems.append(f"{failures} calls failed after retries")
+    waits = stats["wait_seconds"]
+    if "interactive" in waits and "batch" in waits and waits["interactive"]["mean"] > waits["batch"]["mean"]:
+        problems.append("interactive calls waited longer than batch calls")
+    if problems:
+        print("\nFAILED: " + "; ".join(problems))
+        sys.exit(1)
+    print("\nPASSED")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""Memory soak test: thousands of simulated turns against the mock OpenAI API, flagging growth.
+
+Sessions come and go: --concurrency workers each open a session, hold a
+--turns-per-session conversation (the load test's question mix, no think
+time) and drop it. Every --sample-every turns the soak collects garbage, trims
+the heap and samples RSS and tracemalloc-traced memory (memory_monitor.py).
+After warm-up and the first --settle-turns, both are fitted against turns;
+bounded caches are shrunk so they fill while settling. The run is flagged when
+traced memory grows faster than --max-growth-kb-per-turn, RSS faster than
+--max-rss-growth-kb-per-turn (it also creeps as the allocator fragments), or
+when sessions stay alive after being dropped. The largest allocation growth sites and the memory
+report are printed either way. Exit status is 1 when flagged:
+
+    python -m benchmarks.soak_test --turns 5000
+    python -m benchmarks.soak_test --driver app --turns 1000 --index-path vector_index
+"""
+import argparse
+import gc
+import os
+import random
+import tempfile
+import threading
+import time
+import numpy as np
+from benchmarks.load_test import AppUser, SystemUser, build_synthetic_index, user_script
+from benchmarks.mock_openai_server import MockOpenAIServer
+from memory_monitor import format_report, get_memory_monitor, trim_heap
+
+
+def run_session(index: int, driver, args) -> int:
+    """One conversation from login to drop; returns the turns it answered"""
+    rng = random.Random(args.seed * 100003 + index)
+    user = driver(f"soak{index}", rng.choice(["Sales Rep", "Ophthalmologist"]))
+    answered = 0
+    for switch, question in user_script(rng, args.turns_per_session, args.switch_probability):
+        if switch:
+            user.switch_mode(switch)
+        if user.ask(question):
+            answered += 1
+    return answered
+
+
+def slope_per_turn(samples: list, key: str):
+    points = [(s["turns"], s[key]) for s in samples if s[key] is not None]
+    if len(points) < 3:
+        return None
+    turns, values = np.array(points, dtype=np.float64).T
+    return float(np.polyfit(turns, values, 1)[0]) if np.ptp(turns) > 0 else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory soak test against the mock OpenAI API")
+    parser.add_argument("--turns", type=int, default=3000, help="Total questions to ask")
+    parser.add_argument("--turns-per-session", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=4, help="Sessions alive at once")
+    parser.add_argument("--switch-probability", type=float, default=0.3)
+    parser.add_argument("--driver", choices=["app", "system"], default="system")
+    parser.add_argument("--index-path", help="Index to query (default: a generated synthetic index)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Mock API latency in seconds")
+    parser.add_argument("--sample-every", type=int, default=200, help="Turns between memory samples")
+    parser.add_argument("--settle-turns", type=int, default=500,
+                        help="Turns before growth is measured (caches filling up)")
+    parser.add_argument("--max-growth-kb-per-turn", type=float, default=1.0,
+                        help="Limit for tracemalloc-traced memory (Python objects)")
+    parser.add_argument("--max-rss-growth-kb-per-turn", type=float, default=8.0,
+                        help="Limit for RSS, which also creeps with allocator fragmentation")
+    parser.add_argument("--trace-frames", type=int, default=1, help="tracemalloc depth (0 = RSS only)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(chat_latency=args.latency, embedding_latency=args.latency, jitter=0,
+                              seed=args.seed).start()
+    workdir = tempfile.mkdtemp(prefix="soak-test-")
+    os.environ.update({
+        "OPENAI_API_KEY": "sk-mock",
+        "OPENAI_BASE_URL": server.base_url,
+        "OPENAI_API_BASE": server.base_url,
+        "SESSION_DB": os.path.join(workdir, "sessions.db"),
+        "INDEX_WATCH_INTERVAL": "0",
+        # The app answers opening questions from the answer bank; exercise the pipeline instead
+        "ANSWER_BANK": "false",
+        # Sessions register with the process-wide monitor; the soak takes its own samples
+        "MEMORY_PROFILE": "true",
+        "MEMORY_TRACE_FRAMES": str(args.trace_frames),
+        "MEMORY_SAMPLE_SECONDS": "0"
+    })
+    # Bounded caches sized for an hour of production traffic would still be filling up during a
+    # soak of a few minutes; shrink them so they fill while settling and only unbounded growth shows
+    os.environ.setdefault("USAGE_MAX_RECORDS", "1000")
+    os.environ.setdefault("REWRITE_CACHE_SIZE", "256")
+    # Session usage totals are kept for the budget window after the session's last call
+    os.environ.setdefault("USAGE_WINDOW_SECONDS", "60")
+    if args.index_path:
+        os.environ["RAG_INDEX_PATH"] = args.index_path
+    else:
+        index_path = os.path.join(workdir, "index")
+        print(f"Building synthetic index in {index_path}...")
+        build_synthetic_index(index_path, seed=args.seed)
+        os.environ["RAG_INDEX_PATH"] = index_path
+        os.environ.setdefault("RAG_MAX_DISTANCE", "2.0")
+
+    monitor = get_memory_monitor()
+    driver = AppUser if args.driver == "app" else SystemUser
+
+    print("Warming up...")
+    run_session(-1, driver, args)
+    gc.collect()
+    monitor.mark_baseline()
+
+    samples, errors, lock = [], [], threading.Lock()
+    state = {"turns": 0, "sessions": 0, "next_sample": 0}
+
+    def take_sample():
+        gc.collect()
+        # Freed memory glibc keeps in its arenas is not growth
+        trim_heap()
+        sample = monitor.sample()
+        samples.append(dict(sample, turns=state["turns"]))
+        print(f"  {state['turns']:>6} turns  RSS {sample['rss_bytes'] / 2 ** 20:7.1f} MB  traced "
+              f"{(sample['traced_bytes'] or 0) / 2 ** 20:7.1f} MB  {sample['sessions']} live sessions")
+
+    def worker():
+        while True:
+            with lock:
+                if state["turns"] >= args.turns:
+                    return
+                index = state["sessions"]
+                state["sessions"] += 1
+            try:
+                answered = run_session(index, driver, args)
+            except Exception as e:
+                answered = 0
+                with lock:
+                    errors.append(str(e))
+            with lock:
+                state["turns"] += max(answered, 1)
+                if state["turns"] >= state["next_sample"]:
+                    state["next_sample"] = state["turns"] + args.sample_every
+                    take_sample()
+
+    print(f"Soaking: {args.turns} turns, {args.concurrency} concurrent sessions of {args.turns_per_session} "
+          f"turns ({args.driver} driver)")
+    start = time.perf_counter()
+    try:
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        take_sample()
+        report = monitor.report()
+    finally:
+        server.stop()
+
+    measured = [s for s in samples if s["turns"] >= args.settle_turns]
+    flags = []
+    print(f"\n{state['turns']} turns in {state['sessions']} sessions, {elapsed:.0f}s, {len(errors)} failed sessions")
+    for key in ("rss_bytes", "traced_bytes"):
+        slope = slope_per_turn(measured, key)
+        if slope is None:
+            print(f"{key.replace('_bytes', '')}: not enough samples after {args.settle_turns} turns")
+            continue
+        print(f"{key.replace('_bytes', '')} growth: {slope / 1024:.2f} KB/turn "
+              f"({slope * 1000 / 2 ** 20:.1f} MB per 1000 turns)")
+        limit = args.max_rss_growth_kb_per_turn if key == "rss_bytes" else args.max_growth_kb_per_turn
+        if slope / 1024 > limit:
+            flags.append(f"{key.replace('_bytes', '')} grows {slope / 1024:.2f} KB/turn (limit {limit})")
+    if samples[-1]["sessions"] > 0:
+        # Every soak session has been dropped; whatever is still tracked is being kept alive
+        flags.append(f"{samples[-1]['sessions']} dropped sessions are still alive")
+    if errors:
+        print(f"First error: {errors[0]}")
+
+    print("\n" + format_report(report))
+    if flags:
+        print("\n🚩 Memory growth flagged:\n  " + "\n  ".join(flags))
+        raise SystemExit(1)
+    print("\n✅ No memory growth above the limits")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import argparse
+import json
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from answer_bank import AnswerBank, index_identity
+from llm_scheduler import PRIORITY_BATCH, call_context
+from main import MedicalQuerySystem
+from single_flight import normalize_text
+from traffic_recorder import is_redacted, read_traffic_log
+
+load_dotenv()
+
+DEFAULT_ROLES = ("doctor", "sales")
+CATEGORY_ALIASES = {"iol": "iols", "iols": "iols", "ctr": "ctr", "gen": None, "general": None, None: None}
+# Error, refusal and "not in the knowledge base" answers all start like this; they are never banked
+REFUSAL_PREFIX = "I apologize"
+
+
+def load_questions(path: str) -> list:
+    """Curated questions as JSON lines: {"question": ..., "category": "ctr" | "iols" | null}"""
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                questions.append({"question": item["question"],
+                                  "category": CATEGORY_ALIASES[item.get("category")]})
+    return questions
+
+
+def mine_questions(traffic_log: str, min_count: int = 3, top: int = 200) -> list:
+    """The most frequent opening questions per category in a traffic log (TRAFFIC_LOG).
+
+    Only the first question of each session in each category is counted, since
+    later ones depend on the conversation; redacted questions are skipped.
+    """
+    counts, wording = Counter(), {}
+    opened = set()
+    for record in read_traffic_log(traffic_log):
+        scope = (record["session"], record["category"])
+        if scope in opened:
+            continue
+        opened.add(scope)
+        if is_redacted(record["query"]):
+            continue
+        key = (normalize_text(record["query"]), record["category"])
+        counts[key] += 1
+        wording.setdefault(key, Counter())[record["query"].strip()] += 1
+    return [{"question": wording[key].most_common(1)[0][0], "category": key[1]}
+            for key, count in counts.most_common(top) if count >= min_count]
+
+
+def build_answer_bank(index_path: str, questions: list, roles=DEFAULT_ROLES, workers: int = 4,
+                      output_dir: str = None) -> AnswerBank:
+    """Run every question through the full pipeline for every role and save the answers
+    next to the index they were built from (or in output_dir).
+
+    Calls run at batch priority so they queue behind interactive traffic.
+    """
+    local = threading.local()
+
+    def answer(question: dict, role: str):
+        system = getattr(local, "system", None)
+        if system is None:
+            system = local.system = MedicalQuerySystem(debug=False, index_path=index_path, answer_bank=False)
+            system.traffic_recorder = None
+        system.chat_histories = {category: [] for category in system.chat_histories}
+        system.current_category = question["category"]
+        system.current_role = role
+        with call_context(priority=PRIORITY_BATCH):
+            response = system.process_query(question["question"])
+            trace = system.last_trace
+            if (not response or response.startswith(REFUSAL_PREFIX) or trace["degradations"]
+                    or any(stage["failed"] for stage in trace["stages"])):
+                print(f"⏭️ Not banking ({role}): {question['question']}")
+                return None
+            with call_context(stage="answer_bank"):
+                vector = system.rag.embed_query(question["question"])
+        entry = {"question": question["question"], "category": question["category"], "role": role,
+                 "rewritten_query": system.last_rewritten_query, "answer": response}
+        return entry, vector, system.rag.snapshot
+
+    jobs = [(question, role) for question in questions for role in roles]
+    print(f"\n📦 Building answer bank: {len(questions)} questions x {len(roles)} roles")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = [result for result in executor.map(lambda job: answer(*job), jobs) if result is not None]
+
+    if not results:
+        raise ValueError("No question produced a bankable answer")
+    snapshot = results[0][2]
+    if any(result[2] is not snapshot for result in results):
+        raise ValueError("The index changed while the answer bank was being built; run it again")
+    bank = AnswerBank(index_identity(snapshot.path, snapshot.index_meta),
+                      [entry for entry, _, _ in results], [vector for _, vector, _ in results])
+    bank.save(output_dir or snapshot.path)
+    print(f"📦 Answer bank for index {bank.index_version}: {len(bank)} of {len(jobs)} answers banked "
+          f"in {output_dir or snapshot.path}")
+    return bank
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute answers to common questions for the active index")
+    parser.add_argument("questions", nargs="?", help="JSON lines of {question, category} to answer")
+    parser.add_argument("--from-traffic", help="Mine the most frequent opening questions from a traffic log")
+    parser.add_argument("--min-count", type=int, default=3, help="Times a mined question must have been asked")
+    parser.add_argument("--top", type=int, default=200, help="Most frequent mined questions to keep")
+    parser.add_argument("--index-path", default=os.getenv("RAG_INDEX_PATH", "."),
+                        help="Index root (its active version) or a single index directory")
+    parser.add_argument("--roles", nargs="+", default=list(DEFAULT_ROLES))
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions) if args.questions else []
+    if args.from_traffic:
+        mined = mine_questions(args.from_traffic, args.min_count, args.top)
+        print(f"Mined {len(mined)} questions asked at least {args.min_count} times")
+        known = {(normalize_text(item["question"]), item["category"]) for item in questions}
+        questions += [item for item in mined if (normalize_text(item["question"]), item["category"]) not in known]
+    if not questions:
+        parser.error("give a questions file and/or --from-traffic")
+    build_answer_bank(args.index_path, questions, roles=args.roles, workers=args.workers)
+    print("Running apps load it with the next index version they swap to, or on restart")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,52 +1,140 @@
 from typing import Dict, List
+import argparse
 import os
 from pathlib import Path
 import pickle
 from dotenv import load_dotenv
 from langchain_community.document_loaders import Docx2txtLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.text_splitter import RecursiveCharacterTextSplitter, TokenTextSplitter
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
 from langchain.schema import Document
 from langchain_groq import ChatGroq
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain.text_splitter import CharacterTextSplitter
 import fitz  # PyMuPDF
 import tiktoken
 from openai import OpenAI
-from langchain_openai import OpenAIEmbeddings
+from structured_chunker import StructuredPDFExtractor, SectionChunker
+from index_meta import write_index_meta
+from index_registry import IndexRegistry, close_index_reloader
+from llm_scheduler import call_context, count_tokens, PRIORITY_INDEX_BUILD
+from embedding_backends import DEFAULT_EMBEDDING_MODELS, EMBEDDING_BACKENDS, make_embeddings
+from chunk_dedup import MinHashDeduplicator, deduplicate_documents
+from extraction_cache import ExtractionCache
+from ann_index import INDEX_TYPES, build_ann_index, index_params
+from context_compression import SENTENCE_VECTORS_FILE, normalize_rows, split_sentences
+import numpy as np
+from answer_bank import AnswerBank
+from build_answer_bank import DEFAULT_ROLES, build_answer_bank, load_questions
 
 # Load environment variables
 load_dotenv()
 
+# Bump when extract_text_from_pdf output changes; cached extractions are keyed by it
+TEXT_EXTRACTOR_ID = f"pymupdf-text-v1-{fitz.VersionBind}"
+
+# Text splitters by name; chunk_size/chunk_overlap are characters, or tokens for "token"
+TEXT_SPLITTERS = {
+    "character": lambda size, overlap: CharacterTextSplitter(
+        separator="\n", chunk_size=size, chunk_overlap=overlap, length_function=len
+    ),
+    "recursive": lambda size, overlap: RecursiveCharacterTextSplitter(chunk_size=size, chunk_overlap=overlap),
+    "token": lambda size, overlap: TokenTextSplitter(
+        encoding_name="cl100k_base", chunk_size=size, chunk_overlap=overlap
+    )
+}
+
 class KnowledgeBaseBuilder:
-    def __init__(self, embeddings_model: str = "text-embedding-3-small"):
-        self.embeddings = OpenAIEmbeddings(
-            model=embeddings_model,
-            openai_api_key=os.getenv("OPENAI_API_KEY")
-        )
-        self.text_splitter = CharacterTextSplitter(
-            separator="\n",
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len
-        )
+    CHUNKING_STRATEGIES = tuple(TEXT_SPLITTERS) + ("structured",)
+
+    def __init__(self, embeddings_model: str = None, chunking: str = "character",
+                 max_chunk_tokens: int = 350, embedding_dimensions: int = None, dedup: bool = True,
+                 dedup_threshold: float = 0.85, chunk_size: int = 1000, chunk_overlap: int = 200,
+                 cache_dir: str = ".cache/kb_build", index_type: str = "flat", ann_params: dict = None,
+                 sentence_vectors: bool = False, embeddings_backend: str = "openai"):
+        if chunking not in self.CHUNKING_STRATEGIES:
+            raise ValueError(f"Unknown chunking strategy '{chunking}'. Use one of: {', '.join(self.CHUNKING_STRATEGIES)}")
+        # OpenAI, local sentence-transformers or the deterministic hash stand-in (embedding_backends.py);
+        # OpenAI calls share the process-wide rate limits at index-build priority
+        embeddings_model = embeddings_model or DEFAULT_EMBEDDING_MODELS[embeddings_backend]
+        self.backend_embeddings = make_embeddings(embeddings_backend, embeddings_model, embedding_dimensions)
+        self.embeddings = self.backend_embeddings
+        # With a cache directory, page text is extracted once per PDF version and
+        # chunks are embedded once per (model, dimensions, chunk text)
+        self.extraction_cache = None
+        if cache_dir:
+            self.extraction_cache = ExtractionCache(os.path.join(cache_dir, "extraction"))
+            # OpenAI keys keep their original namespace so existing caches stay valid
+            backend_prefix = "" if embeddings_backend == "openai" else f"{embeddings_backend}-"
+            self.embeddings = CacheBackedEmbeddings.from_bytes_store(
+                self.backend_embeddings,
+                LocalFileStore(os.path.join(cache_dir, "embeddings")),
+                namespace=f"{backend_prefix}{embeddings_model.replace('/', '_')}-{embedding_dimensions or 'full'}/",
+                key_encoder="sha256"
+            )
+        self.embeddings_backend = embeddings_backend
+        self.embeddings_model = embeddings_model
+        self.embedding_dimensions = embedding_dimensions
+        self.chunking = chunking
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.text_splitter = TEXT_SPLITTERS[chunking](chunk_size, chunk_overlap) if chunking in TEXT_SPLITTERS else None
+        # Section-aware chunking from PyMuPDF layout information
+        self.pdf_extractor = StructuredPDFExtractor()
+        self.section_chunker = SectionChunker(max_tokens=max_chunk_tokens)
+        # Near-duplicate chunks (boilerplate, repeated spec tables, overlap) are embedded once
+        self.deduplicator = MinHashDeduplicator(threshold=dedup_threshold) if dedup else None
+        # FAISS index structure (see ann_index.py); validated here so a bad flag fails before embedding
+        self.index_type = index_type
+        self.ann_params = index_params(index_type, ann_params)
+        # Per-sentence embeddings let RAGQuery trim retrieved chunks to the relevant sentences; off by
+        # default because every sentence is embedded on top of its chunk
+        self.sentence_vectors = sentence_vectors
         
     def num_tokens_from_string(self, string: str, encoding_name: str = "cl100k_base") -> int:
         """Count the number of tokens in a text string"""
         encoding = tiktoken.get_encoding(encoding_name)
         return len(encoding.encode(string))
     
+    def _extract(self, pdf_path: str, extractor_id: str, extract):
+        """Run an extractor, through the extraction cache when enabled"""
+        if self.extraction_cache is None:
+            return extract(pdf_path)
+        return self.extraction_cache.get_or_extract(pdf_path, extractor_id, extract)
+
+    @staticmethod
+    def extract_pages(pdf_path: str) -> List[str]:
+        """Plain text of every page"""
+        doc = fitz.open(pdf_path)
+        try:
+            return [page.get_text() for page in doc]
+        finally:
+            doc.close()
+
     def extract_text_from_pdf(self, pdf_path: str) -> str:
         """Extract text from a PDF file"""
         try:
-            doc = fitz.open(pdf_path)
-            text = "\n".join([page.get_text() for page in doc])
-            doc.close()
-            return text
+            return "\n".join(self._extract(pdf_path, TEXT_EXTRACTOR_ID, self.extract_pages))
         except Exception as e:
             print(f"Error extracting text from {pdf_path}: {e}")
             return ""
 
+    def split_pdf(self, pdf_path: str) -> List[Dict]:
+        """Split a PDF into chunks as {"text", ...extra metadata} using the configured strategy"""
+        if self.chunking == "structured":
+            try:
+                blocks = self._extract(pdf_path, self.pdf_extractor.cache_id(), self.pdf_extractor.extract_blocks)
+            except Exception as e:
+                print(f"Error extracting structure from {pdf_path}: {e}")
+                return []
+            return self.section_chunker.chunk(blocks)
+
+        text = self.extract_text_from_pdf(pdf_path)
+        if not text:
+            return []
+        return [{"text": chunk} for chunk in self.text_splitter.split_text(text)]
+
     def process_directory(self, base_dir: str) -> List[Dict]:
         """Process all PDFs in the directory structure"""
         documents = []
@@ -65,30 +153,30 @@ class KnowledgeBaseBuilder:
                 try:
                     print(f"\nProcessing {pdf_path}")
                     
-                    # Extract text from PDF
-                    text = self.extract_text_from_pdf(str(pdf_path))
-                    if not text:
+                    # Extract and split the PDF into chunks
+                    chunks = self.split_pdf(str(pdf_path))
+                    if not chunks:
                         continue
                     
-                    # Split text into chunks
-                    chunks = self.text_splitter.split_text(text)
-                    
                     # Log chunks for debugging
                     print(f"Generated {len(chunks)} chunks from {pdf_path.name}")
                     for i, chunk in enumerate(chunks):
+                        text = chunk["text"]
                         print(f"\nChunk {i+1}/{len(chunks)}:")
                         print("-" * 40)
-                        print(chunk[:200] + "..." if len(chunk) > 200 else chunk)
+                        print(text[:200] + "..." if len(text) > 200 else text)
                         print("-" * 40)
                         
-                        # Create document with metadata
+                        # Create document with metadata (page range and section when known)
+                        metadata = {
+                            "source": str(pdf_path),
+                            "category": category,
+                            "filename": pdf_path.name
+                        }
+                        metadata.update({key: value for key, value in chunk.items() if key != "text"})
                         documents.append({
-                            "page_content": chunk,
-                            "metadata": {
-                                "source": str(pdf_path),
-                                "category": category,
-                                "filename": pdf_path.name
-                            }
+                            "page_content": text,
+                            "metadata": metadata
                         })
                         
                 except Exception as e:
@@ -97,12 +185,40 @@ class KnowledgeBaseBuilder:
         
         return documents
 
-    def build_index(self, pdfs_dir: str = "pdfs", output_dir: str = "vector_index"):
-        """Build vector store index from PDF directory"""
+    def embed_sentences(self, documents: List[Document]) -> np.ndarray:
+        """Embed every sentence of every chunk; rows and spans are recorded in each chunk's metadata.
+
+        Without any sentence (image-only PDFs) there are no rows; build_index widens that to the index's width.
+        """
+        texts = []
+        for doc in documents:
+            spans = split_sentences(doc.page_content)
+            doc.metadata["sentences"] = [len(texts), len(spans)]
+            doc.metadata["sentence_spans"] = spans
+            texts.extend(doc.page_content[start:end] for start, end in spans)
+        with call_context(priority=PRIORITY_INDEX_BUILD, stage="index_build"):
+            vectors = self.embeddings.embed_documents(texts) if texts else np.zeros((0, 0))
+        return normalize_rows(vectors)
+
+    def build_index(self, pdfs_dir: str = "pdfs", output_dir: str = "vector_index", activate: bool = True,
+                    answer_bank_questions: list = None, answer_bank_roles=DEFAULT_ROLES) -> str:
+        """Build a new index version under output_dir from the PDF directory and return its version.
+
+        The answer bank is rebuilt for the new version from answer_bank_questions, or
+        from the questions of the active version's bank when None ([] = no bank).
+        """
         # Process PDFs
         documents_dict = self.process_directory(pdfs_dir)
         if not documents_dict:
             raise ValueError("No documents were successfully processed!")
+        
+        dedup_report = None
+        if self.deduplicator is not None:
+            documents_dict, dedup_report = deduplicate_documents(
+                documents_dict,
+                self.deduplicator,
+                token_counter=lambda text: count_tokens(self.embeddings_model, text)
+            )
             
         # Convert dictionaries to Document objects
         documents = [
@@ -112,21 +228,76 @@ class KnowledgeBaseBuilder:
             ) for doc in documents_dict
         ]
             
+        # Sentence rows and spans go into chunk metadata, so this comes before the vector store
+        embedded_before = self.backend_embeddings.texts_embedded
+        sentence_vectors = self.embed_sentences(documents) if self.sentence_vectors else None
+        sentences_embedded = self.backend_embeddings.texts_embedded - embedded_before
+        
         # Create metadata list
         metadata_list = [doc.metadata for doc in documents]
         
-        # Create vector store
-        vector_store = FAISS.from_documents(
-            documents,
-            self.embeddings
-        )
+        # Create vector store (behind interactive chat traffic in the scheduler)
+        embedded_before = self.backend_embeddings.texts_embedded
+        with call_context(priority=PRIORITY_INDEX_BUILD, stage="index_build"):
+            vector_store = FAISS.from_documents(
+                documents,
+                self.embeddings
+            )
+        embedded = self.backend_embeddings.texts_embedded - embedded_before
+        if sentence_vectors is not None and not len(sentence_vectors):
+            # No sentences to embed: an empty (0, dim) array
+            sentence_vectors = sentence_vectors.reshape(0, vector_store.index.d)
         
-        # Save vector store and metadata
-        os.makedirs(output_dir, exist_ok=True)
-        vector_store.save_local(output_dir)
+        # from_documents builds exact (flat) search; rebuild the same vectors as an ANN index if asked
+        ann = {"index_type": "flat", "index_params": {}}
+        if self.index_type != "flat":
+            vectors = vector_store.index.reconstruct_n(0, vector_store.index.ntotal)
+            vector_store.index, ann = build_ann_index(vectors, self.index_type, self.ann_params)
         
-        with open(os.path.join(output_dir, "metadata.pkl"), "wb") as f:
+        # Save vector store and metadata into a staging directory for the new version
+        registry = IndexRegistry(output_dir)
+        version, staging_dir = registry.new_version()
+        vector_store.save_local(staging_dir)
+        
+        with open(os.path.join(staging_dir, "metadata.pkl"), "wb") as f:
             pickle.dump(metadata_list, f)
+        
+        if sentence_vectors is not None:
+            np.save(os.path.join(staging_dir, SENTENCE_VECTORS_FILE), sentence_vectors)
+        
+        # Record how the vectors were made so RAGQuery can't silently disagree
+        index_meta = write_index_meta(staging_dir, {
+            "embeddings_backend": self.embeddings_backend,
+            "embeddings_model": self.embeddings_model,
+            "dimensions": vector_store.index.d,
+            "shortened": self.embedding_dimensions is not None,
+            "chunking": self.chunking,
+            "chunk_size": self.chunk_size if self.text_splitter else None,
+            "chunk_overlap": self.chunk_overlap if self.text_splitter else None,
+            "max_chunk_tokens": self.section_chunker.max_tokens if self.chunking == "structured" else None,
+            "num_chunks": len(documents),
+            "version": version,
+            "dedup": dedup_report,
+            "index_type": ann["index_type"],
+            "index_params": ann["index_params"],
+            "num_sentences": len(sentence_vectors) if sentence_vectors is not None else None
+        })
+        
+        # Answer the banked questions against this build before it can go live, so the two swap together
+        if answer_bank_questions is None:
+            answer_bank_questions, answer_bank_roles = self.previous_answer_bank(registry)
+        answer_bank = None
+        if answer_bank_questions:
+            try:
+                answer_bank = build_answer_bank(staging_dir, answer_bank_questions, roles=answer_bank_roles)
+            except Exception as e:
+                print(f"\n⚠️ Answer bank not built: {str(e)}")
+            finally:
+                # The staging directory is about to move; don't keep watching it or its loaded index
+                close_index_reloader(staging_dir)
+        
+        # Checksummed manifest, then an atomic move into place; running apps hot-swap on activation
+        version_dir = registry.publish(version, staging_dir, activate=activate, extra={"index_meta": index_meta})
             
         print(f"\nIndex built successfully!")
         print(f"Total documents indexed: {len(documents)}")
@@ -137,12 +308,87 @@ class KnowledgeBaseBuilder:
             categories[cat] = categories.get(cat, 0) + 1
         for cat, count in categories.items():
             print(f"  - {cat}: {count} chunks")
-        print(f"Index saved to: {output_dir}")
+        if dedup_report:
+            print(f"Near-duplicate chunks removed: {dedup_report['chunks_removed']} of {dedup_report['chunks_before']} "
+                  f"({dedup_report['duplicate_groups']} groups, ~{dedup_report['embedding_tokens_saved']} embedding tokens saved)")
+        print(f"Chunks embedded: {embedded} new, {len(documents) - embedded} from the embedding cache")
+        if self.extraction_cache is not None:
+            cache_stats = self.extraction_cache.stats()
+            print(f"PDF extraction: {cache_stats['misses']} extracted, {cache_stats['hits']} from the extraction cache")
+        if sentence_vectors is not None:
+            print(f"Sentences embedded: {sentences_embedded} new, "
+                  f"{len(sentence_vectors) - sentences_embedded} from the embedding cache")
+        print(f"Embeddings: {self.embeddings_backend} {self.embeddings_model}, {vector_store.index.d} dimensions")
+        print(f"FAISS index: {ann['index_type']} {ann['index_params'] or ''}")
+        if answer_bank is not None:
+            print(f"Answer bank: {len(answer_bank)} precomputed answers")
+        print(f"Index version {version} saved to: {version_dir}{' (active)' if activate else ''}")
+        return version
+
+    @staticmethod
+    def previous_answer_bank(registry: IndexRegistry) -> tuple:
+        """(questions, roles) of the active version's answer bank, or ([], ()) when it has none"""
+        try:
+            bank = AnswerBank.load(registry.version_dir(registry.current_version()))
+        except Exception as e:
+            print(f"Could not read the previous answer bank: {str(e)}")
+            bank = None
+        if bank is None:
+            return [], ()
+        return bank.questions(), bank.roles()
 
 def main():
+    parser = argparse.ArgumentParser(description="Build the FAISS knowledge base index")
+    parser.add_argument("--pdfs-dir", default="KB/pdfs", help="Directory with one sub-directory per category")
+    parser.add_argument("--output-dir", default="vector_index", help="Root directory of versioned indexes")
+    parser.add_argument("--no-activate", action="store_true",
+                        help="Publish the new version without making it live (see index_registry.py activate)")
+    parser.add_argument("--chunking", choices=KnowledgeBaseBuilder.CHUNKING_STRATEGIES, default="character",
+                        help="'structured' chunks by PDF section under a token budget and keeps page numbers")
+    parser.add_argument("--chunk-size", type=int, default=1000,
+                        help="Text splitter chunk size (characters; tokens for --chunking token)")
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--max-chunk-tokens", type=int, default=350, help="Token budget for --chunking structured")
+    parser.add_argument("--cache-dir", default=".cache/kb_build",
+                        help="Where extracted PDF text and chunk embeddings are cached")
+    parser.add_argument("--no-cache", action="store_true", help="Re-extract and re-embed everything")
+    parser.add_argument("--embedding-backend", choices=EMBEDDING_BACKENDS, default="openai",
+                        help="'local' embeds with sentence-transformers on the CPU; 'hash' is a deterministic test stand-in")
+    parser.add_argument("--embedding-model", help="Model name (default depends on the backend)")
+    parser.add_argument("--dimensions", type=int, default=None,
+                        help="Shortened embedding size, e.g. 256 or 512 (default: the model's full size)")
+    parser.add_argument("--no-dedup", action="store_true", help="Keep near-duplicate chunks")
+    parser.add_argument("--dedup-threshold", type=float, default=0.85,
+                        help="Word 5-gram Jaccard similarity above which chunks are merged")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat",
+                        help="FAISS index: exact 'flat' search or approximate HNSW / IVF (compare with benchmarks.bench_ann_index)")
+    parser.add_argument("--index-param", action="append", default=[], metavar="KEY=VALUE",
+                        help="Index parameter, e.g. m=32, ef_search=64, nlist=1024, nprobe=16, pq_m=32")
+    parser.add_argument("--sentence-vectors", action=argparse.BooleanOptionalAction,
+                        default=os.getenv("RAG_COMPRESS", "false").lower() == "true",
+                        help="Embed every chunk sentence, needed for RAG_COMPRESS context compression "
+                             "(default: on when RAG_COMPRESS=true)")
+    parser.add_argument("--answer-bank", metavar="QUESTIONS",
+                        help="JSON lines of questions to precompute answers for (default: those of the active version's bank)")
+    parser.add_argument("--no-answer-bank", action="store_true", help="Build the version without an answer bank")
+    args = parser.parse_args()
+    ann_params = {}
+    for item in args.index_param:
+        key, _, value = item.partition("=")
+        ann_params[key] = int(value)
+
     # Build index from KB/pdfs directory
-    builder = KnowledgeBaseBuilder()
-    builder.build_index("KB/pdfs")  # Updated path to KB/pdfs directory
+    builder = KnowledgeBaseBuilder(chunking=args.chunking, max_chunk_tokens=args.max_chunk_tokens,
+                                   embedding_dimensions=args.dimensions, dedup=not args.no_dedup,
+                                   dedup_threshold=args.dedup_threshold, chunk_size=args.chunk_size,
+                                   chunk_overlap=args.chunk_overlap,
+                                   cache_dir=None if args.no_cache else args.cache_dir,
+                                   index_type=args.index_type, ann_params=ann_params,
+                                   sentence_vectors=args.sentence_vectors,
+                                   embeddings_backend=args.embedding_backend, embeddings_model=args.embedding_model)
+    answer_bank_questions = [] if args.no_answer_bank else load_questions(args.answer_bank) if args.answer_bank else None
+    builder.build_index(args.pdfs_dir, args.output_dir, activate=not args.no_activate,
+                        answer_bank_questions=answer_bank_questions)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,107 @@
+import argparse
+import json
+from rag_query import RAGQuery
+
+
+def load_question_set(path: str) -> list:
+    """Load a labelled question set (JSON lines).
+
+    Each line looks like:
+        {"question": "What is the RingJect 376?", "category": "ctr", "answerable": true}
+    Optional keys: "expected_source" (PDF file name holding the answer).
+    """
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            item = json.loads(line)
+            if "question" not in item:
+                raise ValueError(f"{path}:{line_no}: missing 'question'")
+            item.setdefault("category", None)
+            item.setdefault("answerable", True)
+            questions.append(item)
+    return questions
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def suggest_max_distance(top_distances: list, target_recall: float = 0.95) -> dict:
+    """Suggest distance cutoffs from (top-1 distance, answerable) pairs"""
+    candidates = sorted({distance for distance, _ in top_distances})
+    total_answerable = sum(1 for _, answerable in top_distances if answerable)
+
+    best = None
+    recall_cutoff = None
+    for threshold in candidates:
+        passed = [answerable for distance, answerable in top_distances if distance <= threshold]
+        true_pos = sum(1 for answerable in passed if answerable)
+        false_pos = len(passed) - true_pos
+        precision = true_pos / len(passed) if passed else 0.0
+        recall = true_pos / total_answerable if total_answerable else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+
+        if best is None or f1 > best["f1"]:
+            best = {"threshold": threshold, "f1": f1, "precision": precision,
+                    "recall": recall, "false_positives": false_pos}
+        if recall_cutoff is None and recall >= target_recall:
+            recall_cutoff = {"threshold": threshold, "precision": precision, "recall": recall}
+
+    return {"best_f1": best, "target_recall": recall_cutoff}
+
+
+def calibrate(rag: RAGQuery, questions: list, k: int = 6, target_recall: float = 0.95) -> dict:
+    """Run every question through raw retrieval and derive cutoff suggestions"""
+    top_distances = []
+    gaps = []
+    for item in questions:
+        scored_docs = rag.search_with_scores(item["question"], category=item["category"], k=k)
+        if not scored_docs:
+            print(f"⚠️ No results for: {item['question']}")
+            continue
+
+        distances = [score for _, score in scored_docs]
+        top_distances.append((distances[0], bool(item["answerable"])))
+        print(f"{'✅' if item['answerable'] else '❌'} {distances[0]:.3f}  {item['question'][:80]}")
+
+        # Gaps inside the rankings of answerable questions should not trigger a cut
+        if item["answerable"]:
+            gaps.extend(b - a for a, b in zip(distances, distances[1:]))
+
+    suggestion = suggest_max_distance(top_distances, target_recall)
+    suggestion["score_gap"] = round(percentile(gaps, 95), 4) if gaps else None
+    suggestion["questions"] = len(top_distances)
+    return suggestion
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Suggest RAG retrieval thresholds from a labelled question set")
+    parser.add_argument("questions", help="JSON lines file with question/category/answerable")
+    parser.add_argument("--k", type=int, default=6, help="Number of chunks to inspect per question")
+    parser.add_argument("--target-recall", type=float, default=0.95,
+                        help="Share of answerable questions that must pass the cutoff")
+    args = parser.parse_args()
+
+    rag = RAGQuery()
+    questions = load_question_set(args.questions)
+    result = calibrate(rag, questions, k=args.k, target_recall=args.target_recall)
+
+    print("\nCalibration results:")
+    print(json.dumps(result, indent=2))
+    if result["best_f1"]:
+        print(f"\nSuggested settings:")
+        print(f"  RAG_MAX_DISTANCE={result['best_f1']['threshold']:.4f}")
+        if result["score_gap"] is not None:
+            print(f"  RAG_SCORE_GAP={result['score_gap']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import re
+import zlib
+from collections import defaultdict
+import numpy as np
+
+_MERSENNE_PRIME = (1 << 31) - 1
+_WORD = re.compile(r"\w+")
+
+
+def shingles(text: str, size: int = 5) -> set:
+    """Hashed word n-grams of the normalised text"""
+    words = _WORD.findall(text.lower())
+    if len(words) < size:
+        return {zlib.crc32(" ".join(words).encode("utf-8"))}
+    return {zlib.crc32(" ".join(words[i:i + size]).encode("utf-8")) for i in range(len(words) - size + 1)}
+
+
+def jaccard(a: set, b: set) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class MinHashDeduplicator:
+    """Groups near-duplicate chunks with MinHash signatures and LSH banding.
+
+    Chunks whose shingle sets have a Jaccard similarity of at least threshold
+    end up in one group. LSH only proposes candidate pairs (bands x rows =
+    num_perm); each candidate is confirmed with the exact Jaccard similarity.
+    """
+
+    def __init__(self, threshold: float = 0.85, num_perm: int = 128, bands: int = 16, shingle_size: int = 5,
+                 seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, shingle_set: set) -> np.ndarray:
+        values = np.fromiter(shingle_set, dtype=np.uint64, count=len(shingle_set))
+        # (a * x + b) mod p for every permutation and shingle; a < 2^31 and x < 2^32 keep it within uint64
+        hashed = (np.outer(values, self._a) + self._b) % _MERSENNE_PRIME
+        return hashed.min(axis=0)
+
+    def groups(self, texts: list) -> list:
+        """Lists of indices of near-duplicate texts (singletons included), in input order"""
+        shingle_sets = [shingles(text, self.shingle_size) for text in texts]
+        buckets = defaultdict(list)
+        for i, shingle_set in enumerate(shingle_sets):
+            signature = self.signature(shingle_set)
+            for band in range(self.bands):
+                key = (band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+                buckets[key].append(i)
+
+        parent = list(range(len(texts)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        checked = set()
+        for members in buckets.values():
+            for pos, i in enumerate(members):
+                for j in members[pos + 1:]:
+                    if (i, j) in checked or find(i) == find(j):
+                        continue
+                    checked.add((i, j))
+                    if jaccard(shingle_sets[i], shingle_sets[j]) >= self.threshold:
+                        parent[find(j)] = find(i)
+
+        grouped = defaultdict(list)
+        for i in range(len(texts)):
+            grouped[find(i)].append(i)
+        return sorted(grouped.values(), key=lambda members: members[0])
+
+
+def source_reference(metadata: dict) -> dict:
+    """The parts of a chunk's metadata that say where it came from"""
+    keys = ("source", "filename", "page_start", "page_end", "section")
+    return {key: metadata[key] for key in keys if key in metadata}
+
+
+def deduplicate_documents(documents: list, deduplicator: MinHashDeduplicator, token_counter=None) -> tuple:
+    """Collapse near-duplicate {"page_content", "metadata"} dicts within each category.
+
+    The longest chunk of a group is kept and its metadata lists every source in
+    "sources" (with "duplicate_count" removed chunks). Returns (documents, report).
+    """
+    by_category = defaultdict(list)
+    for i, doc in enumerate(documents):
+        by_category[doc["metadata"].get("category")].append(i)
+
+    kept, removed_tokens, groups_merged = [], 0, 0
+    for indices in by_category.values():
+        texts = [documents[i]["page_content"] for i in indices]
+        for group in deduplicator.groups(texts):
+            members = [documents[indices[g]] for g in group]
+            longest = max(members, key=lambda doc: len(doc["page_content"]))
+            keep = longest
+            if len(members) > 1:
+                groups_merged += 1
+                metadata = dict(longest["metadata"])
+                metadata["sources"] = [source_reference(doc["metadata"]) for doc in members]
+                metadata["duplicate_count"] = len(members) - 1
+                keep = {"page_content": longest["page_content"], "metadata": metadata}
+                if token_counter:
+                    removed_tokens += sum(token_counter(doc["page_content"]) for doc in members if doc is not longest)
+            kept.append((indices[group[0]], keep))
+
+    # Keep the original document order
+    kept.sort(key=lambda item: item[0])
+    deduplicated = [doc for _, doc in kept]
+    report = {
+        "threshold": deduplicator.threshold,
+        "chunks_before": len(documents),
+        "chunks_after": len(deduplicated),
+        "chunks_removed": len(documents) - len(deduplicated),
+        "duplicate_groups": groups_merged,
+        "embedding_tokens_saved": removed_tokens
+    }
+    return deduplicated, report
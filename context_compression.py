@@ -0,0 +1,115 @@
+import math
+import re
+import numpy as np
+from langchain.schema import Document
+
+SENTENCE_VECTORS_FILE = "sentence_vectors.npy"
+
+# Sentence ends, blank lines and list items; PDF text also wraps lines mid-sentence, so single newlines are kept
+_BOUNDARY = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[]?[A-Z])|\n\s*\n|\n(?=\s*(?:[•▪●\-–*]|\d+[.)])\s)")
+# A full stop after these doesn't end the sentence ("Fig. 2", "Dr. Smith")
+_ABBREVIATION = re.compile(r"\b(?:Fig|Figs|No|Nr|Dr|Prof|Ref|Tab|approx|ca|vs|e\.g|i\.e|etc)\.$", re.IGNORECASE)
+# Longer pieces (tables, unpunctuated lists) are cut at line breaks
+MAX_SENTENCE_CHARS = 400
+
+
+def _trimmed(text: str, start: int, end: int) -> tuple:
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def _pieces(text: str, start: int, end: int) -> list:
+    """One trimmed span, or several cut at line breaks when it is too long"""
+    start, end = _trimmed(text, start, end)
+    if start >= end:
+        return []
+    if end - start <= MAX_SENTENCE_CHARS:
+        return [(start, end)]
+    pieces, piece_start = [], start
+    for line_break in re.finditer(r"\n", text[start:end]):
+        position = start + line_break.start()
+        if position - piece_start >= MAX_SENTENCE_CHARS // 2:
+            pieces.append(_trimmed(text, piece_start, position))
+            piece_start = position + 1
+    pieces.append(_trimmed(text, piece_start, end))
+    return [piece for piece in pieces if piece[0] < piece[1]]
+
+
+def split_sentences(text: str) -> list:
+    """Character spans (start, end) of the sentences in a chunk, whitespace trimmed"""
+    spans, start = [], 0
+    for boundary in _BOUNDARY.finditer(text):
+        spans.extend(_pieces(text, start, boundary.start()))
+        start = boundary.end()
+    spans.extend(_pieces(text, start, len(text)))
+    merged = []
+    for span in spans:
+        if merged and _ABBREVIATION.search(text[merged[-1][0]:merged[-1][1]]) and "\n\n" not in text[merged[-1][1]:span[0]]:
+            merged[-1] = (merged[-1][0], span[1])
+        else:
+            merged.append(span)
+    return merged
+
+
+def normalize_rows(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def compress_documents(docs: list, query_vector, sentence_vectors, keep_ratio: float = 0.4, window: int = 1,
+                       min_sentences: int = 6) -> tuple:
+    """Keep the sentences of the retrieved chunks most similar to the query, plus their neighbours.
+
+    Chunks locate their sentences with metadata "sentences" ([first row, count]
+    in sentence_vectors) and "sentence_spans"; chunks without them are kept
+    whole. The top keep_ratio of all sentences survive, and every chunk keeps at
+    least its best sentence since it passed the retrieval cutoff. Returns
+    (documents, stats); stats is None when nothing was compressed.
+    """
+    located = [(i, doc.metadata["sentences"]) for i, doc in enumerate(docs)
+               if doc.metadata.get("sentences") and doc.metadata["sentences"][1]]
+    total = sum(count for _, (_, count) in located)
+    if total < min_sentences:
+        return docs, None
+
+    rows = np.concatenate([np.arange(first, first + count) for _, (first, count) in located])
+    owner = np.concatenate([np.full(count, i) for i, (_, count) in located])
+    query_vector = np.asarray(query_vector, dtype=np.float32)
+    similarities = np.asarray(sentence_vectors[rows], dtype=np.float32) @ (
+        query_vector / (np.linalg.norm(query_vector) or 1.0))
+
+    seed = np.zeros(total, dtype=bool)
+    seed[np.argsort(-similarities, kind="stable")[:max(1, math.ceil(keep_ratio * total))]] = True
+    by_chunk = np.lexsort((-similarities, owner))
+    seed[by_chunk[np.r_[True, owner[by_chunk][1:] != owner[by_chunk][:-1]]]] = True
+    keep = seed.copy()
+    for shift in range(1, window + 1):
+        same_chunk = owner[shift:] == owner[:-shift]
+        keep[:-shift] |= seed[shift:] & same_chunk
+        keep[shift:] |= seed[:-shift] & same_chunk
+
+    compressed = list(docs)
+    offset = 0
+    for i, (_, count) in located:
+        doc = docs[i]
+        kept = np.flatnonzero(keep[offset:offset + count])
+        offset += count
+        if len(kept) == count:
+            continue
+        spans = doc.metadata["sentence_spans"]
+        # Runs of consecutive sentences are copied as they are; gaps become an ellipsis
+        runs = np.split(kept, np.flatnonzero(np.diff(kept) > 1) + 1)
+        text = " … ".join(doc.page_content[spans[run[0]][0]:spans[run[-1]][1]] for run in runs)
+        compressed[i] = Document(page_content=text, metadata=doc.metadata)
+
+    stats = {
+        "sentences_before": total,
+        "sentences_after": int(keep.sum()),
+        "chars_before": sum(len(doc.page_content) for doc in docs),
+        "chars_after": sum(len(doc.page_content) for doc in compressed)
+    }
+    return compressed, stats
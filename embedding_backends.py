@@ -0,0 +1,159 @@
+import hashlib
+import os
+import queue
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+from llm_scheduler import ScheduledEmbeddings
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # only needed for the "local" backend
+    SentenceTransformer = None
+
+# Which implementation turns text into vectors; recorded in index_meta.json as "embeddings_backend"
+EMBEDDING_BACKENDS = ("openai", "local", "hash")
+DEFAULT_EMBEDDING_MODELS = {
+    "openai": "text-embedding-3-small",
+    "local": "sentence-transformers/all-MiniLM-L6-v2",
+    "hash": "hash-v1"
+}
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministic, dependency-free stand-in: signed feature hashing of words and word pairs.
+
+    Shared words give similar vectors, which is enough for tests and offline
+    benchmarks; it is not a semantic model.
+    """
+
+    def __init__(self, dimensions: int = 384):
+        self.dimensions = dimensions
+        self.texts_embedded = 0
+
+    def _embed(self, text: str) -> list:
+        words = re.findall(r"\w+", text.lower())
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dimensions] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: list) -> list:
+        self.texts_embedded += len(texts)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list:
+        return self._embed(text)
+
+
+class LocalEmbeddings(Embeddings):
+    """sentence-transformers model on the CPU, no network calls.
+
+    Documents are encoded in batches on a thread pool. Concurrent query
+    embeddings are collected for up to max_wait seconds and encoded as one
+    batch, so many sessions asking at once cost one forward pass.
+    runtime "onnx" or "openvino" uses sentence-transformers' exported backends.
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 32, workers: int = 2, max_wait: float = 0.005,
+                 runtime: str = "torch"):
+        if SentenceTransformer is None:
+            raise ImportError("The local embedding backend needs sentence-transformers: "
+                              "pip install sentence-transformers")
+        runtime_kwargs = {} if runtime == "torch" else {"backend": runtime}
+        self.model = SentenceTransformer(model_name, device="cpu", **runtime_kwargs)
+        self.model_name = model_name
+        self.dimensions = self.model.get_sentence_embedding_dimension()
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.texts_embedded = 0
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="local-embeddings")
+        self._queries = queue.Queue()
+        self._dispatcher = threading.Thread(target=self._dispatch_queries, daemon=True,
+                                            name="local-embeddings-batcher")
+        self._dispatcher.start()
+
+    def _encode(self, texts: list) -> list:
+        return self.model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True,
+                                 convert_to_numpy=True).tolist()
+
+    def embed_documents(self, texts: list) -> list:
+        self.texts_embedded += len(texts)
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        return [vector for vectors in self._pool.map(self._encode, batches) for vector in vectors]
+
+    def embed_query(self, text: str) -> list:
+        future = Future()
+        self._queries.put((text, future))
+        return future.result()
+
+    def _dispatch_queries(self):
+        while True:
+            pending = [self._queries.get()]
+            try:
+                while len(pending) < self.batch_size:
+                    pending.append(self._queries.get(timeout=self.max_wait))
+            except queue.Empty:
+                pass
+            self._pool.submit(self._run_queries, pending)
+
+    def _run_queries(self, pending: list):
+        try:
+            vectors = self._encode([text for text, _ in pending])
+        except Exception as e:
+            for _, future in pending:
+                future.set_exception(e)
+            return
+        for (_, future), vector in zip(pending, vectors):
+            future.set_result(vector)
+
+
+_local_models = {}
+_local_models_lock = threading.Lock()
+
+
+def get_local_embeddings(model_name: str) -> LocalEmbeddings:
+    """Process-wide local model per name (loading one takes seconds and hundreds of MB).
+
+    LOCAL_EMBEDDING_WORKERS, LOCAL_EMBEDDING_BATCH and LOCAL_EMBEDDING_RUNTIME
+    (torch, onnx or openvino) configure it.
+    """
+    with _local_models_lock:
+        if model_name not in _local_models:
+            _local_models[model_name] = LocalEmbeddings(
+                model_name,
+                batch_size=int(os.getenv("LOCAL_EMBEDDING_BATCH", "32")),
+                workers=int(os.getenv("LOCAL_EMBEDDING_WORKERS", "2")),
+                runtime=os.getenv("LOCAL_EMBEDDING_RUNTIME", "torch")
+            )
+        return _local_models[model_name]
+
+
+def make_embeddings(backend: str, model: str = None, dimensions: int = None) -> Embeddings:
+    """Embeddings for a backend and model; OpenAI calls go through the LLM scheduler"""
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}'. Use one of: {', '.join(EMBEDDING_BACKENDS)}")
+    model = model or DEFAULT_EMBEDDING_MODELS[backend]
+    if backend == "openai":
+        # text-embedding-3 models can return shortened vectors (e.g. 256 or 512 dimensions)
+        embedding_kwargs = {"dimensions": dimensions} if dimensions else {}
+        return ScheduledEmbeddings(
+            OpenAIEmbeddings(
+                model=model,
+                openai_api_key=os.getenv("OPENAI_API_KEY"),
+                max_retries=0,
+                **embedding_kwargs
+            ),
+            model
+        )
+    if backend == "hash":
+        return HashEmbeddings(dimensions or 384)
+    embeddings = get_local_embeddings(model)
+    if dimensions and dimensions != embeddings.dimensions:
+        raise ValueError(f"{model} produces {embeddings.dimensions}-dimensional vectors, not {dimensions}")
+    return embeddings
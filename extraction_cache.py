@@ -0,0 +1,48 @@
+import hashlib
+import json
+import os
+import re
+from index_registry import file_sha256
+
+
+class ExtractionCache:
+    """Extracted PDF content on disk, keyed by the PDF's content hash and the extractor id.
+
+    The extractor id names the extraction code and its settings (for example
+    "pymupdf-text-v1"); bump it whenever extraction output would change so
+    stale entries are simply never looked up again.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, pdf_hash: str, extractor_id: str) -> str:
+        slug = re.sub(r"[^A-Za-z0-9._-]+", "_", extractor_id)[:60]
+        digest = hashlib.sha256(extractor_id.encode("utf-8")).hexdigest()[:12]
+        return os.path.join(self.cache_dir, pdf_hash[:2], f"{pdf_hash}-{slug}-{digest}.json")
+
+    def get_or_extract(self, pdf_path: str, extractor_id: str, extract):
+        """Cached result of extract(pdf_path); must be JSON serialisable"""
+        path = self._path(file_sha256(pdf_path), extractor_id)
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    value = json.load(f)
+                self.hits += 1
+                return value
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable extraction cache entry {path}: {e}")
+
+        value = extract(pdf_path)
+        self.misses += 1
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+        return value
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,60 @@
+import json
+import os
+from datetime import datetime, timezone
+
+INDEX_META_FILE = "index_meta.json"
+
+# What an index built before index_meta.json existed looks like
+LEGACY_INDEX_META = {
+    "embeddings_backend": "openai",
+    "embeddings_model": "text-embedding-3-small",
+    "dimensions": 1536,
+    "shortened": False
+}
+
+
+class IndexMismatchError(ValueError):
+    """Raised when the query side is configured differently from the index it loads"""
+
+
+def write_index_meta(index_dir: str, meta: dict) -> dict:
+    """Write index metadata next to index.faiss and return what was written"""
+    meta = dict(meta)
+    meta.setdefault("created_at", datetime.now(timezone.utc).isoformat())
+    with open(os.path.join(index_dir, INDEX_META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2, sort_keys=True)
+    return meta
+
+
+def read_index_meta(index_dir: str) -> dict:
+    """Read index metadata, falling back to the legacy defaults for older indexes"""
+    path = os.path.join(index_dir, INDEX_META_FILE)
+    if not os.path.exists(path):
+        return dict(LEGACY_INDEX_META, legacy=True)
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def embeddings_backend_of(meta: dict) -> str:
+    """Backend the index was embedded with; indexes from before backends were recorded used OpenAI"""
+    return meta.get("embeddings_backend", "openai")
+
+
+def check_index_compatible(meta: dict, index_dimension: int = None, requested_dimensions: int = None,
+                           requested_backend: str = None):
+    """Refuse to query an index whose vectors don't match the query embeddings"""
+    if requested_backend is not None and requested_backend != embeddings_backend_of(meta):
+        raise IndexMismatchError(
+            f"Requested {requested_backend} query embeddings but the index was built with the "
+            f"{embeddings_backend_of(meta)} backend ({meta['embeddings_model']})"
+        )
+    if index_dimension is not None and index_dimension != meta["dimensions"]:
+        raise IndexMismatchError(
+            f"FAISS index has {index_dimension}-dimensional vectors but index metadata "
+            f"records {meta['dimensions']}"
+        )
+    if requested_dimensions is not None and requested_dimensions != meta["dimensions"]:
+        raise IndexMismatchError(
+            f"Requested {requested_dimensions}-dimensional query embeddings but the index "
+            f"was built with {meta['dimensions']} dimensions"
+        )
@@ -0,0 +1,345 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import weakref
+from datetime import datetime, timezone
+
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "CURRENT"
+LEGACY_VERSION = "legacy"
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_manifest(version_dir: str, version: str, extra: dict = None) -> dict:
+    """Record checksums of every index file in the version directory"""
+    files = {}
+    for name in sorted(os.listdir(version_dir)):
+        path = os.path.join(version_dir, name)
+        if name == MANIFEST_FILE or not os.path.isfile(path):
+            continue
+        files[name] = {"sha256": file_sha256(path), "bytes": os.path.getsize(path)}
+    manifest = {
+        "version": version,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "files": files
+    }
+    manifest.update(extra or {})
+    with open(os.path.join(version_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def verify_manifest(version_dir: str) -> list:
+    """Return a list of problems; empty when every file matches its checksum"""
+    path = os.path.join(version_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return [f"missing {MANIFEST_FILE}"]
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    problems = []
+    for name, expected in manifest["files"].items():
+        file_path = os.path.join(version_dir, name)
+        if not os.path.exists(file_path):
+            problems.append(f"missing {name}")
+        elif file_sha256(file_path) != expected["sha256"]:
+            problems.append(f"checksum mismatch for {name}")
+    return problems
+
+
+class IndexRegistry:
+    """Versioned index directories under one root with a CURRENT pointer file.
+
+    Layout:
+        <root>/CURRENT                 name of the active version
+        <root>/<version>/index.faiss   plus index.pkl, metadata.pkl, index_meta.json, manifest.json
+
+    A root without CURRENT is a legacy flat index and resolves to the root itself.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def current_version(self) -> str:
+        path = os.path.join(self.root, CURRENT_FILE)
+        if not os.path.exists(path):
+            return LEGACY_VERSION
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+
+    def version_dir(self, version: str) -> str:
+        return self.root if version == LEGACY_VERSION else os.path.join(self.root, version)
+
+    def list_versions(self) -> list:
+        """Published versions, oldest first"""
+        if not os.path.isdir(self.root):
+            return []
+        versions = [
+            name for name in os.listdir(self.root)
+            if os.path.exists(os.path.join(self.root, name, MANIFEST_FILE))
+        ]
+        return sorted(versions)
+
+    def new_version(self) -> tuple:
+        """Return (version, staging_dir) for a build that is about to be written"""
+        version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+        staging_dir = os.path.join(self.root, f".staging-{version}")
+        os.makedirs(staging_dir, exist_ok=True)
+        return version, staging_dir
+
+    def publish(self, version: str, staging_dir: str, activate: bool = True, extra: dict = None) -> str:
+        """Write the manifest, move the staged build into place and optionally activate it"""
+        write_manifest(staging_dir, version, extra)
+        version_dir = self.version_dir(version)
+        os.rename(staging_dir, version_dir)
+        if activate:
+            self.activate(version)
+        return version_dir
+
+    def activate(self, version: str):
+        """Atomically point CURRENT at a published, verified version"""
+        if version not in self.list_versions():
+            raise ValueError(f"Unknown index version '{version}'")
+        problems = verify_manifest(self.version_dir(version))
+        if problems:
+            raise ValueError(f"Index version '{version}' failed verification: {', '.join(problems)}")
+        tmp_path = os.path.join(self.root, f".{CURRENT_FILE}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(version + "\n")
+        os.replace(tmp_path, os.path.join(self.root, CURRENT_FILE))
+
+    def rollback(self) -> str:
+        """Activate the version published before the current one"""
+        versions = self.list_versions()
+        current = self.current_version()
+        if current not in versions or versions.index(current) == 0:
+            raise ValueError(f"No earlier version to roll back to from '{current}'")
+        previous = versions[versions.index(current) - 1]
+        self.activate(previous)
+        return previous
+
+    def prune(self, keep: int = 3) -> list:
+        """Delete the oldest versions, never the active one"""
+        versions = self.list_versions()
+        current = self.current_version()
+        removed = []
+        for version in versions[:-keep] if keep else versions:
+            if version != current:
+                shutil.rmtree(self.version_dir(version))
+                removed.append(version)
+        return removed
+
+
+class IndexReloader:
+    """Loads the active index version once and swaps it into every live consumer.
+
+    Consumers (RAGQuery instances) expose swap_resources(snapshot). The loader
+    callable turns (version, version_dir) into a snapshot. Release hooks are
+    called with (old_snapshot, new_snapshot) after a swap so caches tied to the
+    old version can be dropped; bound methods are held weakly, like consumers.
+    A version that failed to load (e.g. still being copied) is retried with
+    exponential backoff, or as soon as its manifest changes.
+    """
+
+    def __init__(self, root: str, loader, retry_delay: float = 10.0, max_retry_delay: float = 600.0):
+        self.registry = IndexRegistry(root)
+        self.loader = loader
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._consumers = weakref.WeakSet()
+        self._release_hooks = []
+        self._snapshot = None
+        # (version, manifest mtime, monotonic retry time, consecutive failures) of the last failed load
+        self._failed = None
+        self._lock = threading.RLock()
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        self._stop = threading.Event()
+
+    def register(self, consumer):
+        with self._lock:
+            self._consumers.add(consumer)
+
+    def add_release_hook(self, hook):
+        """hook(old_snapshot, new_snapshot) runs after every swap; adding the same hook twice is a no-op"""
+        ref = weakref.WeakMethod(hook) if hasattr(hook, "__self__") else (lambda: hook)
+        with self._lock:
+            if hook not in self._hooks():
+                self._release_hooks.append(ref)
+
+    def _hooks(self) -> list:
+        """Live release hooks, forgetting those whose owner was garbage collected"""
+        self._release_hooks = [ref for ref in self._release_hooks if ref() is not None]
+        return [ref() for ref in self._release_hooks]
+
+    def current_snapshot(self):
+        """The loaded snapshot of the active version, loading it on first use"""
+        with self._lock:
+            if self._snapshot is None:
+                version = self.registry.current_version()
+                self._snapshot = self.loader(version, self.registry.version_dir(version))
+            return self._snapshot
+
+    def reload_now(self) -> bool:
+        """Load the active version if it changed and swap it in; returns True on swap"""
+        with self._reload_lock:
+            return self._reload()
+
+    def _reload(self) -> bool:
+        with self._lock:
+            version = self.registry.current_version()
+            old_snapshot = self._snapshot
+            if old_snapshot is not None and old_snapshot.version == version:
+                return False
+            version_dir = self.registry.version_dir(version)
+            failed = self._failed
+            if (failed is not None and failed[0] == version and failed[1] == self._manifest_mtime(version_dir)
+                    and time.monotonic() < failed[2]):
+                return False
+
+        if version != LEGACY_VERSION:
+            problems = verify_manifest(version_dir)
+            if problems:
+                delay = self._record_failure(version, version_dir)
+                print(f"\n❌ Not loading index version {version}: {', '.join(problems)} "
+                      f"(retrying in {delay:.0f}s or when its manifest changes)")
+                return False
+
+        # Load outside the lock so queries keep running on the old version meanwhile
+        print(f"\n🔄 Loading index version {version}...")
+        try:
+            new_snapshot = self.loader(version, version_dir)
+        except Exception:
+            self._record_failure(version, version_dir)
+            raise
+
+        with self._lock:
+            self._failed = None
+            self._snapshot = new_snapshot
+            consumers = list(self._consumers)
+            hooks = self._hooks()
+        for consumer in consumers:
+            try:
+                consumer.swap_resources(new_snapshot)
+            except Exception as e:
+                print(f"\n❌ Failed to swap index into {consumer!r}: {str(e)}")
+        for hook in hooks:
+            try:
+                hook(old_snapshot, new_snapshot)
+            except Exception as e:
+                print(f"\n❌ Index release hook failed: {str(e)}")
+        old_version = old_snapshot.version if old_snapshot is not None else None
+        print(f"\n✅ Swapped index {old_version} -> {version} in {len(consumers)} live instance(s)")
+        return True
+
+    @staticmethod
+    def _manifest_mtime(version_dir: str):
+        try:
+            return os.stat(os.path.join(version_dir, MANIFEST_FILE)).st_mtime_ns
+        except OSError:
+            return None
+
+    def _record_failure(self, version: str, version_dir: str) -> float:
+        """Hold off reloading version until the backoff passes or its manifest changes; returns the delay"""
+        with self._lock:
+            failures = self._failed[3] + 1 if self._failed is not None and self._failed[0] == version else 1
+            delay = min(self.max_retry_delay, self.retry_delay * 2 ** (failures - 1))
+            self._failed = (version, self._manifest_mtime(version_dir), time.monotonic() + delay, failures)
+        return delay
+
+    def start_watching(self, interval: float = 10.0):
+        """Poll CURRENT in a background thread and hot-swap new versions"""
+        with self._lock:
+            if self._watcher is not None or interval <= 0:
+                return
+            self._watcher = threading.Thread(target=self._watch, args=(interval,), daemon=True,
+                                             name="index-reloader")
+            self._watcher.start()
+
+    def stop_watching(self):
+        self._stop.set()
+
+    def _watch(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.reload_now()
+            except Exception as e:
+                print(f"\n❌ Index reload failed: {str(e)}")
+
+
+_reloaders = {}
+_reloaders_lock = threading.Lock()
+
+
+def get_index_reloader(root: str, loader) -> IndexReloader:
+    """Process-wide reloader for an index root; starts the watcher (INDEX_WATCH_INTERVAL seconds, 0 = off)"""
+    root = os.path.abspath(root)
+    with _reloaders_lock:
+        reloader = _reloaders.get(root)
+        if reloader is None:
+            reloader = IndexReloader(root, loader)
+            _reloaders[root] = reloader
+            reloader.start_watching(float(os.getenv("INDEX_WATCH_INTERVAL", "10")))
+        return reloader
+
+
+def close_index_reloader(root: str):
+    """Stop watching an index root and forget its reloader (staging directories after a build)"""
+    with _reloaders_lock:
+        reloader = _reloaders.pop(os.path.abspath(root), None)
+    if reloader is not None:
+        reloader.stop_watching()
+
+
+def loaded_snapshots() -> list:
+    """The active snapshot of every index root loaded in this process"""
+    with _reloaders_lock:
+        reloaders = list(_reloaders.values())
+    return [reloader._snapshot for reloader in reloaders if reloader._snapshot is not None]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage versioned knowledge base indexes")
+    parser.add_argument("--root", default=os.getenv("RAG_INDEX_PATH", "vector_index"))
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="List published versions")
+    activate_parser = subparsers.add_parser("activate", help="Make a version live")
+    activate_parser.add_argument("version")
+    subparsers.add_parser("rollback", help="Re-activate the previous version")
+    verify_parser = subparsers.add_parser("verify", help="Check a version against its manifest")
+    verify_parser.add_argument("version", nargs="?")
+    prune_parser = subparsers.add_parser("prune", help="Delete old versions")
+    prune_parser.add_argument("--keep", type=int, default=3)
+    args = parser.parse_args()
+
+    registry = IndexRegistry(args.root)
+    if args.command == "list":
+        current = registry.current_version()
+        for version in registry.list_versions():
+            print(f"{'*' if version == current else ' '} {version}")
+    elif args.command == "activate":
+        registry.activate(args.version)
+        print(f"Activated {args.version}; running apps pick it up on their next poll")
+    elif args.command == "rollback":
+        print(f"Rolled back to {registry.rollback()}")
+    elif args.command == "verify":
+        version = args.version or registry.current_version()
+        problems = verify_manifest(registry.version_dir(version))
+        print(f"{version}: {'OK' if not problems else ', '.join(problems)}")
+    elif args.command == "prune":
+        removed = registry.prune(args.keep)
+        print(f"Removed: {', '.join(removed) if removed else 'nothing'}")
+
+
+if __name__ == "__main__":
+    main()
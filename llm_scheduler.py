@@ -0,0 +1,397 @@
+import contextvars
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from functools import lru_cache
+import openai
+import tiktoken
+from langchain_core.embeddings import Embeddings
+from pipeline_budget import DeadlineExceeded
+
+# Lower value = served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+PRIORITY_INDEX_BUILD = 2
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_BATCH: "batch",
+    PRIORITY_INDEX_BUILD: "index_build"
+}
+
+# Requests and tokens per minute per model, e.g. LLM_RATE_LIMITS='{"gpt-4o": {"rpm": 500, "tpm": 30000}}'.
+# Account limits depend on the usage tier, so models without one are not throttled locally
+# (a 429 from the API is still retried with backoff)
+DEFAULT_LIMITS = {}
+# Completion budget assumed when a call sets no max_tokens
+DEFAULT_COMPLETION_TOKENS = 512
+
+_call_context = contextvars.ContextVar("llm_call_context", default={})
+
+
+@contextmanager
+def call_context(**values):
+    """Tag every LLM/embedding call made inside the block (priority, stage, session, role, category, ...)"""
+    token = _call_context.set({**_call_context.get(), **values})
+    try:
+        yield
+    finally:
+        _call_context.reset(token)
+
+
+def get_call_context() -> dict:
+    return dict(_call_context.get())
+
+
+@lru_cache(maxsize=None)
+def _encoding_for(model: str):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # Estimates must never block a call (e.g. tiktoken can't download its encoding files)
+        print(f"Token estimation falling back to a character count: {str(e)}")
+        return None
+
+
+def count_tokens(model: str, text: str) -> int:
+    encoding = _encoding_for(model)
+    if encoding is None:
+        return len(text or "") // 4 + 1
+    return len(encoding.encode(text or ""))
+
+
+def estimate_chat_tokens(model: str, messages: list, max_tokens: int = None) -> int:
+    """Prompt tokens (plus per-message overhead) and the completion budget"""
+    prompt = sum(count_tokens(model, message.get("content", "")) + 4 for message in messages)
+    return prompt + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    return isinstance(error, openai.RateLimitError) or getattr(error, "status_code", None) == 429
+
+
+def is_retryable_error(error: Exception) -> bool:
+    if is_rate_limit_error(error):
+        return True
+    if isinstance(error, (openai.APIConnectionError, openai.InternalServerError)):
+        return True
+    return getattr(error, "status_code", None) in (500, 502, 503, 504)
+
+
+def retry_after_seconds(error: Exception):
+    """The Retry-After header of a 429/5xx response, if the server sent one"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class TokenBucket:
+    """Continuously refilling bucket holding at most `capacity` units per `period` seconds"""
+
+    def __init__(self, capacity: float, period: float = 60.0):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` can be taken; requests larger than the bucket wait for a full one"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount: float):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def empty(self):
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+
+class LLMScheduler:
+    """Admission control for every OpenAI call in the process.
+
+    Each model with limits gets a request bucket and a token bucket. Callers
+    queue per model in priority order and are admitted when both buckets can
+    cover the request's estimated tokens. Rate-limit and transient errors are retried
+    with full-jitter exponential backoff (or the server's Retry-After).
+    Observers receive one event per finished call.
+    """
+
+    def __init__(self, limits: dict = None, max_retries: int = 5, base_delay: float = 0.5,
+                 max_delay: float = 20.0):
+        self.limits = {**DEFAULT_LIMITS, **(limits or {})}
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._cond = threading.Condition()
+        self._buckets = {}
+        self._queues = defaultdict(list)
+        self._sequence = itertools.count()
+        self._observers = []
+        self._waits = defaultdict(lambda: deque(maxlen=1000))
+        self._counters = defaultdict(int)
+        self._max_depth = defaultdict(int)
+
+    def _model_buckets(self, model: str) -> tuple:
+        """(request bucket, token bucket), or () for a model without limits"""
+        if model not in self._buckets:
+            limits = self.limits.get(model)
+            self._buckets[model] = (TokenBucket(limits["rpm"]), TokenBucket(limits["tpm"])) if limits else ()
+        return self._buckets[model]
+
+    def add_observer(self, observer):
+        """observer(event: dict) is called after every call, successful or not"""
+        self._observers.append(observer)
+
+    def _notify(self, event: dict):
+        for observer in list(self._observers):
+            try:
+                observer(event)
+            except Exception as e:
+                print(f"LLM scheduler observer failed: {str(e)}")
+
+    def _acquire(self, model: str, tokens: int, priority: int) -> float:
+        """Block until this caller is first in line for the model and both buckets allow it"""
+        start = time.monotonic()
+        with self._cond:
+            queue = self._queues[model]
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(queue, ticket)
+            self._max_depth[model] = max(self._max_depth[model], len(queue))
+            expires_at = get_call_context().get("expires_at")
+            try:
+                while True:
+                    if expires_at is not None and time.monotonic() >= expires_at:
+                        raise DeadlineExceeded(f"Deadline passed while queued for {model}")
+                    if queue[0] == ticket:
+                        buckets = list(zip(self._model_buckets(model), (1, tokens)))
+                        wait = max((bucket.wait_time(amount) for bucket, amount in buckets), default=0.0)
+                        if expires_at is not None and time.monotonic() + wait > expires_at:
+                            raise DeadlineExceeded(f"{model} rate limit would delay the call past its deadline")
+                        if wait <= 0:
+                            for bucket, amount in buckets:
+                                bucket.consume(amount)
+                            heapq.heappop(queue)
+                            break
+                        self._cond.wait(timeout=wait)
+                    else:
+                        self._cond.wait(timeout=1.0)
+            except BaseException:
+                if ticket in queue:
+                    queue.remove(ticket)
+                    heapq.heapify(queue)
+                raise
+            finally:
+                self._cond.notify_all()
+        waited = time.monotonic() - start
+        with self._cond:
+            self._waits[priority].append(waited)
+        return waited
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            return min(self.max_delay, retry_after) + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _settle(self, model: str, estimated_tokens: int, response):
+        """Give back the unused part of the estimate once the real usage is known"""
+        usage = getattr(response, "usage", None)
+        actual = getattr(usage, "total_tokens", None)
+        if actual is not None and actual < estimated_tokens:
+            with self._cond:
+                for token_bucket in self._model_buckets(model)[1:]:
+                    token_bucket.refund(estimated_tokens - actual)
+                self._cond.notify_all()
+
+    def submit(self, model: str, call, estimated_tokens: int, priority: int = None, kind: str = "chat"):
+        """Run call() once admitted, retrying rate-limit and transient errors"""
+        context = get_call_context()
+        if priority is None:
+            priority = context.get("priority", PRIORITY_INTERACTIVE)
+
+        total_wait = 0.0
+        for attempt in range(self.max_retries + 1):
+            total_wait += self._acquire(model, estimated_tokens, priority)
+            start = time.monotonic()
+            try:
+                result = call()
+            except Exception as e:
+                latency = time.monotonic() - start
+                rate_limited = is_rate_limit_error(e)
+                with self._cond:
+                    self._counters["rate_limited" if rate_limited else "errors"] += 1
+                    if rate_limited:
+                        # The provider window is exhausted: hold everyone back, not just this caller
+                        for bucket in self._model_buckets(model):
+                            bucket.empty()
+                delay = self._backoff(attempt, e)
+                expires_at = context.get("expires_at")
+                out_of_time = expires_at is not None and time.monotonic() + delay >= expires_at
+                if attempt == self.max_retries or not is_retryable_error(e) or out_of_time:
+                    with self._cond:
+                        self._counters["failed"] += 1
+                    self._notify({"model": model, "kind": kind, "priority": priority, "context": context,
+                                  "latency": latency, "wait": total_wait, "attempts": attempt + 1,
+                                  "estimated_tokens": estimated_tokens, "response": None, "error": e})
+                    raise
+                with self._cond:
+                    self._counters["retries"] += 1
+                print(f"\n⏳ {model} call failed ({type(e).__name__}), retrying in {delay:.1f}s "
+                      f"(attempt {attempt + 1}/{self.max_retries})")
+                time.sleep(delay)
+                total_wait += delay
+                continue
+
+            latency = time.monotonic() - start
+            self._settle(model, estimated_tokens, result)
+            with self._cond:
+                self._counters["completed"] += 1
+            self._notify({"model": model, "kind": kind, "priority": priority, "context": context,
+                          "latency": latency, "wait": total_wait, "attempts": attempt + 1,
+                          "estimated_tokens": estimated_tokens, "response": result, "error": None})
+            return result
+
+    def stats(self) -> dict:
+        """Queue depth per model and priority, admission waits per priority and call counters"""
+        with self._cond:
+            depth = {
+                model: {PRIORITY_NAMES.get(p, str(p)): sum(1 for ticket in queue if ticket[0] == p)
+                        for p in PRIORITY_NAMES}
+                for model, queue in self._queues.items()
+            }
+            waits = {}
+            for priority, samples in self._waits.items():
+                ordered = sorted(samples)
+                if ordered:
+                    waits[PRIORITY_NAMES.get(priority, str(priority))] = {
+                        "count": len(ordered),
+                        "mean": sum(ordered) / len(ordered),
+                        "p95": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+                        "max": ordered[-1]
+                    }
+            return {
+                "queue_depth": depth,
+                "max_queue_depth": dict(self._max_depth),
+                "wait_seconds": waits,
+                "counters": dict(self._counters)
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> LLMScheduler:
+    """Process-wide scheduler (LLM_RATE_LIMITS JSON, LLM_MAX_RETRIES)"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            limits = json.loads(os.getenv("LLM_RATE_LIMITS", "{}"))
+            _scheduler = LLMScheduler(limits=limits, max_retries=int(os.getenv("LLM_MAX_RETRIES", "5")))
+        return _scheduler
+
+
+def configure_scheduler(scheduler: LLMScheduler) -> LLMScheduler:
+    """Replace the process-wide scheduler (tests, harnesses, custom limits); its observers carry over"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is not None and _scheduler is not scheduler:
+            # The router's latency feed, usage tracking and prompt cache stats registered on the old one
+            for observer in _scheduler._observers:
+                if observer not in scheduler._observers:
+                    scheduler.add_observer(observer)
+        _scheduler = scheduler
+    return scheduler
+
+
+def chat_completion(client, priority: int = None, **kwargs):
+    """client.chat.completions.create(**kwargs) through the shared scheduler"""
+    model = kwargs["model"]
+    estimated = estimate_chat_tokens(model, kwargs.get("messages", []), kwargs.get("max_tokens"))
+    expires_at = get_call_context().get("expires_at")
+
+    def call():
+        # Under a pipeline deadline the HTTP timeout is whatever time is left
+        if expires_at is not None and "timeout" not in kwargs:
+            remaining = expires_at - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(f"No time left for {model} call")
+            return client.chat.completions.create(timeout=remaining, **kwargs)
+        return client.chat.completions.create(**kwargs)
+
+    return get_scheduler().submit(
+        model,
+        call,
+        estimated,
+        priority=priority,
+        kind="chat"
+    )
+
+
+class ScheduledEmbeddings(Embeddings):
+    """Wraps a LangChain embeddings object so its API calls go through the scheduler"""
+
+    def __init__(self, embeddings: Embeddings, model: str, batch_size: int = 256, max_batch_tokens: int = 200000):
+        self.embeddings = embeddings
+        self.model = model
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        # Documents sent to the API so far (index builds report cache savings from it)
+        self.texts_embedded = 0
+
+    def _batches(self, texts: list):
+        batch, batch_tokens = [], 0
+        for text in texts:
+            tokens = count_tokens(self.model, text)
+            if batch and (len(batch) >= self.batch_size or batch_tokens + tokens > self.max_batch_tokens):
+                yield batch, batch_tokens
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            yield batch, batch_tokens
+
+    def embed_documents(self, texts: list) -> list:
+        self.texts_embedded += len(texts)
+        vectors = []
+        for batch, tokens in self._batches(texts):
+            vectors.extend(get_scheduler().submit(
+                self.model,
+                lambda batch=batch: self.embeddings.embed_documents(batch),
+                tokens,
+                kind="embedding"
+            ))
+        return vectors
+
+    def embed_query(self, text: str) -> list:
+        return get_scheduler().submit(
+            self.model,
+            lambda: self.embeddings.embed_query(text),
+            count_tokens(self.model, text),
+            kind="embedding"
+        )
@@ -3,9 +3,24 @@ from langchain_community.vectorstores import FAISS
 from langchain_openai import ChatOpenAI
 import pickle
 import os
-from query_rewriter import QueryRewriter
+import uuid
+from query_rewriter import QueryRewriter, expand_abbreviations
 from rag_query import RAGQuery
 from query_merger import QueryMerger
+from pipeline_budget import DeadlineExceeded, PipelineBudget
+from llm_scheduler import call_context
+from prompt_templates import get_prompt_cache_stats
+from single_flight import get_single_flight
+from usage_tracker import BudgetExceeded, get_usage_tracker
+from traffic_recorder import build_record, get_request_usage, get_traffic_recorder
+from speculation import Speculation, get_speculation_stats, rewrite_similarity
+from working_set import get_working_set_stats
+from memory_monitor import get_memory_monitor
+
+def is_first_question(history: list) -> bool:
+    """Whether the user hasn't asked anything yet in this history"""
+    return not any(message["role"] == "user" for message in history)
+
 
 class QueryEngine:
     def __init__(self):
@@ -38,14 +53,18 @@ class QueryEngine:
         return results
 
 class MedicalQuerySystem:
-    def __init__(self, debug: bool = False):
+    def __init__(self, debug: bool = False, index_path: str = None, answer_bank: bool = None):
         try:
             # Verify API key
             api_key = os.getenv("OPENAI_API_KEY")
             if not api_key:
                 raise ValueError("OpenAI API key not found in environment variables")
+            
+            # Per-session memory attribution when MEMORY_PROFILE=true; started before the index loads
+            self.memory_monitor = get_memory_monitor()
                 
-            self.rag = RAGQuery(index_path=".", debug=debug)
+            # RAG_INDEX_PATH may point at a versioned index root written by build_index.py
+            self.rag = RAGQuery(index_path=index_path or os.getenv("RAG_INDEX_PATH", "."), debug=debug)
             self.current_category = None
             self.categories = ['ctr', 'iols', 'gen']
             self.category_aliases = {
@@ -64,6 +83,42 @@ class MedicalQuerySystem:
             self.query_merger = QueryMerger(api_key)
             self.current_role = "doctor"
             self.valid_roles = ["doctor", "sales"]
+            # Stage timings and degradations of the most recent query
+            self.last_trace = None
+            # Cached prompt tokens per stage/model, from the usage of every chat call
+            self.prompt_cache_stats = get_prompt_cache_stats()
+            # Identical in-flight calls shared across sessions (process-wide)
+            self.single_flight = get_single_flight()
+            # Tokens, cost and time per stage/session/role/category, with per-session budgets
+            self.usage = get_usage_tracker()
+            # Optional SessionStore the chat histories are persisted to
+            self.session_store = None
+            self.session_id = None
+            # Usage is attributed to the stored session, or to this instance when there is none
+            self.anonymous_session_id = uuid.uuid4().hex
+            # Redacted record of the most recent query (also appended to TRAFFIC_LOG when set)
+            self.request_usage = get_request_usage()
+            self.traffic_recorder = get_traffic_recorder()
+            self.last_request = None
+            self.last_rewritten_query = None
+            # First questions close enough to a precomputed one are answered from the index's answer bank;
+            # off unless asked for (the app does), so scripted runs measure the pipeline itself
+            if answer_bank is None:
+                answer_bank = os.getenv("ANSWER_BANK", "false").lower() == "true"
+            self.use_answer_bank = answer_bank
+            self.answer_bank_min_similarity = float(os.getenv("ANSWER_BANK_MIN_SIMILARITY", "0.95"))
+            # While the LLM rewrite runs, retrieve (SPECULATIVE_RAG=retrieval) or also answer
+            # (=generation) on the raw question; kept when the rewrite is at least
+            # SPECULATION_MIN_SIMILARITY alike, discarded otherwise. Off by default: it costs an
+            # extra embedding and search per query
+            self.speculative_rag = os.getenv("SPECULATIVE_RAG", "off").lower()
+            self.speculation_min_similarity = float(os.getenv("SPECULATION_MIN_SIMILARITY", "0.95"))
+            # Hit rate and latency saved by speculation (process-wide)
+            self.speculation_stats = get_speculation_stats()
+            # Follow-up retrievals answered from the session's working set (process-wide)
+            self.working_set_stats = get_working_set_stats()
+            if self.memory_monitor is not None:
+                self.memory_monitor.track_session(self)
         except Exception as e:
             print(f"Error initializing MedicalQuerySystem: {str(e)}")
             raise
@@ -72,6 +127,30 @@ class MedicalQuerySystem:
         """Get chat history for current category"""
         return self.chat_histories[self.current_category]
     
+    def memory_components(self) -> tuple:
+        """Objects this session owns by component, and shared ones its size must not include"""
+        owned = {
+            "chat_histories": self.chat_histories,
+            "openai_clients": [self.rag.client, self.rag.query_rewriter.client, self.query_rewriter.client,
+                               self.query_merger.client, self.query_merger.relevancy_checker.client],
+            "working_set": self.rag.working_set
+        }
+        return owned, [self.rag.snapshot, self.rag.reloader]
+    
+    def attach_session(self, session_store, session_id: str):
+        """Persist chat histories to a SessionStore session, restoring any saved ones"""
+        self.session_store = session_store
+        self.session_id = session_id
+        saved = session_store.load_histories(session_id)
+        for category in self.chat_histories:
+            self.chat_histories[category] = saved.get(category, [])
+    
+    def add_to_history(self, role: str, content: str):
+        """Append a message to the current category's history (and its session, if attached)"""
+        self.get_current_history().append({"role": role, "content": content})
+        if self.session_store is not None:
+            self.session_store.append_history(self.session_id, self.current_category, role, content)
+    
     def switch_category(self, command):
         """Handle category switching commands"""
         if command.startswith('switch '):
@@ -99,52 +178,117 @@ class MedicalQuerySystem:
                 return True
         return False
     
-    def process_query(self, query: str) -> str:
-        """Process query and get appropriate response"""
+    def process_query(self, query: str, deadline_seconds: float = None) -> str:
+        """Process query and get appropriate response.
+
+        With a deadline (argument or PIPELINE_DEADLINE_SECONDS) optional stages are
+        skipped or replaced by local fallbacks when they would not fit in the time left.
+        """
+        if deadline_seconds is None and os.getenv("PIPELINE_DEADLINE_SECONDS"):
+            deadline_seconds = float(os.getenv("PIPELINE_DEADLINE_SECONDS"))
+        session = self.session_id or self.anonymous_session_id
+        # Stored sessions keep their usage totals (and so their budget) across restarts
+        self.usage.track_session(session, self.session_store)
+        try:
+            self.usage.check_budget(session)
+        except BudgetExceeded as e:
+            print(f"\n💸 {e}")
+            return ("This chat session has reached its usage limit. "
+                    "Please contact your administrator if you need to continue.")
+        budget = PipelineBudget(deadline_seconds)
+        request_id = uuid.uuid4().hex
+        self.last_rewritten_query = query
+        self.rag.last_retrieval = []
+        response = None
+        try:
+            # Scheduled LLM calls give up instead of queueing past the deadline; category and
+            # role let the model router apply per-category/per-role overrides; all three and the
+            # session and request attribute usage
+            with call_context(expires_at=budget.expires_at, category=self.current_category,
+                              role=self.current_role, session=session, request=request_id):
+                response = self._process_query(query, budget)
+                return response
+        finally:
+            self.last_trace = budget.trace()
+            self.last_request = build_record(
+                request_id, session, query, self.last_rewritten_query, self.current_category, self.current_role,
+                self.rag.index_version, self.rag.last_retrieval if self.current_category else [],
+                self.last_trace, self.request_usage.pop(request_id), response
+            )
+            if self.traffic_recorder is not None:
+                try:
+                    self.traffic_recorder.write(self.last_request)
+                except Exception as e:
+                    print(f"Could not record request: {str(e)}")
+
+    def _process_query(self, query: str, budget: PipelineBudget) -> str:
         try:
             # Get current category's history
             current_history = self.get_current_history()
+            # A mode's introduction may already be in the history; only the user's own turns count
+            first_question = is_first_question(current_history)
+            
+            # Only follow-ups reuse the chunks retrieved earlier in the conversation
+            if first_question and self.rag.working_set is not None:
+                self.rag.working_set.clear()
+            
+            # Opening questions don't depend on any history, so a banked answer is as good as a fresh one
+            if first_question and self.use_answer_bank:
+                banked = self.answer_from_bank(query, budget)
+                if banked is not None:
+                    return banked
             
-            # Single rewrite for both RAG and merger
-            rewritten_query = self.query_rewriter.rewrite_query(query, current_history)
+            # Stages that must still run after the rewrite to produce any answer
+            essential = ("rag",) if self.current_category else ("general_answer",)
+            
+            # Single rewrite for both RAG and merger; follow-ups need the LLM to resolve references
+            speculation = None
+            if not first_question or budget.can_afford("rewrite", then=essential):
+                speculation = self.speculate(query)
+                with budget.stage("rewrite"):
+                    rewritten_query = self.query_rewriter.rewrite_query(query, current_history)
+            else:
+                budget.degrade("rewrite", "local_abbreviations", "not enough time for the LLM rewrite")
+                rewritten_query = expand_abbreviations(query)
+            
+            self.last_rewritten_query = rewritten_query
             
             # If query was rewritten, show the rewrite
             if rewritten_query != query:
                 print(f"Rewritten query: {rewritten_query}")
             
             # Update chat history for current category
-            current_history.append({
-                "role": "user",
-                "content": query
-            })
+            self.add_to_history("user", query)
             
             # Get response based on category
             if self.current_category:
                 # Get KB response using rewritten query
-                kb_response = self.rag.query(
-                    rewritten_query,
-                    category=self.current_category,
-                    skip_rewrite=True
-                )
+                try:
+                    with budget.stage("rag"):
+                        kb_response = self.rag_response(query, rewritten_query, speculation, budget)
+                except DeadlineExceeded as e:
+                    # Not the "nothing in the knowledge base" reply: the answer may well be there
+                    budget.degrade("rag", "timed_out", str(e))
+                    return ("I'm sorry, looking this up in our knowledge base took too long. "
+                            "Please try again in a moment.")
                 # Process KB response according to role
                 final_response = self.query_merger.get_response(
                     rewritten_query,
                     category=self.current_category,
                     kb_response=kb_response,
-                    role=self.current_role
+                    role=self.current_role,
+                    budget=budget
                 )
             else:
                 # For general queries, use the merger with role
                 final_response = self.query_merger.get_response(
                     rewritten_query,
-                    role=self.current_role
+                    role=self.current_role,
+                    budget=budget
                 )
             
             # Update chat history for current category
-            current_history.append({
-                "role": "assistant",
-                "content": final_response
-            })
+            self.add_to_history("assistant", final_response)
             
             return final_response
             
@@ -152,6 +296,65 @@ class MedicalQuerySystem:
             print(f"Error processing query: {str(e)}")
             return "I apologize, but I encountered an error. Could you please try again?"
     
+    def speculate(self, query: str):
+        """Start the knowledge base stage on the raw question, before the rewrite is known"""
+        if self.speculative_rag not in ("retrieval", "generation") or not self.current_category:
+            return None
+        category = self.current_category
+        if self.speculative_rag == "generation":
+            def answer():
+                response = self.rag.query(query, category=category, skip_rewrite=True)
+                return response, self.rag.last_retrieval, self.rag.last_compression
+            return Speculation("generation", answer)
+        return Speculation("retrieval", lambda: self.rag.prefetch(query, category=category))
+    
+    def rag_response(self, query: str, rewritten_query: str, speculation, budget: PipelineBudget):
+        """Knowledge base answer, committing the speculation when the rewrite barely changed the question"""
+        if speculation is not None:
+            similarity = rewrite_similarity(query, rewritten_query)
+            if similarity >= self.speculation_min_similarity:
+                try:
+                    result = speculation.commit()
+                except Exception as e:
+                    print(f"Speculative {speculation.kind} failed: {str(e)}")
+                    budget.speculated(speculation.kind, "failed", similarity)
+                    if isinstance(e, DeadlineExceeded):
+                        raise
+                else:
+                    # "missed" when it never got a worker and ran inline
+                    budget.speculated(speculation.kind, speculation.outcome, similarity, speculation.saved_seconds)
+                    if speculation.kind == "retrieval":
+                        return self.rag.query(rewritten_query, category=self.current_category,
+                                              skip_rewrite=True, retrieval=result)
+                    response, self.rag.last_retrieval, self.rag.last_compression = result
+                    return response
+            else:
+                speculation.discard()
+                budget.speculated(speculation.kind, "discarded", similarity)
+                print(f"\n🗑️ Speculative {speculation.kind} discarded (rewrite similarity {similarity:.2f})")
+        return self.rag.query(rewritten_query, category=self.current_category, skip_rewrite=True)
+    
+    def answer_from_bank(self, query: str, budget: PipelineBudget):
+        """Answer from the active index's answer bank when the question confidently matches one"""
+        bank = self.rag.answer_bank
+        if bank is None or not bank.covers(self.current_category, self.current_role):
+            return None
+        try:
+            with budget.stage("answer_bank"):
+                match = bank.match(query, self.current_category, self.current_role,
+                                   self.rag.embed_query, self.answer_bank_min_similarity)
+        except Exception as e:
+            print(f"Answer bank lookup failed: {str(e)}")
+            return None
+        if match is None:
+            return None
+        entry, similarity = match
+        print(f"\n📦 Answer bank hit (similarity {similarity:.3f}): '{entry['question']}'")
+        self.last_rewritten_query = entry["rewritten_query"]
+        self.add_to_history("user", query)
+        self.add_to_history("assistant", entry["answer"])
+        return entry["answer"]
+    
     def run(self):
         print("\nWelcome to the Medical Knowledge Base Query System")
         print("Available commands:")
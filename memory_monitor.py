@@ -0,0 +1,356 @@
+import argparse
+import ctypes
+import gc
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+import types
+import weakref
+from collections import deque
+import faiss
+import numpy as np
+from index_registry import loaded_snapshots
+
+# Objects never followed when sizing: code and classes are process-wide, not owned by anyone
+_SKIP_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+               types.CodeType, types.FrameType, weakref.ReferenceType)
+_PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def rss_bytes() -> int:
+    """Current resident set size (Linux /proc; peak RSS elsewhere)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def trim_heap() -> bool:
+    """Hand freed heap pages back to the OS (glibc malloc_trim), so RSS follows live memory; False elsewhere"""
+    try:
+        return bool(ctypes.CDLL("libc.so.6").malloc_trim(0))
+    except (OSError, AttributeError):
+        return False
+
+
+def peak_rss_bytes() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+def module_global_ids() -> set:
+    """ids of every module-level object; singletons are shared by all sessions, so sizing stops there"""
+    ids = set()
+    for module in list(sys.modules.values()):
+        for value in list(getattr(module, "__dict__", {}).values()):
+            ids.add(id(value))
+    return ids
+
+
+def deep_size(obj, exclude: set = frozenset(), max_objects: int = 500000) -> int:
+    """Bytes of obj and everything it references, stopping at excluded ids, code, classes and modules.
+
+    numpy arrays count the buffer they own (views and memory maps only their
+    header); C objects without a reported size (FAISS, SSL contexts) count as empty.
+    """
+    seen = set(exclude)
+    pending = [obj]
+    total = 0
+    while pending and len(seen) < max_objects:
+        item = pending.pop()
+        if id(item) in seen or isinstance(item, _SKIP_TYPES):
+            continue
+        seen.add(id(item))
+        if isinstance(item, np.ndarray):
+            total += sys.getsizeof(item)
+            continue
+        try:
+            total += sys.getsizeof(item)
+        except TypeError:
+            continue
+        pending.extend(gc.get_referents(item))
+    return total
+
+
+def faiss_index_bytes(index) -> int:
+    """Estimated memory of a FAISS index (vectors or codes, ids and graph links)"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        hnsw = index.hnsw
+        return (faiss_index_bytes(index.storage) + hnsw.neighbors.size() * 4 + hnsw.offsets.size() * 8
+                + hnsw.levels.size() * 4)
+    if isinstance(index, faiss.IndexIVF):
+        direct_map = index.ntotal * 8 if index.direct_map.type != faiss.DirectMap.NoMap else 0
+        return index.ntotal * (index.code_size + 8) + direct_map + faiss_index_bytes(index.quantizer)
+    return index.ntotal * getattr(index, "code_size", index.d * 4)
+
+
+def index_components(snapshot, exclude: set) -> dict:
+    """Bytes of one loaded index version by component"""
+    store = snapshot.vector_store
+    components = {
+        "faiss_index": faiss_index_bytes(store.index),
+        "docstore": deep_size(store.docstore, exclude) + deep_size(store.index_to_docstore_id, exclude),
+        "metadata": deep_size(snapshot.metadata, exclude),
+        "answer_bank": deep_size(snapshot.answer_bank, exclude) if snapshot.answer_bank is not None else 0,
+    }
+    if snapshot.sentence_vectors is not None:
+        # Memory-mapped: only the pages compression touched are resident
+        components["sentence_vectors_mapped"] = int(snapshot.sentence_vectors.nbytes)
+    return components
+
+
+def _package_of(filename: str) -> str:
+    """Top-level package (or project module) an allocation site belongs to"""
+    if filename.startswith(_PROJECT_DIR + os.sep):
+        return os.path.relpath(filename, _PROJECT_DIR)
+    parts = filename.replace("\\", "/").split("/")
+    for marker in ("site-packages", "dist-packages"):
+        if marker in parts:
+            rest = parts[parts.index(marker) + 1:]
+            return rest[0].removesuffix(".py") if rest else filename
+    return "stdlib" if "/lib/python" in filename else filename
+
+
+class MemoryMonitor:
+    """Opt-in memory instrumentation: tracemalloc, RSS samples, and sizes per component and per session.
+
+    Sessions (MedicalQuerySystem instances) are tracked weakly; their sizes
+    are measured on report() by walking what each one owns, excluding the
+    shared index and module-level singletons, which are reported separately.
+    """
+
+    def __init__(self, trace_frames: int = 1, sample_seconds: float = 60.0, report_file: str = None,
+                 max_samples: int = 1440):
+        self.trace_frames = trace_frames
+        self.sample_seconds = sample_seconds
+        self.report_file = report_file
+        self.samples = deque(maxlen=max_samples)
+        self.started_at = time.time()
+        self._baseline = None
+        # The most recent report(), for views that must not measure on every request
+        self.last_report = None
+        self._sessions = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self) -> "MemoryMonitor":
+        if self.trace_frames and not tracemalloc.is_tracing():
+            tracemalloc.start(self.trace_frames)
+        self.mark_baseline()
+        if self.sample_seconds > 0:
+            self._thread = threading.Thread(target=self._sample_loop, daemon=True, name="memory-monitor")
+            self._thread.start()
+        print(f"🧮 Memory monitor on (tracemalloc {self.trace_frames} frames, "
+              f"RSS every {self.sample_seconds:g}s)")
+        return self
+
+    def _sample_loop(self):
+        while True:
+            time.sleep(self.sample_seconds)
+            try:
+                self.sample()
+                if self.report_file:
+                    self.write_report(self.report_file)
+            except Exception as e:
+                print(f"Memory sample failed: {str(e)}")
+
+    def track_session(self, system, transcript: list = None):
+        """Attribute a session's memory to it; the app passes its rendered transcript on every rerun"""
+        with self._lock:
+            entry = self._sessions.setdefault(system, {"transcript": None})
+            if transcript is not None:
+                entry["transcript"] = transcript
+
+    def live_sessions(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def mark_baseline(self):
+        """Allocation growth in reports is measured from here (e.g. after warm-up)"""
+        self._baseline = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+
+    def sample(self) -> dict:
+        traced, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (None, None)
+        sample = {"time": time.time(), "rss_bytes": rss_bytes(), "traced_bytes": traced,
+                  "traced_peak_bytes": peak, "sessions": self.live_sessions()}
+        self.samples.append(sample)
+        return sample
+
+    def growth_per_hour(self) -> dict:
+        """Least-squares RSS and traced-memory slope over the kept samples, in bytes per hour.
+
+        Empty until the samples span ten minutes; shorter spans extrapolate start-up noise.
+        """
+        samples = list(self.samples)
+        hours = np.array([s["time"] for s in samples]) / 3600.0
+        if len(samples) < 3 or np.ptp(hours) < 1 / 6:
+            return {}
+        result = {}
+        for key in ("rss_bytes", "traced_bytes"):
+            values = [s[key] for s in samples]
+            if None not in values:
+                result[key] = float(np.polyfit(hours, np.array(values, dtype=np.float64), 1)[0])
+        return result
+
+    def session_report(self, system, transcript: list, exclude: set) -> dict:
+        owned, shared = system.memory_components()
+        exclude = exclude | {id(obj) for obj in shared}
+        report = {
+            "session": system.session_id or system.anonymous_session_id,
+            "total_bytes": deep_size(system, exclude),
+            "history_messages": sum(len(history) for history in system.chat_histories.values()),
+            "openai_clients": len(owned["openai_clients"]),
+        }
+        for name, obj in owned.items():
+            report[f"{name}_bytes"] = deep_size(obj, exclude) if obj is not None else 0
+        if transcript is not None:
+            report["transcript_messages"] = len(transcript)
+            report["transcript_bytes"] = deep_size(transcript, exclude)
+        return report
+
+    def report(self, top: int = 15) -> dict:
+        """Process, shared component, per-session and allocation-site breakdown of memory use"""
+        gc.collect()
+        sample = self.sample()
+        with self._lock:
+            sessions = list(self._sessions.items())
+        exclude = module_global_ids()
+
+        # Active index versions, plus older ones sessions still hold
+        snapshots = {id(snapshot): snapshot for snapshot in loaded_snapshots()}
+        for system, _ in sessions:
+            snapshot = system.rag.snapshot
+            if snapshot is not None:
+                snapshots[id(snapshot)] = snapshot
+        exclude_index = exclude | set(snapshots)
+        shared = {f"index {snapshot.version}": index_components(snapshot, exclude)
+                  for snapshot in snapshots.values()}
+        # Private module-level containers and project objects: caches, registries, counters
+        singletons = {}
+        modules = {name: module for name, module in list(sys.modules.items())
+                   if (getattr(module, "__file__", None) or "").startswith(_PROJECT_DIR + os.sep)}
+        for name, module in modules.items():
+            for attr, value in list(vars(module).items()):
+                if attr.startswith("_") and not attr.startswith("__") and (
+                        isinstance(value, (dict, list, set, deque)) or type(value).__module__ in modules):
+                    singletons[f"{name}.{attr}"] = deep_size(value, exclude_index - {id(value)})
+        shared["singletons"] = dict(sorted(singletons.items(), key=lambda item: -item[1]))
+
+        session_reports = sorted((self.session_report(system, entry["transcript"], exclude_index)
+                                  for system, entry in sessions), key=lambda r: -r["total_bytes"])
+
+        allocations, growth = [], []
+        if tracemalloc.is_tracing():
+            # The monitor's own bookkeeping (samples, this report) is left out
+            own_files = (os.path.abspath(__file__), tracemalloc.__file__)
+            current = tracemalloc.take_snapshot()
+            by_package = {}
+            for stat in current.statistics("filename"):
+                filename = stat.traceback[0].filename
+                if filename not in own_files:
+                    package = _package_of(filename)
+                    by_package[package] = by_package.get(package, 0) + stat.size
+            allocations = [{"package": package, "bytes": size}
+                           for package, size in sorted(by_package.items(), key=lambda item: -item[1])[:top]]
+            if self._baseline is not None:
+                growth = [{"site": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                           "size_diff_bytes": stat.size_diff, "count_diff": stat.count_diff}
+                          for stat in current.compare_to(self._baseline, "lineno")
+                          if stat.size_diff > 0 and stat.traceback[0].filename not in own_files][:top]
+
+        self.last_report = {
+            "generated_at": time.time(),
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "process": dict(sample, peak_rss_bytes=peak_rss_bytes(), growth_per_hour=self.growth_per_hour()),
+            "shared": shared,
+            "sessions": session_reports,
+            "allocations": allocations,
+            "growth_since_baseline": growth
+        }
+        return self.last_report
+
+    def write_report(self, path: str) -> dict:
+        report = self.report()
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        os.replace(temp_path, path)
+        return report
+
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+
+def get_memory_monitor():
+    """Process-wide memory monitor when MEMORY_PROFILE=true, else None.
+
+    MEMORY_TRACE_FRAMES (tracemalloc depth, 0 = RSS only), MEMORY_SAMPLE_SECONDS
+    and MEMORY_REPORT_FILE (JSON report rewritten after every sample) configure it.
+    """
+    global _monitor
+    if os.getenv("MEMORY_PROFILE", "false").lower() != "true":
+        return None
+    with _monitor_lock:
+        if _monitor is None:
+            _monitor = MemoryMonitor(
+                trace_frames=int(os.getenv("MEMORY_TRACE_FRAMES", "1")),
+                sample_seconds=float(os.getenv("MEMORY_SAMPLE_SECONDS", "60")),
+                report_file=os.getenv("MEMORY_REPORT_FILE") or None
+            ).start()
+        return _monitor
+
+
+def _mb(value) -> str:
+    return "-" if value is None else f"{value / 2 ** 20:.1f}"
+
+
+def format_report(report: dict, top_sessions: int = 10) -> str:
+    process = report["process"]
+    lines = [f"RSS {_mb(process['rss_bytes'])} MB (peak {_mb(process['peak_rss_bytes'])} MB), "
+             f"traced {_mb(process['traced_bytes'])} MB, {process['sessions']} live sessions, "
+             f"up {report['uptime_seconds'] / 3600:.1f} h"]
+    for key, slope in process.get("growth_per_hour", {}).items():
+        lines.append(f"  {key.replace('_bytes', '')} growth: {_mb(slope)} MB/hour")
+    for name, components in report["shared"].items():
+        lines.append(f"\n{name}:")
+        lines += [f"  {component:<48}{_mb(size):>10} MB" for component, size in list(components.items())[:15]]
+    if report["sessions"]:
+        lines.append(f"\nSessions (largest {top_sessions} of {len(report['sessions'])}):")
+        lines.append(f"  {'session':<34}{'total MB':>10}{'history':>9}{'hist MB':>9}{'transcript MB':>15}"
+                     f"{'clients':>9}{'clients MB':>12}")
+        for s in report["sessions"][:top_sessions]:
+            lines.append(f"  {s['session']:<34}{_mb(s['total_bytes']):>10}{s['history_messages']:>9}"
+                         f"{_mb(s['chat_histories_bytes']):>9}{_mb(s.get('transcript_bytes')):>15}"
+                         f"{s['openai_clients']:>9}{_mb(s['openai_clients_bytes']):>12}")
+    if report["allocations"]:
+        lines.append("\nTraced allocations by package:")
+        lines += [f"  {a['package']:<48}{_mb(a['bytes']):>10} MB" for a in report["allocations"]]
+    if report["growth_since_baseline"]:
+        lines.append("\nLargest growth since baseline:")
+        lines += [f"  {g['site']:<70}{g['size_diff_bytes'] / 1024:>10.1f} KB{g['count_diff']:>+9}"
+                  for g in report["growth_since_baseline"]]
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show a memory report written by the running app")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    show_parser = subparsers.add_parser("show", help="Format a MEMORY_REPORT_FILE")
+    show_parser.add_argument("report", nargs="?", default=os.getenv("MEMORY_REPORT_FILE", "memory_report.json"))
+    show_parser.add_argument("--sessions", type=int, default=10, help="Largest sessions to list")
+    args = parser.parse_args()
+
+    with open(args.report, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    print(f"Report from {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(report['generated_at']))}")
+    print(format_report(report, args.sessions))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import numpy as np
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def mmr_select(query_vector, candidate_vectors, k: int, lambda_mult: float = 0.5,
+               sources: list = None, max_per_source: int = None) -> list:
+    """Pick k candidates by maximal marginal relevance.
+
+    query_vector has shape (d,), candidate_vectors (n, d). lambda_mult trades
+    relevance (1.0) against diversity (0.0). When sources and max_per_source
+    are given, no source contributes more than max_per_source picks.
+    Returns candidate indices in selection order.
+    """
+    candidates = _normalize(np.asarray(candidate_vectors, dtype=np.float32))
+    n = candidates.shape[0]
+    if n == 0 or k <= 0:
+        return []
+
+    query = _normalize(np.asarray(query_vector, dtype=np.float32).reshape(1, -1))[0]
+    relevance = candidates @ query
+    # Pairwise similarities computed once; the greedy loop only slices columns
+    similarity = candidates @ candidates.T
+
+    max_similarity = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    source_ids = None
+    source_counts = None
+    if sources is not None and max_per_source:
+        _, source_ids = np.unique(np.asarray(sources, dtype=object).astype(str), return_inverse=True)
+        source_counts = np.zeros(source_ids.max() + 1, dtype=np.int64)
+
+    selected = []
+    while len(selected) < k and available.any():
+        redundancy = np.where(np.isfinite(max_similarity), max_similarity, 0.0)
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+
+        selected.append(best)
+        available[best] = False
+        max_similarity = np.maximum(max_similarity, similarity[:, best])
+
+        if source_counts is not None:
+            source = source_ids[best]
+            source_counts[source] += 1
+            if source_counts[source] >= max_per_source:
+                available &= source_ids != source
+
+    return selected
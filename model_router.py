@@ -0,0 +1,219 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from llm_scheduler import call_context, chat_completion, get_call_context, get_scheduler, is_retryable_error
+from pipeline_budget import DeadlineExceeded
+from single_flight import coalesce, fingerprint
+
+# Model per pipeline stage. Short classification/rewrite prompts go to the small
+# model; answers stay on gpt-4o. Each stage falls back to the other model when
+# its primary's recent p95 latency (seconds) or error rate is over the limit.
+DEFAULT_ROUTES = {
+    "rewrite": {"model": "gpt-4o-mini", "fallback": "gpt-4o", "p95_seconds": 4.0},
+    "relevancy": {"model": "gpt-4o-mini", "fallback": "gpt-4o", "p95_seconds": 4.0},
+    "rag": {"model": "gpt-4o", "fallback": "gpt-4o-mini", "p95_seconds": 15.0},
+    "refinement": {"model": "gpt-4o", "fallback": "gpt-4o-mini", "p95_seconds": 15.0},
+    "general_answer": {"model": "gpt-4o", "fallback": "gpt-4o-mini", "p95_seconds": 15.0}
+}
+DEFAULT_MODEL = "gpt-4o"
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile; 0.0 for no values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+class ModelHealth:
+    """Rolling latency and error samples for one model.
+
+    Samples older than max_age_seconds are ignored, so a model that was routed
+    away from (and therefore gets no new samples) is tried again once its bad
+    samples age out.
+    """
+
+    def __init__(self, window: int = 200, max_age_seconds: float = 300.0):
+        self.max_age_seconds = max_age_seconds
+        self.samples = deque(maxlen=window)
+
+    def add(self, latency: float, failed: bool):
+        self.samples.append((time.monotonic(), latency, failed))
+
+    def recent(self) -> list:
+        cutoff = time.monotonic() - self.max_age_seconds
+        return [sample for sample in self.samples if sample[0] >= cutoff]
+
+    def summary(self) -> dict:
+        recent = self.recent()
+        latencies = [latency for _, latency, failed in recent if not failed]
+        failures = sum(1 for _, _, failed in recent if failed)
+        return {
+            "count": len(recent),
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "error_rate": failures / len(recent) if recent else 0.0
+        }
+
+
+class ModelRouter:
+    """Chooses the chat model for each pipeline stage.
+
+    routes maps stage -> {"model", "fallback", "p95_seconds"}. overrides is a
+    list of route fragments with any of "stage", "category" and "role" to match;
+    the most specific matching override wins, e.g.
+        {"stage": "refinement", "role": "sales", "model": "gpt-4o-mini"}
+    Latency and errors are fed in from scheduler events (see observe).
+    """
+
+    def __init__(self, routes: dict = None, overrides: list = None, min_samples: int = 10,
+                 max_error_rate: float = 0.2, window: int = 200, max_age_seconds: float = 300.0):
+        self.routes = {stage: dict(route) for stage, route in DEFAULT_ROUTES.items()}
+        for stage, route in (routes or {}).items():
+            self.routes[stage] = {**self.routes.get(stage, {}), **route}
+        self.overrides = list(overrides or [])
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self._health = defaultdict(lambda: ModelHealth(window, max_age_seconds))
+        self._degraded = set()
+        self._lock = threading.Lock()
+
+    def observe(self, event: dict):
+        """Scheduler observer: record latency or failure of every chat call"""
+        if event.get("kind") != "chat" or isinstance(event.get("error"), DeadlineExceeded):
+            return
+        with self._lock:
+            self._health[event["model"]].add(event["latency"], event["error"] is not None)
+
+    def route(self, stage: str, category: str = None, role: str = None) -> dict:
+        """Stage route with the most specific matching override applied"""
+        route = dict(self.routes.get(stage, {"model": DEFAULT_MODEL}))
+        wanted = {"stage": stage, "category": category, "role": role}
+        matches = []
+        for override in self.overrides:
+            keys = [key for key in ("stage", "category", "role") if key in override]
+            if all(override[key] == wanted[key] for key in keys):
+                matches.append((len(keys), override))
+        for _, override in sorted(matches, key=lambda match: match[0]):
+            route.update({key: value for key, value in override.items() if key not in wanted})
+        return route
+
+    def is_healthy(self, model: str, p95_seconds: float = None) -> bool:
+        with self._lock:
+            summary = self._health[model].summary()
+        if summary["count"] < self.min_samples:
+            return True
+        if summary["error_rate"] > self.max_error_rate:
+            return False
+        return p95_seconds is None or summary["p95"] <= p95_seconds
+
+    def choose(self, stage: str, category: str = None, role: str = None) -> tuple:
+        """(model, fallback) for a call; category and role default to the call context"""
+        context = get_call_context()
+        category = category if category is not None else context.get("category")
+        role = role if role is not None else context.get("role")
+        route = self.route(stage, category, role)
+        primary, fallback = route["model"], route.get("fallback")
+
+        healthy = self.is_healthy(primary, route.get("p95_seconds"))
+        with self._lock:
+            if not healthy and fallback and primary not in self._degraded:
+                self._degraded.add(primary)
+                print(f"\n🔀 {primary} is slow or failing, routing {stage} to {fallback}")
+            elif healthy and primary in self._degraded:
+                self._degraded.discard(primary)
+                print(f"\n🔀 {primary} recovered, routing {stage} back to it")
+        if not healthy and fallback:
+            return fallback, None
+        return primary, fallback
+
+    def stats(self) -> dict:
+        """Rolling latency/error summary per model and the models currently routed around"""
+        with self._lock:
+            return {
+                "models": {model: health.summary() for model, health in self._health.items()},
+                "degraded": sorted(self._degraded)
+            }
+
+
+def load_routing_config(source: str) -> dict:
+    """Routing config from inline JSON or a JSON file: {"routes": {...}, "overrides": [...]}"""
+    if not source:
+        return {}
+    if os.path.exists(source):
+        with open(source, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return json.loads(source)
+
+
+_router = None
+_router_lock = threading.Lock()
+_observing = False
+
+
+def _observe(event: dict):
+    """The one scheduler observer, forwarding to whichever router is current"""
+    router = _router
+    if router is not None:
+        router.observe(event)
+
+
+def _set_router(router: ModelRouter):
+    global _router, _observing
+    _router = router
+    if not _observing:
+        get_scheduler().add_observer(_observe)
+        _observing = True
+
+
+def get_router() -> ModelRouter:
+    """Process-wide router (MODEL_ROUTES: JSON or path to a JSON file), fed by the shared scheduler"""
+    with _router_lock:
+        if _router is None:
+            config = load_routing_config(os.getenv("MODEL_ROUTES", ""))
+            _set_router(ModelRouter(config.get("routes"), config.get("overrides")))
+        return _router
+
+
+def configure_router(router: ModelRouter) -> ModelRouter:
+    """Replace the process-wide router (offline evaluation, tests); the replaced one stops receiving events"""
+    with _router_lock:
+        _set_router(router)
+    return router
+
+
+def routed_chat_completion(client, stage: str, category: str = None, role: str = None, **kwargs):
+    """chat_completion with the model chosen for the stage; retries once on the fallback model after
+    a timeout, rate limit, 5xx or connection error"""
+    model, fallback = get_router().choose(stage, category, role)
+    return _complete(client, stage, model, fallback, **kwargs)
+
+
+def coalesced_chat_completion(client, stage: str, category: str = None, role: str = None, **kwargs):
+    """routed_chat_completion shared by concurrent callers sending exactly the same request.
+
+    The key is the routed model plus the exact messages and parameters, so
+    requests differing in anything the model sees (another role's prompt, the
+    casing of a product name) never share an answer. The response is shared
+    and must be treated as read-only.
+    """
+    model, fallback = get_router().choose(stage, category, role)
+    key = (model, fingerprint(json.dumps(kwargs, sort_keys=True, ensure_ascii=False)))
+    return coalesce(stage, key, lambda: _complete(client, stage, model, fallback, **kwargs))
+
+
+def _complete(client, stage: str, model: str, fallback: str, **kwargs):
+    with call_context(stage=stage):
+        try:
+            return chat_completion(client, model=model, **kwargs)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            # Invalid requests, auth and content-filter errors would fail the same way on the fallback
+            if not fallback or not (is_retryable_error(e) or isinstance(e, TimeoutError)):
+                raise
+            print(f"\n🔀 {stage} call on {model} failed ({type(e).__name__}), trying {fallback}")
+            return chat_completion(client, model=fallback, **kwargs)
@@ -0,0 +1,113 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a call can no longer finish within the request's deadline"""
+
+
+class StageLatencyModel:
+    """Expected seconds per pipeline stage, tracked as an exponential moving average"""
+
+    DEFAULT_ESTIMATES = {
+        "rewrite": 1.5,
+        "rag": 5.0,
+        "refinement": 6.0,
+        "relevancy": 1.5,
+        "general_answer": 6.0
+    }
+
+    def __init__(self, estimates: dict = None, alpha: float = 0.2):
+        self.estimates = {**self.DEFAULT_ESTIMATES, **(estimates or {})}
+        self.alpha = alpha
+        self._lock = threading.Lock()
+
+    def estimate(self, stage: str) -> float:
+        with self._lock:
+            return self.estimates.get(stage, 1.0)
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            previous = self.estimates.get(stage, seconds)
+            self.estimates[stage] = (1 - self.alpha) * previous + self.alpha * seconds
+
+
+# Shared so every session learns from the latencies the others observe
+shared_latency_model = StageLatencyModel()
+
+
+class PipelineBudget:
+    """End-to-end latency budget for one query, plus a trace of stages and degradations.
+
+    Without a deadline every stage is affordable and the budget only records
+    timings. With one, optional stages ask can_afford() before running and
+    record a degradation when they are skipped or replaced.
+    """
+
+    def __init__(self, deadline_seconds: float = None, latency_model: StageLatencyModel = None):
+        self.deadline_seconds = deadline_seconds
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + deadline_seconds if deadline_seconds else None
+        self.latency_model = latency_model or shared_latency_model
+        self.stages = []
+        self.degradations = []
+        self.speculations = []
+
+    def remaining(self) -> float:
+        """Seconds left, or infinity without a deadline"""
+        if self.expires_at is None:
+            return float("inf")
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def can_afford(self, stage: str, then: tuple = ()) -> bool:
+        """Whether stage, followed by the stages that must still run after it, fits the remaining time"""
+        if self.expires_at is None:
+            return True
+        needed = self.latency_model.estimate(stage) + sum(self.latency_model.estimate(s) for s in then)
+        return self.remaining() >= needed
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a stage; completed stages also update the shared latency estimates"""
+        start = time.monotonic()
+        failed = False
+        try:
+            yield
+        except Exception:
+            failed = True
+            raise
+        finally:
+            seconds = time.monotonic() - start
+            self.stages.append({"stage": name, "seconds": round(seconds, 3), "failed": failed})
+            if not failed:
+                self.latency_model.observe(name, seconds)
+
+    def degrade(self, stage: str, action: str, reason: str = ""):
+        """Record that a stage was skipped or swapped for a local alternative"""
+        remaining = self.remaining()
+        self.degradations.append({
+            "stage": stage,
+            "action": action,
+            "reason": reason,
+            "remaining_seconds": None if remaining == float("inf") else round(remaining, 3)
+        })
+        print(f"\n⚡ Degraded {stage}: {action}" + (f" ({reason})" if reason else ""))
+
+    def speculated(self, kind: str, outcome: str, similarity: float, saved_seconds: float = 0.0):
+        """Record whether work started before its input was final was committed or discarded"""
+        self.speculations.append({
+            "kind": kind,
+            "outcome": outcome,
+            "similarity": round(similarity, 3),
+            "saved_seconds": round(saved_seconds, 3)
+        })
+
+    def trace(self) -> dict:
+        return {
+            "deadline_seconds": self.deadline_seconds,
+            "elapsed_seconds": round(time.monotonic() - self.started_at, 3),
+            "stages": list(self.stages),
+            "degradations": list(self.degradations),
+            "speculations": list(self.speculations)
+        }
@@ -0,0 +1,81 @@
+import threading
+from collections import defaultdict
+from llm_scheduler import count_tokens, get_scheduler
+
+# OpenAI caches prompt prefixes automatically once they reach this many tokens
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+
+class PromptTemplate:
+    """A prompt split into a static part and a per-request part.
+
+    The system message and instructions never change between requests and are
+    sent first, so consecutive calls share a prompt prefix the provider can
+    cache. Only the request part (question, answer, ...) is formatted per call
+    and it always comes last.
+    """
+
+    def __init__(self, name: str, instructions: str, request: str, system: str = None):
+        self.name = name
+        self.system = system
+        self.instructions = instructions.strip()
+        self.request = request.strip()
+
+    def messages(self, **values) -> list:
+        messages = [{"role": "system", "content": self.system}] if self.system else []
+        messages.append({"role": "user", "content": f"{self.instructions}\n\n{self.request.format(**values)}"})
+        return messages
+
+    def prefix_tokens(self, model: str = "gpt-4o") -> int:
+        """Tokens in the static prefix shared by every request"""
+        return count_tokens(model, (self.system or "") + self.instructions)
+
+
+class PromptCacheStats:
+    """Scheduler observer totalling prompt and cached prompt tokens per stage and model"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = defaultdict(lambda: {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0})
+
+    def observe(self, event: dict):
+        usage = getattr(event.get("response"), "usage", None)
+        if event.get("kind") != "chat" or usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None) or 0
+        key = (event["context"].get("stage", "unknown"), event["model"])
+        with self._lock:
+            totals = self._totals[key]
+            totals["requests"] += 1
+            totals["prompt_tokens"] += usage.prompt_tokens or 0
+            totals["cached_tokens"] += cached
+
+    def stats(self) -> dict:
+        """{"stage/model": {requests, prompt_tokens, cached_tokens, hit_rate}}"""
+        with self._lock:
+            return {
+                f"{stage}/{model}": {
+                    **totals,
+                    "hit_rate": totals["cached_tokens"] / totals["prompt_tokens"] if totals["prompt_tokens"] else 0.0
+                }
+                for (stage, model), totals in self._totals.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._totals.clear()
+
+
+_cache_stats = None
+_cache_stats_lock = threading.Lock()
+
+
+def get_prompt_cache_stats() -> PromptCacheStats:
+    """Process-wide cached-token counters, fed by the shared scheduler"""
+    global _cache_stats
+    with _cache_stats_lock:
+        if _cache_stats is None:
+            _cache_stats = PromptCacheStats()
+            get_scheduler().add_observer(_cache_stats.observe)
+        return _cache_stats
@@ -1,101 +1,102 @@
 from openai import OpenAI
+from model_router import coalesced_chat_completion
 import os
 from relevancy_checker import RelevancyChecker
+from pipeline_budget import PipelineBudget
+from prompt_templates import PromptTemplate
+
+# Static instructions come first and the question/answer last, so requests of the
+# same role share a prompt prefix that the provider can cache
+IOL_CONTEXT = """Note: For IOL-related queries, only provide information about the Precizon Presbyopic NVA lens.
+If the question is about any other IOL, inform that you can only discuss the Precizon Presbyopic NVA."""
+
+GENERAL_INSTRUCTIONS = {
+    "doctor": """You are a professional medical assistant specializing in ophthalmology.
+Answer the question below with precise, technical information focusing on clinical relevance,
+specifications, and evidence-based practices. Be direct and concise.""",
+
+    "sales": """You are a knowledgeable medical device sales assistant specializing in ophthalmology.
+For every medical or technical term used, provide a simple explanation in parentheses.
+Break down complex concepts into easily understandable parts.
+
+Structure your response in a way that helps sales representatives understand and explain the concepts to others:
+1. Simple explanation first
+2. Key benefits and features
+3. How to explain this to doctors
+4. Common questions and answers"""
+}
+
+GENERAL_TEMPLATES = {
+    (role, iols): PromptTemplate(
+        f"general/{role}{'/iols' if iols else ''}",
+        instructions + (f"\n\n{IOL_CONTEXT}" if iols else ""),
+        "Question: {query}\n\nResponse:"
+    )
+    for role, instructions in GENERAL_INSTRUCTIONS.items() for iols in (False, True)
+}
+
+REFINEMENT_TEMPLATES = {
+    "doctor": PromptTemplate("refinement/doctor", """Refine the knowledge base response below for medical professionals.
+Remove any metadata or instructional text about the format itself.
+
+Rules:
+1. Preserve all technical specifications and clinical details
+2. Maintain medical terminology
+3. Structure the information logically
+4. Remove any text about the format or presentation itself
+5. Focus only on the medical/technical content""", """Original Question: {query}
+Technical Response: {kb_response}
+
+Refined response:"""),
+
+    "sales": PromptTemplate("refinement/sales", """Transform the technical response below into a sales-friendly format.
+Remove any metadata or instructional text about the format itself.
+
+Structure your response as follows:
+1. Simple Explanation
+2. Key Benefits and Features
+3. How to Present to Doctors
+4. Common Questions and Answers
+
+Rules:
+1. Keep language accessible
+2. Explain technical terms in parentheses
+3. Focus on benefits and value
+4. Remove any text about the format or presentation itself""", """Original Question: {query}
+Technical Response: {kb_response}
+
+Response:""")
+}
 
 class QueryMerger:
     def __init__(self, openai_api_key: str):
-        self.client = OpenAI(api_key=openai_api_key)
+        self.client = OpenAI(api_key=openai_api_key, max_retries=0)  # Retries are handled by the LLM scheduler
         self.relevancy_checker = RelevancyChecker(openai_api_key)
         
-    def _get_role_specific_prompt(self, role: str, query: str, category: str = None) -> str:
-        """Get role-specific prompt for general queries"""
-        # Add IOL-specific context if in IOL mode
-        iol_context = """Note: For IOL-related queries, only provide information about the Precizon Presbyopic NVA lens. 
-        If the question is about any other IOL, inform that you can only discuss the Precizon Presbyopic NVA.""" if category == "iols" else ""
-        
-        prompts = {
-            "doctor": f"""You are a professional medical assistant specializing in ophthalmology.
-            Answer the following question with precise, technical information focusing on clinical relevance,
-            specifications, and evidence-based practices. Be direct and concise.
-            
-            {iol_context}
-            
-            Question: {query}
-            
-            Response:""",
-            
-            "sales": f"""You are a knowledgeable medical device sales assistant specializing in ophthalmology.
-            For every medical or technical term used, provide a simple explanation in parentheses.
-            Break down complex concepts into easily understandable parts.
-            
-            Structure your response in a way that helps sales representatives understand and explain the concepts to others:
-            1. Simple explanation first
-            2. Key benefits and features
-            3. How to explain this to doctors
-            4. Common questions and answers
-            
-            {iol_context}
-            
-            Question: {query}
-            
-            Response:"""
-        }
-        return prompts.get(role, prompts["doctor"])
+    def _get_role_specific_template(self, role: str, category: str = None) -> PromptTemplate:
+        """Get role-specific prompt template for general queries"""
+        key = (role if role in GENERAL_INSTRUCTIONS else "doctor", category == "iols")
+        return GENERAL_TEMPLATES[key]
 
-    def _get_kb_refinement_prompt(self, role: str, query: str, kb_response: str, category: str = None) -> str:
-        """Get role-specific prompt for KB response refinement"""
-        prompts = {
-            "doctor": f"""Refine this knowledge base response for medical professionals.
-            Remove any metadata or instructional text about the format itself.
-            
-            Original Question: {query}
-            Technical Response: {kb_response}
-            
-            Rules:
-            1. Preserve all technical specifications and clinical details
-            2. Maintain medical terminology
-            3. Structure the information logically
-            4. Remove any text about the format or presentation itself
-            5. Focus only on the medical/technical content
-            
-            Refined response:""",
-            
-            "sales": f"""Transform this technical response into a sales-friendly format.
-            Remove any metadata or instructional text about the format itself.
-            
-            Original Question: {query}
-            Technical Response: {kb_response}
-            
-            Structure your response as follows:
-            1. Simple Explanation
-            2. Key Benefits and Features
-            3. How to Present to Doctors
-            4. Common Questions and Answers
-            
-            Rules:
-            1. Keep language accessible
-            2. Explain technical terms in parentheses
-            3. Focus on benefits and value
-            4. Remove any text about the format or presentation itself
-            
-            Response:"""
-        }
-        return prompts.get(role, prompts["doctor"])
+    def _get_kb_refinement_template(self, role: str, category: str = None) -> PromptTemplate:
+        """Get role-specific prompt template for KB response refinement"""
+        return REFINEMENT_TEMPLATES.get(role, REFINEMENT_TEMPLATES["doctor"])
         
     def process_general_query(self, query: str, role: str = "doctor", category: str = None) -> str:
         """Handle general queries using GPT-4"""
         try:
-            prompt = self._get_role_specific_prompt(role, query, category)
+            template = self._get_role_specific_template(role, category)
             
             print(f"\n🤖 Sending general query to ChatGPT: {query[:100]}...")
-            response = self.client.chat.completions.create(
-                messages=[{"role": "user", "content": prompt}],
-                model="gpt-4o",
+            return coalesced_chat_completion(
+                self.client,
+                "general_answer",
+                category=category,
+                role=role,
+                messages=template.messages(query=query),
                 temperature=0.3,
                 max_tokens=1200
-            )
-            
-            return response.choices[0].message.content.strip()
+            ).choices[0].message.content.strip()
             
         except Exception as e:
             print(f"Error in general query processing: {str(e)}")
@@ -104,29 +105,39 @@ class QueryMerger:
     def process_kb_response(self, query: str, kb_response: str, role: str = "doctor", category: str = None) -> str:
         """Process and refine knowledge base responses"""
         try:
-            prompt = self._get_kb_refinement_prompt(role, query, kb_response, category)
+            template = self._get_kb_refinement_template(role, category)
             
             print(f"\n🤖 Sending KB response to ChatGPT for refinement...")
-            response = self.client.chat.completions.create(
-                messages=[{"role": "user", "content": prompt}],
-                model="gpt-4o",
+            return coalesced_chat_completion(
+                self.client,
+                "refinement",
+                category=category,
+                role=role,
+                messages=template.messages(query=query, kb_response=kb_response),
                 temperature=0.3,
                 max_tokens=1200
-            )
-            
-            return response.choices[0].message.content.strip()
+            ).choices[0].message.content.strip()
             
         except Exception as e:
             print(f"Error in KB response processing: {str(e)}")
             return kb_response  # Return original response if processing fails
     
-    def get_response(self, query: str, category: str = None, kb_response: str = None, role: str = "doctor") -> str:
+    def get_response(self, query: str, category: str = None, kb_response: str = None, role: str = "doctor",
+                     budget: PipelineBudget = None) -> str:
         """Main method to get appropriate response based on query type and user role"""
+        # Without a deadline the budget only records stage timings
+        budget = budget or PipelineBudget()
         try:
             # For general mode
             if category is None:
-                initial_response = self.process_general_query(query, role)
-                is_relevant, explanation = self.relevancy_checker.is_ophthalmology_related(query, initial_response)
+                with budget.stage("general_answer"):
+                    initial_response = self.process_general_query(query, role)
+                if budget.can_afford("relevancy"):
+                    with budget.stage("relevancy"):
+                        is_relevant, explanation = self.relevancy_checker.is_ophthalmology_related(query, initial_response)
+                else:
+                    budget.degrade("relevancy", "local_keywords", "not enough time for the LLM check")
+                    is_relevant, explanation = self.relevancy_checker.is_ophthalmology_related_local(query)
                 
                 if not is_relevant:
                     return (
@@ -150,10 +161,21 @@ class QueryMerger:
                         "2. Switch to General mode to explore broader ophthalmology concepts related to your question."
                     )
                     
-                processed_response = self.process_kb_response(query, kb_response, role, category)
+                if budget.can_afford("refinement"):
+                    with budget.stage("refinement"):
+                        processed_response = self.process_kb_response(query, kb_response, role, category)
+                else:
+                    budget.degrade("refinement", "skipped", "returning the knowledge base answer unrefined")
+                    processed_response = kb_response
                 
                 # Check relevancy of both question and response
-                is_relevant, explanation = self.relevancy_checker.is_ophthalmology_related(query, processed_response, category)
+                if budget.can_afford("relevancy"):
+                    with budget.stage("relevancy"):
+                        is_relevant, explanation = self.relevancy_checker.is_ophthalmology_related(query, processed_response, category)
+                else:
+                    # The answer is grounded in chunks that passed the retrieval distance cutoff
+                    budget.degrade("relevancy", "skipped", "answer grounded in retrieved knowledge base chunks")
+                    is_relevant, explanation = True, ""
                 
                 if not is_relevant:
                     return (
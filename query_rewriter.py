@@ -1,20 +1,29 @@
 from openai import OpenAI
+from model_router import coalesced_chat_completion
+from rewrite_cache import RewriteCache, get_shared_cache
+from prompt_templates import PromptTemplate
+import re
 
-class QueryRewriter:
-    def __init__(self, openai_api_key: str):
-        self.client = OpenAI(api_key=openai_api_key)
-    
-    def rewrite_query(self, query: str, history: list, category: str = None) -> str:
-        try:
-            print(f"\nQuery Rewrite - Original: '{query}'")
-            
-            # If no history, only expand abbreviations
-            if not history:
-                print("Query Rewrite - No history available, only expanding abbreviations")
-                messages = [
-                    {"role": "system", "content": "You are an expert ophthalmologist. Expand ophthalmology-specific abbreviations to their complete medical terms."},
-                    {"role": "user", "content": f"""
-Important Context:
+# Local fallback for the abbreviation-only rewrite (same terms as the rewrite prompt)
+OPHTHALMIC_ABBREVIATIONS = {
+    "CTRs": "capsular tension rings",
+    "CTR": "capsular tension ring",
+    "IOLs": "intraocular lenses",
+    "IOL": "intraocular lens",
+    "EDOF": "extended depth of focus",
+    "VA": "visual acuity",
+    "IOP": "intraocular pressure"
+}
+_ABBREVIATION_PATTERN = re.compile(r"\b(" + "|".join(OPHTHALMIC_ABBREVIATIONS) + r")\b")
+
+def expand_abbreviations(query: str) -> str:
+    """Expand known ophthalmology abbreviations without calling the model"""
+    return _ABBREVIATION_PATTERN.sub(lambda match: OPHTHALMIC_ABBREVIATIONS[match.group(1)], query)
+
+# Rewrite prompts: static rules first, history and question last (stable cacheable prefix)
+EXPAND_TEMPLATE = PromptTemplate(
+    "rewrite/expand",
+    """Important Context:
 - Examples of ophthalmology-specific expansions:
   * CTR → capsular tension ring (not click-through rate)
   * IOL → intraocular lens
@@ -25,68 +34,96 @@ Important Context:
 Rules:
 - ONLY expand ophthalmology-related abbreviations to their full medical terms
 - Do NOT change anything else in the question
-- Do NOT add any additional context
+- Do NOT add any additional context""",
+    """Question: {query}
+
+Expanded question (only expand abbreviations):""",
+    system="You are an expert ophthalmologist. Expand ophthalmology-specific abbreviations to their complete medical terms."
+)
+
+FOLLOWUP_REQUEST = """Last exchange:
+{history}
 
 Question: {query}
 
-Expanded question (only expand abbreviations):"""}
-                ]
-            else:
-                # With history, do minimal rewriting
-                print(f"Query Rewrite - Using history context for minimal rewrite")
-                formatted_history = "\n".join([
-                    f"User: {msg['content'] if msg['role'] == 'user' else ''}\nAssistant: {msg['content'] if msg['role'] == 'assistant' else ''}"
-                    for msg in history[-2:]
-                ])
-                
-                # Adjust system message and rules based on category
-                if category == "iols":
-                    system_message = "You are an expert ophthalmologist specializing in the Precizon Presbyopic NVA IOL."
-                    rules = """Rules:
+Rewritten question (minimal changes only):"""
+
+FOLLOWUP_TEMPLATES = {
+    "iols": PromptTemplate(
+        "rewrite/followup/iols",
+        """Rules:
 - Replace "this lens", "this IOL", "the lens", "the IOL" with "the Precizon Presbyopic NVA IOL"
 - Replace pronouns with terms from the immediate last exchange
 - Expand ophthalmology abbreviations
 - Keep the rewrite minimal and focused
 - Do NOT add any medical context or assumptions
-- Do NOT elaborate beyond the original question's scope"""
-                else:
-                    system_message = "You are an expert ophthalmologist."
-                    rules = """Rules:
+- Do NOT elaborate beyond the original question's scope""",
+        FOLLOWUP_REQUEST,
+        system="You are an expert ophthalmologist specializing in the Precizon Presbyopic NVA IOL."
+    ),
+    None: PromptTemplate(
+        "rewrite/followup",
+        """Rules:
 - Replace pronouns ONLY with terms from the immediate last exchange
 - Expand ONLY ophthalmology abbreviations
 - Keep the rewrite minimal and focused
 - Do NOT add any medical context or assumptions
-- Do NOT elaborate beyond the original question's scope"""
-                
-                messages = [
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": f"""
-Last exchange:
-{formatted_history}
+- Do NOT elaborate beyond the original question's scope""",
+        FOLLOWUP_REQUEST,
+        system="You are an expert ophthalmologist."
+    )
+}
 
-{rules}
-
-Question: {query}
-
-Rewritten question (minimal changes only):"""}
-                ]
+class QueryRewriter:
+    def __init__(self, openai_api_key: str, cache: RewriteCache = None):
+        self.client = OpenAI(api_key=openai_api_key, max_retries=0)  # Retries are handled by the LLM scheduler
+        self.cache = cache if cache is not None else get_shared_cache()
+    
+    def rewrite_query(self, query: str, history: list, category: str = None) -> str:
+        try:
+            print(f"\nQuery Rewrite - Original: '{query}'")
+            
+            cache_key = self.cache.make_key(query, category, history)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                print(f"Query Rewrite - Cache hit: '{cached}'")
+                return cached
             
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
+            # If no history, only expand abbreviations
+            if not history:
+                print("Query Rewrite - No history available, only expanding abbreviations")
+                messages = EXPAND_TEMPLATE.messages(query=query)
+            else:
+                # With history, do minimal rewriting
+                print(f"Query Rewrite - Using history context for minimal rewrite")
+                formatted_history = "\n".join([
+                    f"User: {msg['content'] if msg['role'] == 'user' else ''}\nAssistant: {msg['content'] if msg['role'] == 'assistant' else ''}"
+                    for msg in history[-2:]
+                ])
+                
+                # Adjust system message and rules based on category
+                template = FOLLOWUP_TEMPLATES.get(category, FOLLOWUP_TEMPLATES[None])
+                messages = template.messages(history=formatted_history, query=query)
+            
+            # Concurrent identical rewrites (same prompt, so same question, category and last exchange) share one call
+            rewritten_query = coalesced_chat_completion(
+                self.client,
+                "rewrite",
+                category=category,
                 messages=messages,
                 temperature=0
-            )
-            
-            rewritten_query = response.choices[0].message.content.strip()
+            ).choices[0].message.content.strip()
             
             if rewritten_query and rewritten_query != query:
                 print(f"Query Rewrite - Modified: '{rewritten_query}'")
                 print("Query Rewrite - Changes made:")
                 print(f"  - Original: '{query}'")
                 print(f"  - Modified: '{rewritten_query}'")
+                self.cache.set(cache_key, rewritten_query)
                 return rewritten_query
             
             print("Query Rewrite - No changes needed")
+            self.cache.set(cache_key, query)
             return query
             
         except Exception as e:
@@ -1,32 +1,165 @@
 import os
 import pickle
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+import numpy as np
 from dotenv import load_dotenv
 from openai import OpenAI
-from langchain_openai import OpenAIEmbeddings
+from langchain_core.embeddings import Embeddings
+from llm_scheduler import call_context
+from pipeline_budget import DeadlineExceeded
+from model_router import coalesced_chat_completion
 from langchain_community.vectorstores import FAISS
 from query_rewriter import QueryRewriter
+from mmr import mmr_select
+from index_meta import read_index_meta, check_index_compatible, embeddings_backend_of
+from embedding_backends import make_embeddings
+from ann_index import configure_search
+from index_registry import get_index_reloader
+from single_flight import coalesce, normalize_text
+from answer_bank import load_answer_bank
+from rewrite_cache import get_shared_cache
+from context_compression import SENTENCE_VECTORS_FILE, compress_documents
+from working_set import WorkingSet, get_working_set_stats
 import time  # Add at the top with other imports
 
 # Load environment variables
 load_dotenv()
 
+@dataclass(frozen=True)
+class IndexSnapshot:
+    """One loaded index version; swapped as a whole so a query never mixes versions"""
+    version: str
+    path: str
+    vector_store: FAISS
+    embeddings: Embeddings
+    metadata: object
+    index_meta: dict
+    # Precomputed answers built against this version (answer_bank.py), if any
+    answer_bank: object = None
+    # Normalised sentence embeddings of the chunks (memory-mapped), for context compression
+    sentence_vectors: object = None
+
+@dataclass(frozen=True)
+class Retrieval:
+    """Chunks retrieved ahead of generation, with what is needed to generate from them later"""
+    snapshot: IndexSnapshot
+    query_text: str
+    scored_docs: list
+    embedding: list
+
+def load_index_snapshot(version: str, version_dir: str) -> IndexSnapshot:
+    """Load the vector store, metadata and matching query embeddings from one index directory"""
+    # Query embeddings must use the backend, model and dimension the index was built with
+    index_meta = read_index_meta(version_dir)
+    embeddings = make_embeddings(
+        embeddings_backend_of(index_meta),
+        index_meta["embeddings_model"],
+        dimensions=index_meta["dimensions"] if index_meta.get("shortened") else None
+    )
+    
+    # Load vector store
+    vector_store = FAISS.load_local(
+        version_dir,
+        embeddings,
+        allow_dangerous_deserialization=True
+    )
+    check_index_compatible(index_meta, index_dimension=vector_store.index.d)
+    # HNSW efSearch / IVF nprobe as recorded at build time
+    configure_search(vector_store.index, index_meta)
+    
+    # Load metadata
+    metadata_path = os.path.join(version_dir, "metadata.pkl")
+    if os.path.exists(metadata_path):
+        with open(metadata_path, 'rb') as f:
+            metadata = pickle.load(f)
+    else:
+        print(f"Warning: Metadata file not found at {metadata_path}")
+        metadata = {}
+    
+    sentence_vectors = None
+    sentence_vectors_path = os.path.join(version_dir, SENTENCE_VECTORS_FILE)
+    if os.path.exists(sentence_vectors_path):
+        sentence_vectors = np.load(sentence_vectors_path, mmap_mode="r")
+        if sentence_vectors.ndim != 2 or sentence_vectors.shape[1] != vector_store.index.d:
+            print(f"Warning: ignoring sentence vectors of shape {sentence_vectors.shape}")
+            sentence_vectors = None
+    
+    answer_bank = load_answer_bank(version_dir, index_meta)
+    if answer_bank is not None:
+        warmed = answer_bank.warm_rewrite_cache(get_shared_cache())
+        print(f"\n📦 Loaded answer bank ({len(answer_bank)} answers, {warmed} rewrites warmed)")
+    
+    print(f"\n📚 Loaded index version {version} ({vector_store.index.ntotal} chunks)")
+    return IndexSnapshot(version, version_dir, vector_store, embeddings, metadata, index_meta, answer_bank,
+                         sentence_vectors)
+
+def release_snapshot_caches(old_snapshot: IndexSnapshot, new_snapshot: IndexSnapshot):
+    """Index release hook: forget the rewrites the replaced version's answer bank warmed"""
+    if old_snapshot is None or old_snapshot.answer_bank is None:
+        return
+    released = old_snapshot.answer_bank.release_rewrite_cache(get_shared_cache(), keep=new_snapshot.answer_bank)
+    if released:
+        print(f"\n🧹 Released {released} rewrites warmed by index version {old_snapshot.version}")
+
 class RAGQuery:
-    def __init__(self, index_path: str = ".", debug: bool = False):
+    # Default retrieval settings (FAISS L2 distances, lower is better)
+    DEFAULT_MAX_DISTANCE = 1.2
+    DEFAULT_SCORE_GAP = 0.15
+    # MMR re-ranking defaults
+    DEFAULT_FETCH_K = 24
+    DEFAULT_MMR_LAMBDA = 0.5
+
+    def __init__(self, index_path: str = ".", debug: bool = False,
+                 max_distance: float = None, score_gap: float = None, min_k: int = 1,
+                 use_mmr: bool = None, fetch_k: int = None, mmr_lambda: float = None,
+                 max_per_source: int = None, embedding_dimensions: int = None, embedding_backend: str = None):
         self.index_path = index_path
-        self.metadata_path = "metadata.pkl"  # Changed to direct file name
         self.debug = debug
+        # Chunks further than max_distance from the query are never sent to the LLM.
+        # Override with RAG_MAX_DISTANCE / RAG_SCORE_GAP (see calibrate_threshold.py)
+        self.max_distance = max_distance if max_distance is not None else float(
+            os.getenv("RAG_MAX_DISTANCE", self.DEFAULT_MAX_DISTANCE))
+        self.score_gap = score_gap if score_gap is not None else float(
+            os.getenv("RAG_SCORE_GAP", self.DEFAULT_SCORE_GAP))
+        self.min_k = min_k
+        # Optional diversity re-ranking over a larger candidate pool (RAG_USE_MMR=true)
+        self.use_mmr = use_mmr if use_mmr is not None else os.getenv("RAG_USE_MMR", "false").lower() == "true"
+        self.fetch_k = fetch_k or int(os.getenv("RAG_FETCH_K", self.DEFAULT_FETCH_K))
+        self.mmr_lambda = mmr_lambda if mmr_lambda is not None else float(
+            os.getenv("RAG_MMR_LAMBDA", self.DEFAULT_MMR_LAMBDA))
+        # Maximum number of chunks taken from one PDF (RAG_MAX_PER_SOURCE, unset = no cap)
+        self.max_per_source = max_per_source or int(os.getenv("RAG_MAX_PER_SOURCE", "0")) or None
+        # last_retrieval / last_compression are kept per thread, so speculative work never overwrites them
+        self._local = threading.local()
+        # Trim retrieved chunks to the sentences closest to the question (RAG_COMPRESS=true; needs
+        # an index built with sentence vectors): the top RAG_COMPRESS_KEEP share plus RAG_COMPRESS_WINDOW neighbours
+        self.compress = os.getenv("RAG_COMPRESS", "false").lower() == "true"
+        self.compress_keep = float(os.getenv("RAG_COMPRESS_KEEP", "0.4"))
+        self.compress_window = int(os.getenv("RAG_COMPRESS_WINDOW", "1"))
+        # Follow-ups are scored against the last RAG_WORKING_SET_SIZE chunks this session retrieved
+        # (RAG_WORKING_SET=true); the index is searched when none is within RAG_WORKING_SET_MAX_DISTANCE
+        use_working_set = os.getenv("RAG_WORKING_SET", "false").lower() == "true"
+        self.working_set = WorkingSet(int(os.getenv("RAG_WORKING_SET_SIZE", "48"))) if use_working_set else None
+        self.working_set_max_distance = float(os.getenv("RAG_WORKING_SET_MAX_DISTANCE", "0.9"))
+        self.working_set_stats = get_working_set_stats()
+        # Query embedding size; must match the index (RAG_EMBEDDING_DIMENSIONS, unset = use the index's)
+        self.embedding_dimensions = embedding_dimensions or int(os.getenv("RAG_EMBEDDING_DIMENSIONS", "0")) or None
+        # Expected embedding backend (RAG_EMBEDDING_BACKEND, unset = whichever built the index)
+        self.embedding_backend = embedding_backend or os.getenv("RAG_EMBEDDING_BACKEND") or None
+        # The active index version; queries pin it per thread so a hot swap never affects them
+        self._snapshot = None
+        self._pinned = threading.local()
+        # The last query embedding per thread, reused by later stages of the same query
+        self._last_embedding = threading.local()
+        self.reloader = None
         try:
             api_key = os.getenv("OPENAI_API_KEY")
             if not api_key or not (api_key.startswith("sk-") or api_key.startswith("sk-proj-")):
                 raise ValueError("Invalid OpenAI API key format. Key should start with 'sk-' or 'sk-proj-'")
             
-            self.embeddings = OpenAIEmbeddings(
-                model="text-embedding-3-small",
-                openai_api_key=api_key
-            )
-            self.client = OpenAI(api_key=api_key)
-            self.vector_store = None
-            self.metadata = None
+            self.client = OpenAI(api_key=api_key, max_retries=0)  # Retries are handled by the LLM scheduler
             self.query_rewriter = QueryRewriter(api_key)
             self.chat_history = []
             self.load_resources()
@@ -35,41 +168,325 @@ class RAGQuery:
             raise
 
     def load_resources(self):
-        """Load existing vector store and metadata"""
+        """Attach to the active index version, shared by every RAGQuery on the same index path"""
         try:
             # Check if running on Streamlit Cloud
             is_streamlit = os.getenv('STREAMLIT_RUNTIME_ENV') is not None
             
             if is_streamlit:
                 # Use relative paths for Streamlit Cloud
-                vector_path = "."
-                metadata_path = "metadata.pkl"
+                index_root = self.index_path
             else:
                 # Use absolute paths for local development
-                vector_path = os.path.abspath(".")
-                metadata_path = os.path.abspath("metadata.pkl")
-            
-            # Load vector store
-            self.vector_store = FAISS.load_local(
-                vector_path,
-                self.embeddings,
-                allow_dangerous_deserialization=True
-            )
+                index_root = os.path.abspath(self.index_path)
             
-            # Load metadata
-            if os.path.exists(metadata_path):
-                with open(metadata_path, 'rb') as f:
-                    self.metadata = pickle.load(f)
-            else:
-                print(f"Warning: Metadata file not found at {metadata_path}")
-                self.metadata = {}
+            # Versioned indexes (<root>/CURRENT) are hot-swapped; a flat index is loaded as is
+            self.reloader = get_index_reloader(index_root, load_index_snapshot)
+            snapshot = self.reloader.current_snapshot()
+            check_index_compatible(snapshot.index_meta, requested_dimensions=self.embedding_dimensions,
+                                   requested_backend=self.embedding_backend)
+            self._snapshot = snapshot
+            self.reloader.register(self)
+            self.reloader.add_release_hook(release_snapshot_caches)
+            self.reloader.add_release_hook(self.release_caches)
                 
         except Exception as e:
             print(f"Error loading resources: {str(e)}")
             raise
 
-    def query(self, query_text: str, category: str = None, k: int = 6, skip_rewrite: bool = False):
-        """Query the vector store and get response from ChatGPT"""
+    def swap_resources(self, snapshot: IndexSnapshot):
+        """Atomically switch to a new index version; in-flight queries finish on the old one"""
+        check_index_compatible(snapshot.index_meta, requested_dimensions=self.embedding_dimensions,
+                               requested_backend=self.embedding_backend)
+        self._snapshot = snapshot
+
+    def release_caches(self, old_snapshot: IndexSnapshot, new_snapshot: IndexSnapshot):
+        """Index release hook: drop this session's chunks and query embeddings from the old version"""
+        if self.working_set is not None:
+            self.working_set.clear()
+        # Every thread's remembered embedding goes with the old thread-local
+        self._last_embedding = threading.local()
+
+    @property
+    def snapshot(self) -> IndexSnapshot:
+        """The index version this thread should use"""
+        return getattr(self._pinned, "snapshot", None) or self._snapshot
+
+    @contextmanager
+    def pinned_snapshot(self, snapshot: IndexSnapshot = None):
+        """Keep using the current (or the given) index version for the duration of one query"""
+        if getattr(self._pinned, "snapshot", None) is not None:
+            yield self._pinned.snapshot
+            return
+        self._pinned.snapshot = snapshot or self._snapshot
+        try:
+            yield self._pinned.snapshot
+        finally:
+            self._pinned.snapshot = None
+
+    @property
+    def vector_store(self):
+        return self.snapshot.vector_store if self.snapshot else None
+
+    @property
+    def embeddings(self):
+        return self.snapshot.embeddings if self.snapshot else None
+
+    @property
+    def metadata(self):
+        return self.snapshot.metadata if self.snapshot else None
+
+    @property
+    def index_meta(self) -> dict:
+        return self.snapshot.index_meta if self.snapshot else None
+
+    @property
+    def index_version(self) -> str:
+        return self.snapshot.version if self.snapshot else None
+
+    @property
+    def answer_bank(self):
+        return self.snapshot.answer_bank if self.snapshot else None
+
+    @property
+    def last_retrieval(self) -> list:
+        """(document, distance) pairs of this thread's latest retrieval"""
+        return getattr(self._local, "retrieval", [])
+
+    @last_retrieval.setter
+    def last_retrieval(self, scored_docs: list):
+        self._local.retrieval = scored_docs
+
+    @property
+    def last_compression(self):
+        """Statistics of this thread's latest context compression, if it compressed"""
+        return getattr(self._local, "compression", None)
+
+    @last_compression.setter
+    def last_compression(self, stats):
+        self._local.compression = stats
+
+    def embed_query(self, query_text: str) -> list:
+        """Query embedding; identical concurrent questions against the same index share one API call"""
+        key = (self.snapshot.path, normalize_text(query_text))
+        last = getattr(self._last_embedding, "value", None)
+        if last is not None and last[0] == key:
+            return last[1]
+        with call_context(stage="embedding"):
+            embedding = coalesce("embedding", key, lambda: self.embeddings.embed_query(query_text))
+        self._last_embedding.value = (key, embedding)
+        return embedding
+
+    def search_with_scores(self, query_text: str, category: str = None, k: int = 6):
+        """Return the k nearest chunks as (document, distance) pairs, closest first"""
+        embedding = self.embed_query(query_text)
+        if category:
+            return self.vector_store.similarity_search_with_score_by_vector(
+                embedding,
+                k=k,
+                filter={"category": category}
+            )
+        return self.vector_store.similarity_search_with_score_by_vector(embedding, k=k)
+
+    def select_adaptive(self, scored_docs: list, k: int = 6) -> list:
+        """Drop chunks beyond the distance cutoff and stop at the first large score gap"""
+        passing = [(doc, score) for doc, score in scored_docs if score <= self.max_distance]
+        if not passing:
+            return []
+
+        selected = [passing[0]]
+        for (_, prev_score), (doc, score) in zip(passing, passing[1:]):
+            if len(selected) >= k:
+                break
+            if len(selected) >= self.min_k and score - prev_score > self.score_gap:
+                break
+            selected.append((doc, score))
+        return selected
+
+    def search_candidates(self, query_text: str, category: str = None, fetch_k: int = 24):
+        """Return up to fetch_k (document, distance, vector, index id) candidates, closest first,
+        together with the query vector.
+
+        Candidate vectors are reconstructed from the FAISS index rather than
+        re-embedded, so only the query itself costs an embedding call.
+        """
+        query_vector = np.asarray(self.embed_query(query_text), dtype=np.float32)
+        index = self.vector_store.index
+        # Over-fetch when filtering by category, like FAISS.similarity_search does
+        search_k = min(index.ntotal, fetch_k * 4 if category else fetch_k)
+        if search_k == 0:
+            return [], query_vector
+        distances, ids = index.search(query_vector.reshape(1, -1), search_k)
+
+        candidates = []
+        for index_id, distance in zip(ids[0], distances[0]):
+            if index_id == -1:
+                continue
+            docstore_id = self.vector_store.index_to_docstore_id[int(index_id)]
+            doc = self.vector_store.docstore.search(docstore_id)
+            if category and doc.metadata.get("category") != category:
+                continue
+            candidates.append((doc, float(distance), int(index_id)))
+            if len(candidates) >= fetch_k:
+                break
+
+        if not candidates:
+            return [], query_vector
+        vectors = index.reconstruct_batch(np.array([index_id for _, _, index_id in candidates], dtype=np.int64))
+        return [(doc, distance, vector, index_id)
+                for (doc, distance, index_id), vector in zip(candidates, vectors)], query_vector
+
+    def cap_per_source(self, scored_docs: list) -> list:
+        """Keep at most max_per_source chunks from each source document"""
+        if not self.max_per_source:
+            return scored_docs
+        counts = {}
+        capped = []
+        for doc, score in scored_docs:
+            source = doc.metadata.get("source", "unknown")
+            if counts.get(source, 0) < self.max_per_source:
+                counts[source] = counts.get(source, 0) + 1
+                capped.append((doc, score))
+        return capped
+
+    def retrieve_mmr(self, query_text: str, category: str = None, k: int = 6) -> list:
+        """Distance cutoff, then MMR diversity selection over a larger candidate pool"""
+        candidates, query_vector = self.search_candidates(
+            query_text, category=category, fetch_k=max(self.fetch_k, k))
+        return self.select_mmr(candidates, query_vector, k=k)
+
+    def select_mmr(self, candidates: list, query_vector: np.ndarray, k: int = 6) -> list:
+        passing = [candidate for candidate in candidates if candidate[1] <= self.max_distance]
+        if not passing:
+            return []
+
+        picks = mmr_select(
+            query_vector,
+            np.vstack([vector for _, _, vector, _ in passing]),
+            k=k,
+            lambda_mult=self.mmr_lambda,
+            sources=[doc.metadata.get("source", "unknown") for doc, _, _, _ in passing],
+            max_per_source=self.max_per_source
+        )
+        return [(passing[i][0], passing[i][1]) for i in picks]
+
+    def retrieve_working_set(self, query_text: str, category: str = None, k: int = 6) -> list:
+        """Score the question against this session's working set first; search the index only
+        when no remembered chunk is within working_set_max_distance"""
+        scope = (self.snapshot.version, category)
+        query_vector = np.asarray(self.embed_query(query_text), dtype=np.float32)
+        candidates = self.working_set.search(scope, query_vector)
+        if candidates and candidates[0][1] <= min(self.working_set_max_distance, self.max_distance):
+            self.working_set_stats.record("hits")
+            if self.debug:
+                print(f"\n🧠 Working set hit (distance {candidates[0][1]:.3f}, {len(candidates)} chunks)")
+        else:
+            self.working_set_stats.record("far" if candidates else "empty")
+            candidates, _ = self.search_candidates(query_text, category=category, fetch_k=max(self.fetch_k, k))
+            self.working_set.add(scope, candidates)
+        if self.use_mmr:
+            return self.select_mmr(candidates, query_vector, k=k)
+        return self.select_adaptive(self.cap_per_source([(doc, distance) for doc, distance, _, _ in candidates]), k=k)
+
+    def retrieve(self, query_text: str, category: str = None, k: int = 6) -> list:
+        """Retrieve the chunks worth sending to the LLM, as (document, distance) pairs"""
+        # Identical concurrent questions with the same index and settings share one retrieval
+        settings = (self.use_mmr, self.max_distance, self.score_gap, self.min_k, self.fetch_k,
+                    self.mmr_lambda, self.max_per_source)
+        if self.working_set is not None:
+            # Answers from a working set depend on what this session retrieved before
+            settings += (id(self.working_set),)
+        # The query embedding is shared too, so waiters can compress without embedding again
+        selected, embedding = coalesce(
+            "retrieval",
+            (self.snapshot.path, normalize_text(query_text), category, k) + settings,
+            lambda: (self._retrieve(query_text, category=category, k=k), self.embed_query(query_text))
+        )
+        self._last_embedding.value = ((self.snapshot.path, normalize_text(query_text)), embedding)
+        self.last_retrieval = list(selected)
+        return list(selected)
+
+    def prefetch(self, query_text: str, category: str = None, k: int = 6) -> Retrieval:
+        """Retrieve now on the current index version, to be answered later by query(retrieval=...)"""
+        with self.pinned_snapshot() as snapshot:
+            scored_docs = self.retrieve(query_text, category=category, k=k)
+            return Retrieval(snapshot, query_text, scored_docs, self.embed_query(query_text))
+
+    def _retrieve(self, query_text: str, category: str = None, k: int = 6) -> list:
+        if self.working_set is not None:
+            return self.retrieve_working_set(query_text, category=category, k=k)
+        if self.use_mmr:
+            return self.retrieve_mmr(query_text, category=category, k=k)
+
+        # Look further down the ranking when some sources will be capped
+        search_k = max(self.fetch_k, k) if self.max_per_source else k
+        scored_docs = self.search_with_scores(query_text, category=category, k=search_k)
+        selected = self.select_adaptive(self.cap_per_source(scored_docs), k=k)
+
+        if self.debug and scored_docs:
+            distances = ", ".join(f"{score:.3f}" for _, score in scored_docs)
+            print(f"\n📏 Distances: [{distances}] -> kept {len(selected)}/{len(scored_docs)} "
+                  f"(cutoff {self.max_distance}, gap {self.score_gap})")
+
+        return selected
+
+    def compress_context(self, query_text: str, docs: list) -> list:
+        """Cut the retrieved chunks down to the sentences closest to the question (no API calls)"""
+        self.last_compression = None
+        sentence_vectors = self.snapshot.sentence_vectors
+        if not self.compress or sentence_vectors is None:
+            return docs
+        compressed, stats = compress_documents(docs, self.embed_query(query_text), sentence_vectors,
+                                               keep_ratio=self.compress_keep, window=self.compress_window)
+        if stats is not None:
+            self.last_compression = stats
+            print(f"\n✂️ Context compressed to {stats['sentences_after']}/{stats['sentences_before']} sentences "
+                  f"({stats['chars_after']}/{stats['chars_before']} characters)")
+        return compressed
+
+    def generate(self, query_text: str, docs: list):
+        """Answer the question from the retrieved documents with ChatGPT; DeadlineExceeded propagates"""
+        # Prepare context from retrieved documents
+        context = "\n\n".join([doc.page_content for doc in docs])
+
+        gpt_start = time.time()
+        messages = [
+            {"role": "system", "content": "You are a helpful ophthalmology assistant. Answer questions based only on the following context:"},
+            {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {query_text}"}
+        ]
+
+        try:
+            print(f"\n🤖 Sending RAG query to ChatGPT: {query_text[:100]}...")
+            # Sessions asking the same question over the same chunks at once share one answer
+            answer = coalesced_chat_completion(
+                self.client,
+                "rag",
+                messages=messages,
+                temperature=0.3
+            ).choices[0].message.content
+            print(f"\n⏱️ ChatGPT response took: {time.time() - gpt_start:.2f} seconds")
+            return answer
+
+        except DeadlineExceeded:
+            # A timeout is not missing knowledge; the caller reports it as such
+            raise
+        except Exception as e:
+            print(f"\n❌ Error querying ChatGPT: {str(e)}")
+            return None
+
+    def query(self, query_text: str, category: str = None, k: int = 6, skip_rewrite: bool = False,
+              retrieval: Retrieval = None):
+        """Query the vector store and get response from ChatGPT.
+
+        A prefetched retrieval is answered as is, on the index version it came from.
+        Returns None when no chunk passes the distance cutoff (or on errors) and
+        raises DeadlineExceeded when the request's deadline runs out.
+        """
+        with self.pinned_snapshot(retrieval.snapshot if retrieval else None):
+            return self._query(query_text, category=category, k=k, skip_rewrite=skip_rewrite, retrieval=retrieval)
+
+    def _query(self, query_text: str, category: str = None, k: int = 6, skip_rewrite: bool = False,
+               retrieval: Retrieval = None):
         try:
             start_time = time.time()
             
@@ -89,62 +506,53 @@ class RAGQuery:
             
             # Time the document retrieval
             retrieval_start = time.time()
+            retrieval_text = retrieval.query_text if retrieval else query_text
             try:
-                if category:
-                    docs = self.vector_store.similarity_search(
-                        query_text,
-                        k=k,
-                        filter={"category": category}
-                    )
+                if retrieval is not None:
+                    # Compression below reuses the embedding the chunks were retrieved with
+                    self._last_embedding.value = ((self.snapshot.path, normalize_text(retrieval_text)),
+                                                  retrieval.embedding)
+                    self.last_retrieval = list(retrieval.scored_docs)
+                    scored_docs = list(retrieval.scored_docs)
                 else:
-                    docs = self.vector_store.similarity_search(query_text, k=k)
+                    scored_docs = self.retrieve(query_text, category=category, k=k)
                     
-                if not docs:
-                    print("\n⚠️ No relevant documents found")
+                if not scored_docs:
+                    # Nothing close enough: let the caller answer without any LLM call
+                    print("\n⚠️ No relevant documents within the distance cutoff, skipping generation")
                     return None
                     
+            except DeadlineExceeded:
+                raise
             except Exception as e:
                 print(f"\n❌ Error during document retrieval: {str(e)}")
                 return None
             
             print(f"\n⏱️ Document retrieval took: {time.time() - retrieval_start:.2f} seconds")
+            docs = [doc for doc, _ in scored_docs]
             
             # Debug output if enabled
             if self.debug:
                 print("\nRetrieving relevant chunks:")
-                for i, doc in enumerate(docs):
-                    print(f"\nChunk {i+1}/{len(docs)}:")
+                for i, (doc, score) in enumerate(scored_docs):
+                    print(f"\nChunk {i+1}/{len(docs)} (distance {score:.3f}):")
                     print("-" * 40)
                     print(doc.page_content)
                     print(f"Source: {doc.metadata.get('source', 'unknown')}")
                     print(f"Category: {doc.metadata.get('category', 'unknown')}")
+                    if "page_start" in doc.metadata:
+                        print(f"Pages: {doc.metadata['page_start']}-{doc.metadata['page_end']} "
+                              f"({doc.metadata.get('section') or 'no section'})")
+                    if doc.metadata.get("duplicate_count"):
+                        print(f"Also in: {', '.join(ref.get('filename', ref.get('source', '?')) for ref in doc.metadata['sources'])}")
                     print("-" * 40)
 
-            # Prepare context from retrieved documents
-            context = "\n\n".join([doc.page_content for doc in docs])
-            
-            # Time the ChatGPT query
-            gpt_start = time.time()
-            messages = [
-                {"role": "system", "content": "You are a helpful ophthalmology assistant. Answer questions based only on the following context:"},
-                {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {query_text}"}
-            ]
-
-            try:
-                print(f"\n🤖 Sending RAG query to ChatGPT: {query_text[:100]}...")
-                response = self.client.chat.completions.create(
-                    model="gpt-4o",
-                    messages=messages,
-                    temperature=0.3
-                )
-                print(f"\n⏱️ ChatGPT response took: {time.time() - gpt_start:.2f} seconds")
-                print(f"\n⏱️ Total query time: {time.time() - start_time:.2f} seconds")
-                return response.choices[0].message.content
-                
-            except Exception as e:
-                print(f"\n❌ Error querying ChatGPT: {str(e)}")
-                return None
+            response = self.generate(query_text, self.compress_context(retrieval_text, docs))
+            print(f"\n⏱️ Total query time: {time.time() - start_time:.2f} seconds")
+            return response
                 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             print(f"\n❌ Error in RAG query: {str(e)}")
             return None
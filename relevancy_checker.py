@@ -1,45 +1,19 @@
 from openai import OpenAI
+from model_router import coalesced_chat_completion
+from prompt_templates import PromptTemplate
 
-class RelevancyChecker:
-    def __init__(self, openai_api_key: str):
-        self.client = OpenAI(api_key=openai_api_key)
+# Stems that mark a question as eye-related when the LLM check is skipped
+OPHTHALMOLOGY_KEYWORDS = (
+    "eye", "ocular", "ophthalm", "vision", "visual", "sight", "lens", "cataract", "retin", "cornea",
+    "glaucoma", "iol", "ctr", "capsul", "intraocular", "pupil", "myopia", "hyperopia", "presbyop",
+    "astigmat", "refract", "macula", "vitre", "iris", "ophtec", "precizon", "ringject", "haptic"
+)
 
-    def is_ophthalmology_related(self, question: str, answer: str, category: str = None) -> tuple[bool, str]:
-        """
-        Check if the question-answer pair is related to ophthalmology using GPT-4o.
-        For IOL and CTR categories, allows both specific product and general ophthalmology concepts.
-        Returns (is_relevant, explanation if not relevant)
-        """
-        try:
-            # Log what's being checked
-            print(f"\n🔍 Relevancy Check:")
-            print(f"📝 Question: '{question[:100]}...'")
-            if answer:
-                print(f"📝 Answer: '{answer[:100]}...'")
-            
-            # Adjust prompt based on whether we're checking just the question or both
-            if answer:
-                base_prompt = f"""As an ophthalmology expert model, analyze if this question and answer pair is strictly related to ophthalmology or OPHTEC products.
-
-Question: {question}
-Answer: {answer}
-
-Analyze both the question and answer to ensure they are focused on:
-"""
-            else:
-                base_prompt = f"""As an ophthalmology expert model, analyze if this question is strictly related to ophthalmology or OPHTEC products.
-
-Question: {question}
+RELEVANCY_SYSTEM_PROMPT = "You are an expert ophthalmology model trained to identify ophthalmology-related content with high precision."
 
-Analyze the question to ensure it is focused on:
-"""
-
-            base_prompt += """1. Ophthalmology topics, OR
-2. OPHTEC products and services
-
-"""
-            if category == "iols":
-                prompt = base_prompt + """For IOL-related content, accept:
+# Category rules; kept ahead of the question/answer so the prompt prefix is stable
+RELEVANCY_RULES = {
+    "iols": """For IOL-related content, accept:
 1. Content about the Precizon Presbyopic NVA:
    - Features and specifications including:
      * Continuous Transitional Focus (CTF)
@@ -73,10 +47,8 @@ Rules:
 
 Format your response exactly as:
 RELEVANT: YES/NO
-EXPLANATION: [Only if NO, explain why it's not ophthalmology-related]"""
-
-            elif category == "ctr":
-                prompt = base_prompt + """For CTR-related content, accept:
+EXPLANATION: [Only if NO, explain why it's not ophthalmology-related]""",
+    "ctr": """For CTR-related content, accept:
 1. Content about OPHTEC CTR models:
    - RingJect Model 376
    - RingJect Model 375
@@ -105,9 +77,8 @@ Rules:
 
 Format your response exactly as:
 RELEVANT: YES/NO
-EXPLANATION: [Only if NO, explain why it's not ophthalmology-related]"""
-            else:
-                prompt = base_prompt + """Specific Topics to Check For:
+EXPLANATION: [Only if NO, explain why it's not ophthalmology-related]""",
+    None: """Specific Topics to Check For:
 1. Ophthalmology Topics:
    - Eye anatomy and conditions
    - Ophthalmic procedures
@@ -131,18 +102,65 @@ Rules:
 Format your response exactly as:
 RELEVANT: YES/NO
 EXPLANATION: [Only if NO, explain why it's not appropriate for this system]"""
+}
+
+def _relevancy_template(category: str, with_answer: bool) -> PromptTemplate:
+    """Static instructions for the category first, the question (and answer) last"""
+    subject = "the question and answer pair below is" if with_answer else "the question below is"
+    checked = "both the question and answer" if with_answer else "the question"
+    instructions = f"""As an ophthalmology expert model, analyze if {subject} strictly related to ophthalmology or OPHTEC products.
+
+Analyze {checked} to ensure they are focused on:
+1. Ophthalmology topics, OR
+2. OPHTEC products and services
+
+{RELEVANCY_RULES.get(category, RELEVANCY_RULES[None])}"""
+    request = "Question: {question}\nAnswer: {answer}" if with_answer else "Question: {question}"
+    return PromptTemplate(f"relevancy/{category}/{'qa' if with_answer else 'q'}", instructions, request,
+                          system=RELEVANCY_SYSTEM_PROMPT)
 
-            response = self.client.chat.completions.create(
-                messages=[
-                    {"role": "system", "content": "You are an expert ophthalmology model trained to identify ophthalmology-related content with high precision."},
-                    {"role": "user", "content": prompt}
-                ],
-                model="gpt-4o",
+RELEVANCY_TEMPLATES = {
+    (category, with_answer): _relevancy_template(category, with_answer)
+    for category in RELEVANCY_RULES for with_answer in (True, False)
+}
+
+class RelevancyChecker:
+    def __init__(self, openai_api_key: str):
+        self.client = OpenAI(api_key=openai_api_key, max_retries=0)  # Retries are handled by the LLM scheduler
+
+    def is_ophthalmology_related_local(self, question: str) -> tuple[bool, str]:
+        """
+        Keyword-based stand-in for is_ophthalmology_related, used when there is no time for the LLM check.
+        Returns (is_relevant, explanation if not relevant)
+        """
+        text = question.lower()
+        if any(keyword in text for keyword in OPHTHALMOLOGY_KEYWORDS):
+            return True, ""
+        return False, "The question doesn't appear to be about eye care or OPHTEC products."
+
+    def is_ophthalmology_related(self, question: str, answer: str, category: str = None) -> tuple[bool, str]:
+        """
+        Check if the question-answer pair is related to ophthalmology using GPT-4o.
+        For IOL and CTR categories, allows both specific product and general ophthalmology concepts.
+        Returns (is_relevant, explanation if not relevant)
+        """
+        try:
+            # Log what's being checked
+            print(f"\n🔍 Relevancy Check:")
+            print(f"📝 Question: '{question[:100]}...'")
+            if answer:
+                print(f"📝 Answer: '{answer[:100]}...'")
+            
+            template = RELEVANCY_TEMPLATES[(category if category in RELEVANCY_RULES else None, bool(answer))]
+
+            result = coalesced_chat_completion(
+                self.client,
+                "relevancy",
+                category=category,
+                messages=template.messages(question=question, answer=answer),
                 temperature=0,
                 max_tokens=150
-            )
-
-            result = response.choices[0].message.content.strip()
+            ).choices[0].message.content.strip()
             relevant = "RELEVANT: YES" in result
             explanation = result.split("EXPLANATION: ")[1] if "EXPLANATION: " in result else ""
             
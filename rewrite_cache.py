@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class RewriteCache:
+    """Bounded LRU cache of query rewrites with TTL eviction.
+
+    Rewrites are a pure function of the query, the category and the last
+    exchange (temperature 0), so one cache is shared by every session.
+    Pass db_path to keep entries in SQLite across restarts.
+    """
+
+    def __init__(self, max_entries: int = 2048, ttl_seconds: float = 24 * 3600, db_path: str = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self._entries = OrderedDict()  # key -> (value, stored_at)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "store_hits": 0, "evictions": 0, "expirations": 0}
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS rewrites (key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def history_fingerprint(history: list) -> str:
+        """Hash of the last exchange, the only part of the history the rewriter reads"""
+        last_exchange = [
+            {"role": msg.get("role"), "content": msg.get("content")}
+            for msg in (history or [])[-2:]
+        ]
+        payload = json.dumps(last_exchange, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def make_key(self, query: str, category: str, history: list) -> str:
+        """Cache key for a rewrite request"""
+        payload = json.dumps([query, category, self.history_fingerprint(history)], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl_seconds is not None and time.time() - stored_at > self.ttl_seconds
+
+    def get(self, key: str):
+        """Return the cached rewrite or None"""
+        with self._lock:
+            expired = False
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                if not self._expired(stored_at):
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return value
+                del self._entries[key]
+                expired = True
+
+            if self._db is not None:
+                row = self._db.execute("SELECT value, stored_at FROM rewrites WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value, stored_at = row
+                    if not self._expired(stored_at):
+                        self._insert(key, value, stored_at)
+                        self._stats["hits"] += 1
+                        self._stats["store_hits"] += 1
+                        return value
+                    self._db.execute("DELETE FROM rewrites WHERE key = ?", (key,))
+                    self._db.commit()
+                    expired = True
+
+            if expired:
+                self._stats["expirations"] += 1
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, key: str, value: str):
+        """Store a rewrite in memory and, if configured, in the backing store"""
+        stored_at = time.time()
+        with self._lock:
+            self._insert(key, value, stored_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO rewrites (key, value, stored_at) VALUES (?, ?, ?)",
+                    (key, value, stored_at)
+                )
+                self._db.commit()
+
+    def _insert(self, key: str, value: str, stored_at: float):
+        self._entries[key] = (value, stored_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def discard(self, keys) -> int:
+        """Drop the given keys from memory and the backing store; returns how many were cached in memory"""
+        keys = list(keys)
+        with self._lock:
+            removed = sum(self._entries.pop(key, None) is not None for key in keys)
+            if self._db is not None and keys:
+                self._db.executemany("DELETE FROM rewrites WHERE key = ?", [(key,) for key in keys])
+                self._db.commit()
+        return removed
+
+    def clear(self):
+        """Drop all cached rewrites"""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM rewrites")
+                self._db.commit()
+
+    def stats(self) -> dict:
+        """Hit/miss counters and the current hit rate"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_cache() -> RewriteCache:
+    """Process-wide rewrite cache, configured from the environment.
+
+    REWRITE_CACHE_SIZE, REWRITE_CACHE_TTL (seconds) and REWRITE_CACHE_DB
+    (SQLite file for the optional persistent store).
+    """
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = RewriteCache(
+                max_entries=int(os.getenv("REWRITE_CACHE_SIZE", "2048")),
+                ttl_seconds=float(os.getenv("REWRITE_CACHE_TTL", str(24 * 3600))),
+                db_path=os.getenv("REWRITE_CACHE_DB") or None
+            )
+        return _shared_cache
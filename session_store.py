@@ -0,0 +1,209 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# chat_histories uses None for general mode; SQLite keys it as ''
+GENERAL_CATEGORY_KEY = ""
+
+
+class SessionStore:
+    """Chat sessions in SQLite: session settings, the UI transcript, the per-category histories
+    and the session's LLM usage totals.
+
+    The transcript (what the user sees) and the chat histories (what the query
+    rewriter reads) are kept separately, as in the app, so a restored session
+    continues exactly where it stopped without re-running any query.
+
+    With max_age_seconds, sessions idle for longer are pruned when the store is
+    opened and then at most once per prune_interval, as new sessions are created.
+    """
+
+    def __init__(self, db_path: str, max_age_seconds: float = None, prune_interval: float = 3600.0):
+        self.db_path = db_path
+        self.max_age_seconds = max_age_seconds
+        self.prune_interval = prune_interval
+        self._next_prune = 0.0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS messages_by_session ON messages (session_id, id);
+            CREATE TABLE IF NOT EXISTS histories (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                category TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS histories_by_session ON histories (session_id, id);
+            CREATE TABLE IF NOT EXISTS usage (
+                session_id TEXT PRIMARY KEY,
+                totals TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+        """)
+        self._db.commit()
+        self._maybe_prune()
+
+    def _maybe_prune(self):
+        if self.max_age_seconds is None or time.time() < self._next_prune:
+            return
+        self._next_prune = time.time() + self.prune_interval
+        pruned = self.prune(self.max_age_seconds)
+        if pruned:
+            print(f"🧹 Pruned {pruned} sessions idle for over {self.max_age_seconds / 86400:g} days")
+
+    def _touch(self, session_id: str, now: float):
+        """Mark the session active (caller holds the lock); prune() goes by this"""
+        self._db.execute("UPDATE sessions SET updated_at = ? WHERE session_id = ?", (now, session_id))
+
+    def create_session(self, **state) -> str:
+        self._maybe_prune()
+        session_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO sessions (session_id, state, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (session_id, json.dumps(state), now, now)
+            )
+            self._db.commit()
+        return session_id
+
+    def load_session(self, session_id: str):
+        """The session's saved state dict, or None for an unknown session"""
+        with self._lock:
+            row = self._db.execute("SELECT state FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update_session(self, session_id: str, **changes):
+        """Merge changes into the session's saved state"""
+        with self._lock:
+            row = self._db.execute("SELECT state FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            state = {**(json.loads(row[0]) if row else {}), **changes}
+            self._db.execute(
+                "UPDATE sessions SET state = ?, updated_at = ? WHERE session_id = ?",
+                (json.dumps(state), time.time(), session_id)
+            )
+            self._db.commit()
+
+    def append_message(self, session_id: str, role: str, content: str) -> int:
+        """Add a transcript message; returns its id"""
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                (session_id, role, content, now)
+            )
+            self._touch(session_id, now)
+            self._db.commit()
+            return cursor.lastrowid
+
+    def recent_messages(self, session_id: str, limit: int, before_id: int = None) -> list:
+        """Up to limit transcript messages before before_id (default: the newest), oldest first"""
+        query = "SELECT id, role, content FROM messages WHERE session_id = ?"
+        params = [session_id]
+        if before_id is not None:
+            query += " AND id < ?"
+            params.append(before_id)
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        return [{"id": row[0], "role": row[1], "content": row[2]} for row in reversed(rows)]
+
+    def count_messages(self, session_id: str, before_id: int = None) -> int:
+        query = "SELECT COUNT(*) FROM messages WHERE session_id = ?"
+        params = [session_id]
+        if before_id is not None:
+            query += " AND id < ?"
+            params.append(before_id)
+        with self._lock:
+            return self._db.execute(query, params).fetchone()[0]
+
+    def append_history(self, session_id: str, category: str, role: str, content: str):
+        """Add a message to the chat history of one category (None = general mode)"""
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO histories (session_id, category, role, content) VALUES (?, ?, ?, ?)",
+                (session_id, category or GENERAL_CATEGORY_KEY, role, content)
+            )
+            self._touch(session_id, time.time())
+            self._db.commit()
+
+    def load_histories(self, session_id: str) -> dict:
+        """{category: [{"role", "content"}, ...]} with None for general mode"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT category, role, content FROM histories WHERE session_id = ? ORDER BY id",
+                (session_id,)
+            ).fetchall()
+        histories = {}
+        for category, role, content in rows:
+            key = category if category != GENERAL_CATEGORY_KEY else None
+            histories.setdefault(key, []).append({"role": role, "content": content})
+        return histories
+
+    def save_usage(self, session_id: str, totals: dict):
+        """Store the session's cumulative LLM usage, so its budget survives restarts"""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO usage (session_id, totals, updated_at) VALUES (?, ?, ?)",
+                (session_id, json.dumps(totals), time.time())
+            )
+            self._db.commit()
+
+    def load_usage(self, session_id: str):
+        """The session's saved usage totals, or None"""
+        with self._lock:
+            row = self._db.execute("SELECT totals FROM usage WHERE session_id = ?", (session_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def delete_session(self, session_id: str):
+        with self._lock:
+            for table in ("messages", "histories", "usage", "sessions"):
+                self._db.execute(f"DELETE FROM {table} WHERE session_id = ?", (session_id,))
+            self._db.commit()
+
+    def prune(self, max_age_seconds: float) -> int:
+        """Delete sessions idle (no new message or settings change) for longer than max_age_seconds;
+        returns how many"""
+        cutoff = time.time() - max_age_seconds
+        with self._lock:
+            ids = [row[0] for row in self._db.execute(
+                "SELECT session_id FROM sessions WHERE updated_at < ?", (cutoff,)
+            ).fetchall()]
+            for table in ("messages", "histories", "usage", "sessions"):
+                self._db.executemany(f"DELETE FROM {table} WHERE session_id = ?", [(i,) for i in ids])
+            self._db.commit()
+        return len(ids)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_session_store(db_path: str = None) -> SessionStore:
+    """Process-wide store for SESSION_DB (default sessions.db); sessions idle for SESSION_MAX_AGE_DAYS
+    (default 30, 0 = keep forever) are pruned"""
+    db_path = os.path.abspath(db_path or os.getenv("SESSION_DB", "sessions.db"))
+    with _stores_lock:
+        if db_path not in _stores:
+            max_age_days = float(os.getenv("SESSION_MAX_AGE_DAYS", "30"))
+            _stores[db_path] = SessionStore(db_path, max_age_seconds=max_age_days * 86400 if max_age_days else None)
+        return _stores[db_path]
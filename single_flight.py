@@ -0,0 +1,96 @@
+import hashlib
+import re
+import threading
+import time
+from llm_scheduler import get_call_context
+from pipeline_budget import DeadlineExceeded
+
+
+def normalize_text(text: str) -> str:
+    """Case- and whitespace-insensitive form of a question, for matching identical requests"""
+    return re.sub(r"\s+", " ", (text or "").strip().lower())
+
+
+def fingerprint(text: str) -> str:
+    """Short hash standing in for long inputs (retrieved context, answers) in keys"""
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()[:16]
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces identical in-flight calls: the first caller for a key runs it,
+    concurrent callers with the same key wait for that call and share its result.
+
+    Nothing is cached. The key is released when the call finishes, so the next
+    request runs again, and an error reaches every waiter of that call only.
+    Shared results must be treated as read-only.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "shared": 0, "errors": 0}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats["calls"] += 1
+            else:
+                call.waiters += 1
+                self._stats["shared"] += 1
+
+        if not leader:
+            # Waiters keep their own deadline even though the leader's call runs on
+            expires_at = get_call_context().get("expires_at")
+            timeout = None if expires_at is None else max(0.0, expires_at - time.monotonic())
+            if not call.done.wait(timeout):
+                raise DeadlineExceeded(f"Deadline passed waiting for an identical {key[0]} call")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        if call.waiters:
+            print(f"🔗 {key[0]}: shared one call with {call.waiters} identical request(s)")
+        return call.result
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._calls))
+
+
+_single_flight = SingleFlight()
+
+
+def get_single_flight() -> SingleFlight:
+    """Process-wide coalescing group shared by every session"""
+    return _single_flight
+
+
+def coalesce(stage: str, key: tuple, fn):
+    """Run fn once for all concurrent callers of the same stage and key"""
+    return _single_flight.do((stage,) + tuple(key), fn)
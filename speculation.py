@@ -0,0 +1,116 @@
+import contextvars
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from difflib import SequenceMatcher
+from single_flight import normalize_text
+
+_pool = ThreadPoolExecutor(max_workers=int(os.getenv("SPECULATION_WORKERS", "8")), thread_name_prefix="speculation")
+
+
+def rewrite_similarity(original: str, rewritten: str) -> float:
+    """How close a rewrite is to the original question, ignoring case, spacing and punctuation (0-1)"""
+    a = re.sub(r"[^\w\s]", "", normalize_text(original)).strip()
+    b = re.sub(r"[^\w\s]", "", normalize_text(rewritten)).strip()
+    if a == b:
+        return 1.0
+    return SequenceMatcher(None, a, b).ratio()
+
+
+class SpeculationStats:
+    """Hit rate, latency saved and work wasted by speculative calls, per kind"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _entry(self, kind: str) -> dict:
+        return self._stats.setdefault(kind, {"started": 0, "committed": 0, "missed": 0, "discarded": 0,
+                                             "failed": 0, "saved_seconds": 0.0, "wasted_seconds": 0.0})
+
+    def record(self, kind: str, outcome: str, saved: float = 0.0, wasted: float = 0.0):
+        with self._lock:
+            entry = self._entry(kind)
+            entry[outcome] += 1
+            entry["saved_seconds"] += saved
+            entry["wasted_seconds"] += wasted
+
+    def stats(self) -> dict:
+        with self._lock:
+            result = {}
+            for kind, entry in self._stats.items():
+                decided = entry["committed"] + entry["missed"] + entry["discarded"] + entry["failed"]
+                result[kind] = dict(entry, hit_rate=entry["committed"] / decided if decided else 0.0)
+            return result
+
+
+_stats = SpeculationStats()
+
+
+def get_speculation_stats() -> SpeculationStats:
+    """Process-wide speculation counters shared by every session"""
+    return _stats
+
+
+class Speculation:
+    """A call started before its input is final, in a worker thread with the caller's call context.
+
+    commit() waits for and returns the result, counting the time it ran in
+    parallel as saved. Work still queued behind other sessions' speculations is
+    cancelled and done inline instead (a miss), so a busy pool never adds
+    latency. discard() drops it (a running call still finishes).
+    """
+
+    def __init__(self, kind: str, fn):
+        self.kind = kind
+        self.started_at = None
+        self.finished_at = None
+        self.saved_seconds = 0.0
+        # committed, missed or failed once commit() returns or raises
+        self.outcome = None
+        self._fn = fn
+        _stats.record(kind, "started")
+        self._future = _pool.submit(contextvars.copy_context().run, self._run, fn)
+
+    def _run(self, fn):
+        self.started_at = time.monotonic()
+        try:
+            return fn()
+        finally:
+            self.finished_at = time.monotonic()
+
+    def commit(self):
+        if self._future.cancel():
+            # Never got a worker; waiting for one would only be slower than doing it now
+            try:
+                result = self._fn()
+            except Exception:
+                self.outcome = "failed"
+                _stats.record(self.kind, "failed")
+                raise
+            self.outcome = "missed"
+            _stats.record(self.kind, "missed")
+            print(f"\n⌛ Speculative {self.kind} never started, ran it inline")
+            return result
+        needed_at = time.monotonic()
+        try:
+            result = self._future.result()
+        except Exception:
+            self.outcome = "failed"
+            _stats.record(self.kind, "failed", wasted=self.finished_at - self.started_at)
+            raise
+        # Only the part that ran while the caller was busy elsewhere is latency saved
+        self.saved_seconds = max(0.0, min(self.finished_at, needed_at) - self.started_at)
+        self.outcome = "committed"
+        _stats.record(self.kind, "committed", saved=self.saved_seconds)
+        print(f"\n🎯 Speculative {self.kind} committed ({self.saved_seconds:.2f}s saved)")
+        return result
+
+    def discard(self):
+        if self._future.cancel():
+            _stats.record(self.kind, "discarded")
+            return
+        self._future.add_done_callback(
+            lambda _: _stats.record(self.kind, "discarded", wasted=self.finished_at - self.started_at))
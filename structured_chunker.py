@@ -0,0 +1,192 @@
+from collections import Counter
+from typing import Dict, List
+import re
+import fitz  # PyMuPDF
+import tiktoken
+
+
+class StructuredPDFExtractor:
+    """Extract ordered text, heading and table blocks from a PDF with page numbers.
+
+    Headings are detected from PyMuPDF span fonts: noticeably larger than the
+    document's body size, or short all-bold lines. Tables come from
+    page.find_tables() when the installed PyMuPDF supports it.
+    """
+
+    # Bump when extract_blocks output changes; cached extractions are keyed by it
+    VERSION = "1"
+
+    def __init__(self, heading_size_ratio: float = 1.15, max_heading_chars: int = 120):
+        self.heading_size_ratio = heading_size_ratio
+        self.max_heading_chars = max_heading_chars
+
+    def cache_id(self) -> str:
+        """Identifies this extractor's output for the extraction cache"""
+        return (f"pymupdf-structured-v{self.VERSION}-{fitz.VersionBind}"
+                f"-h{self.heading_size_ratio}-m{self.max_heading_chars}")
+
+    @staticmethod
+    def _span_is_bold(span: dict) -> bool:
+        return bool(span.get("flags", 0) & 16) or "bold" in span.get("font", "").lower()
+
+    @staticmethod
+    def _overlaps(bbox, other) -> bool:
+        return not (bbox[2] <= other[0] or bbox[0] >= other[2] or bbox[3] <= other[1] or bbox[1] >= other[3])
+
+    def _find_tables(self, page) -> List[Dict]:
+        """Tables on the page as {"bbox", "text"}; empty if table detection is unavailable"""
+        if not hasattr(page, "find_tables"):
+            return []
+        tables = []
+        try:
+            for table in page.find_tables().tables:
+                rows = table.extract()
+                lines = [" | ".join((cell or "").replace("\n", " ").strip() for cell in row) for row in rows]
+                text = "\n".join(line for line in lines if line.strip(" |"))
+                if text:
+                    tables.append({"bbox": tuple(table.bbox), "text": text})
+        except Exception as e:
+            print(f"Table detection failed on page {page.number + 1}: {e}")
+        return tables
+
+    def extract_blocks(self, pdf_path: str) -> List[Dict]:
+        """Return blocks as {"type": "heading"|"text"|"table", "text", "page"} in reading order"""
+        doc = fitz.open(pdf_path)
+        try:
+            raw_blocks = []
+            size_counts = Counter()
+            for page in doc:
+                page_number = page.number + 1
+                tables = self._find_tables(page)
+                for table in tables:
+                    raw_blocks.append({"type": "table", "text": table["text"], "page": page_number,
+                                       "y": table["bbox"][1]})
+
+                for block in page.get_text("dict", sort=True)["blocks"]:
+                    if block.get("type") != 0:
+                        continue
+                    if any(self._overlaps(block["bbox"], table["bbox"]) for table in tables):
+                        continue
+                    spans = [span for line in block["lines"] for span in line["spans"] if span["text"].strip()]
+                    if not spans:
+                        continue
+                    text = "\n".join(
+                        "".join(span["text"] for span in line["spans"]).strip()
+                        for line in block["lines"]
+                    ).strip()
+                    for span in spans:
+                        size_counts[round(span["size"], 1)] += len(span["text"])
+                    raw_blocks.append({
+                        "type": "text",
+                        "text": text,
+                        "page": page_number,
+                        "y": block["bbox"][1],
+                        "size": max(span["size"] for span in spans),
+                        "bold": all(self._span_is_bold(span) for span in spans),
+                        "lines": len(block["lines"])
+                    })
+        finally:
+            doc.close()
+
+        body_size = size_counts.most_common(1)[0][0] if size_counts else 0
+        blocks = []
+        for block in sorted(raw_blocks, key=lambda b: (b["page"], b["y"])):
+            if block["type"] == "text" and self._is_heading(block, body_size):
+                block_type = "heading"
+            else:
+                block_type = block["type"]
+            blocks.append({"type": block_type, "text": block["text"], "page": block["page"]})
+        return blocks
+
+    def _is_heading(self, block: Dict, body_size: float) -> bool:
+        text = block["text"]
+        if len(text) > self.max_heading_chars or block["lines"] > 2 or not re.search(r"[A-Za-z]", text):
+            return False
+        if body_size and block["size"] >= body_size * self.heading_size_ratio:
+            return True
+        return block["bold"] and not text.rstrip().endswith((".", ":", ";", ","))
+
+
+class SectionChunker:
+    """Group extracted blocks into chunks that never cross a section boundary.
+
+    Chunks stay under max_tokens; oversized blocks are split on sentence and
+    line boundaries, and oversized tables are split by rows.
+    """
+
+    def __init__(self, max_tokens: int = 350, encoding_name: str = "cl100k_base"):
+        self.max_tokens = max_tokens
+        self.encoding = tiktoken.get_encoding(encoding_name)
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.encoding.encode(text))
+
+    def _split_oversized(self, text: str, is_table: bool, max_tokens: int) -> List[str]:
+        """Split one block into pieces that each fit max_tokens"""
+        if is_table:
+            units = text.split("\n")
+        else:
+            units = [unit for unit in re.split(r"(?<=[.!?])\s+|\n", text) if unit.strip()]
+
+        pieces, current = [], []
+        for unit in units:
+            candidate = "\n".join(current + [unit]) if is_table else " ".join(current + [unit])
+            if current and self.count_tokens(candidate) > max_tokens:
+                pieces.append("\n".join(current) if is_table else " ".join(current))
+                current = []
+            current.append(unit)
+        if current:
+            pieces.append("\n".join(current) if is_table else " ".join(current))
+
+        # A single unit can still exceed the budget; cut it on token boundaries
+        result = []
+        for piece in pieces:
+            tokens = self.encoding.encode(piece)
+            for start in range(0, len(tokens), max_tokens):
+                result.append(self.encoding.decode(tokens[start:start + max_tokens]))
+        return result
+
+    def chunk(self, blocks: List[Dict]) -> List[Dict]:
+        """Return chunks as {"text", "section", "page_start", "page_end"}"""
+        chunks = []
+        section = ""
+        parts, pages = [], []
+
+        def flush():
+            if parts:
+                body = "\n".join(parts)
+                text = f"{section}\n{body}" if section else body
+                chunks.append({
+                    "text": text,
+                    "section": section,
+                    "page_start": min(pages),
+                    "page_end": max(pages)
+                })
+            parts.clear()
+            pages.clear()
+
+        for block in blocks:
+            if block["type"] == "heading":
+                flush()
+                section = block["text"].replace("\n", " ").strip()
+                continue
+
+            heading_tokens = self.count_tokens(section) if section else 0
+            budget = max(1, self.max_tokens - heading_tokens)
+            block_tokens = self.count_tokens(block["text"])
+
+            if block_tokens > budget:
+                flush()
+                for piece in self._split_oversized(block["text"], block["type"] == "table", budget):
+                    parts.append(piece)
+                    pages.append(block["page"])
+                    flush()
+                continue
+
+            if parts and self.count_tokens("\n".join(parts + [block["text"]])) > budget:
+                flush()
+            parts.append(block["text"])
+            pages.append(block["page"])
+
+        flush()
+        return chunks
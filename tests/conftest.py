@@ -0,0 +1,14 @@
+import os
+import sys
+import pytest
+
+# The modules live flat in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_backends import HashEmbeddings
+
+
+@pytest.fixture
+def embeddings():
+    """Deterministic offline embeddings; shared words give similar vectors"""
+    return HashEmbeddings(dimensions=256)
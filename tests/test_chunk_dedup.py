@@ -0,0 +1,46 @@
+from chunk_dedup import MinHashDeduplicator, deduplicate_documents, jaccard, shingles
+
+BASE = ("The capsular tension ring is implanted into the capsular bag to stabilise it when the zonules "
+        "are weak, for example in pseudoexfoliation or after trauma, and keeps the bag round during surgery.")
+
+
+def test_near_duplicates_are_grouped():
+    texts = [BASE, "Toric lenses correct corneal astigmatism at the time of cataract surgery.",
+             BASE + " See the instructions for use.", BASE.replace("weak", "weakened")]
+    # One changed word removes five shingles: below the threshold
+    assert MinHashDeduplicator(threshold=0.8).groups(texts) == [[0, 2], [1], [3]]
+
+
+def test_groups_are_transitive():
+    # Overlapping windows of one text: a~b and b~c, but a and c are too far apart on their own
+    words = [f"word{i}" for i in range(40)]
+    a, b, c = " ".join(words[0:30]), " ".join(words[5:35]), " ".join(words[10:40])
+    assert jaccard(shingles(a), shingles(b)) > 0.6 > jaccard(shingles(a), shingles(c))
+    deduplicator = MinHashDeduplicator(threshold=0.6, num_perm=128, bands=64)
+    assert deduplicator.groups([a, c]) == [[0], [1]]
+    assert deduplicator.groups([a, b, c]) == [[0, 1, 2]]
+
+
+def test_num_perm_must_split_into_bands():
+    try:
+        MinHashDeduplicator(num_perm=100, bands=16)
+    except ValueError:
+        return
+    raise AssertionError("expected ValueError")
+
+
+def test_deduplicate_documents_keeps_longest_and_lists_sources():
+    documents = [
+        {"page_content": BASE, "metadata": {"source": "a.pdf", "category": "ctr", "page_start": 1}},
+        {"page_content": BASE + " Extra.", "metadata": {"source": "b.pdf", "category": "ctr", "page_start": 4}},
+        {"page_content": BASE, "metadata": {"source": "c.pdf", "category": "iols"}}
+    ]
+    deduplicated, report = deduplicate_documents(documents, MinHashDeduplicator(threshold=0.8),
+                                                 token_counter=lambda text: len(text.split()))
+    # Categories are never merged with each other
+    assert [doc["metadata"]["source"] for doc in deduplicated] == ["b.pdf", "c.pdf"]
+    merged = deduplicated[0]["metadata"]
+    assert merged["duplicate_count"] == 1
+    assert [ref["source"] for ref in merged["sources"]] == ["a.pdf", "b.pdf"]
+    assert report["chunks_removed"] == 1
+    assert report["embedding_tokens_saved"] == len(BASE.split())
@@ -0,0 +1,65 @@
+from langchain.schema import Document
+from context_compression import compress_documents, normalize_rows, split_sentences
+
+
+def test_split_sentences_keeps_abbreviations_and_list_items():
+    text = "See Fig. 2 for the ring. It is made of PMMA.\n\n- Size 11 mm\n- Size 13 mm"
+    sentences = [text[start:end] for start, end in split_sentences(text)]
+    assert sentences == ["See Fig. 2 for the ring.", "It is made of PMMA.", "- Size 11 mm", "- Size 13 mm"]
+
+
+def test_split_sentences_cuts_long_pieces_at_line_breaks():
+    text = "\n".join(f"row {i} value {'x' * 40}" for i in range(20))
+    spans = split_sentences(text)
+    assert len(spans) > 1
+    assert all(end - start <= 400 for start, end in spans)
+
+
+def chunk(text: str, first_row: int) -> Document:
+    spans = split_sentences(text)
+    return Document(page_content=text, metadata={"sentences": [first_row, len(spans)], "sentence_spans": spans})
+
+
+def test_compress_keeps_the_sentences_closest_to_the_question(embeddings):
+    texts = ["The ring stabilises the capsular bag. Our offices are closed on Sunday. "
+             "Parking is free for visitors. The cafeteria serves lunch.",
+             "Shipping takes three days. The ring comes in three sizes. "
+             "Invoices are sent by email. Returns need a form."]
+    docs = [chunk(texts[0], 0), chunk(texts[1], 4)]
+    sentences = [text[start:end] for text, doc in zip(texts, docs) for start, end in doc.metadata["sentence_spans"]]
+    sentence_vectors = normalize_rows(embeddings.embed_documents(sentences))
+
+    compressed, stats = compress_documents(docs, embeddings.embed_query("What sizes does the ring come in?"),
+                                           sentence_vectors, keep_ratio=0.25, window=0)
+    assert stats["sentences_before"] == 8
+    assert stats["sentences_after"] == 2
+    assert compressed[1].page_content == "The ring comes in three sizes."
+    # Every chunk keeps at least its best sentence
+    assert compressed[0].page_content == "The ring stabilises the capsular bag."
+    assert stats["chars_after"] < stats["chars_before"]
+
+
+def test_neighbours_are_kept(embeddings):
+    text = "Alpha one. Bravo two. The ring sizes are listed. Delta four. Echo five. Foxtrot six."
+    doc = chunk(text, 0)
+    sentences = [text[start:end] for start, end in doc.metadata["sentence_spans"]]
+    compressed, _ = compress_documents([doc], embeddings.embed_query("ring sizes listed"),
+                                       normalize_rows(embeddings.embed_documents(sentences)),
+                                       keep_ratio=0.1, window=1)
+    assert compressed[0].page_content == "Bravo two. The ring sizes are listed. Delta four."
+
+
+def test_gaps_become_an_ellipsis(embeddings):
+    text = "Alpha one. The ring sizes. Charlie three. Delta four. Ring sizes again. Foxtrot six."
+    doc = chunk(text, 0)
+    sentences = [text[start:end] for start, end in doc.metadata["sentence_spans"]]
+    compressed, _ = compress_documents([doc], embeddings.embed_query("ring sizes"),
+                                       normalize_rows(embeddings.embed_documents(sentences)),
+                                       keep_ratio=0.33, window=0)
+    assert compressed[0].page_content == "The ring sizes. … Ring sizes again."
+
+
+def test_too_few_sentences_are_left_alone(embeddings):
+    doc = chunk("Only one sentence here.", 0)
+    docs, stats = compress_documents([doc], embeddings.embed_query("sentence"), normalize_rows([[1.0] * 256]))
+    assert docs == [doc] and stats is None
@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+from embedding_backends import HashEmbeddings, make_embeddings
+
+
+def test_hash_embeddings_are_deterministic_and_normalised(embeddings):
+    first = np.array(embeddings.embed_query("Capsular tension ring"))
+    assert first.shape == (256,)
+    assert np.isclose(np.linalg.norm(first), 1.0)
+    assert np.array_equal(first, HashEmbeddings(256).embed_documents(["capsular  TENSION ring"])[0])
+
+
+def test_shared_words_are_closer(embeddings):
+    query = np.array(embeddings.embed_query("capsular tension ring sizes"))
+    near, far = np.array(embeddings.embed_documents(["sizes of the capsular tension ring", "toric lens axis"]))
+    assert query @ near > query @ far
+    assert embeddings.texts_embedded == 2
+
+
+def test_make_embeddings_hash_backend():
+    assert make_embeddings("hash", dimensions=64).dimensions == 64
+    with pytest.raises(ValueError):
+        make_embeddings("word2vec")
@@ -0,0 +1,49 @@
+from types import SimpleNamespace
+import numpy as np
+from answer_bank import AnswerBank
+from main import MedicalQuerySystem, is_first_question
+from pipeline_budget import PipelineBudget
+from working_set import WorkingSet
+
+CTR_INTRO = "In CTR mode, I can provide information about the following Capsular Tension Ring models."
+
+
+def make_system(embeddings):
+    """The parts of a MedicalQuerySystem the opening-question path touches, without an index or API key"""
+    entries = [{"question": "What sizes does the CTR come in?", "category": "ctr", "role": "doctor",
+                "rewritten_query": "capsular tension ring sizes", "answer": "Banked CTR sizes answer"}]
+    bank = AnswerBank("v1", entries, embeddings.embed_documents([entries[0]["question"]]))
+    working_set = WorkingSet()
+    working_set.add(("v1", "ctr"), [("stale chunk", 0.0, np.ones(4, dtype=np.float32), 7)])
+
+    system = MedicalQuerySystem.__new__(MedicalQuerySystem)
+    system.rag = SimpleNamespace(answer_bank=bank, working_set=working_set, embed_query=embeddings.embed_query)
+    system.category_aliases = {"iol": "iols", "iols": "iols", "ctr": "ctr", "gen": None, "general": None}
+    system.chat_histories = {"ctr": [], "iols": [], None: []}
+    system.current_category = None
+    system.current_role = "doctor"
+    system.session_store = None
+    system.use_answer_bank = True
+    system.answer_bank_min_similarity = 0.95
+    system.last_rewritten_query = None
+    return system
+
+
+def test_mode_intro_does_not_count_as_a_user_turn():
+    intro = [{"role": "assistant", "content": CTR_INTRO}]
+    assert is_first_question([])
+    assert is_first_question(intro)
+    assert not is_first_question(intro + [{"role": "user", "content": "sizes?"}])
+
+
+def test_first_question_after_mode_intro_uses_bank_and_clears_working_set(embeddings):
+    system = make_system(embeddings)
+    # What app.py's handle_mode_change does before the user asks anything
+    system.switch_category("switch ctr")
+    system.add_to_history("assistant", CTR_INTRO)
+
+    response = system._process_query("What sizes does the CTR come in?", PipelineBudget())
+
+    assert response == "Banked CTR sizes answer"
+    assert len(system.rag.working_set) == 0
+    assert [message["role"] for message in system.get_current_history()] == ["assistant", "user", "assistant"]
@@ -0,0 +1,27 @@
+import pytest
+from index_meta import LEGACY_INDEX_META, IndexMismatchError, check_index_compatible, read_index_meta
+
+META = {"embeddings_backend": "hash", "embeddings_model": "hash-v1", "dimensions": 256, "shortened": False}
+
+
+def test_matching_settings_pass():
+    check_index_compatible(META, index_dimension=256, requested_dimensions=256, requested_backend="hash")
+    check_index_compatible(META)
+
+
+@pytest.mark.parametrize("settings", [
+    {"index_dimension": 384},
+    {"requested_dimensions": 512},
+    {"requested_backend": "openai"}
+])
+def test_mismatches_are_refused(settings):
+    with pytest.raises(IndexMismatchError):
+        check_index_compatible(META, **settings)
+
+
+def test_legacy_index_is_openai(tmp_path):
+    meta = read_index_meta(str(tmp_path))
+    assert meta["legacy"] and meta["dimensions"] == LEGACY_INDEX_META["dimensions"]
+    check_index_compatible(meta, requested_backend="openai")
+    with pytest.raises(IndexMismatchError):
+        check_index_compatible(meta, requested_backend="local")
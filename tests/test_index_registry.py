@@ -0,0 +1,72 @@
+import os
+from types import SimpleNamespace
+import pytest
+from index_registry import (CURRENT_FILE, MANIFEST_FILE, IndexReloader, close_index_reloader, get_index_reloader,
+                            write_manifest)
+
+
+def publish(root, version, content="vectors"):
+    version_dir = os.path.join(root, version)
+    os.makedirs(version_dir)
+    with open(os.path.join(version_dir, "index.faiss"), "w") as f:
+        f.write(content)
+    write_manifest(version_dir, version)
+    with open(os.path.join(root, CURRENT_FILE), "w") as f:
+        f.write(version)
+    return version_dir
+
+
+def test_failed_version_is_retried_when_its_manifest_changes(tmp_path):
+    root = str(tmp_path)
+    publish(root, "v1")
+    reloader = IndexReloader(root, lambda version, version_dir: SimpleNamespace(version=version))
+    reloader.current_snapshot()
+
+    # v2 is still being copied: its file doesn't match the manifest yet
+    v2 = publish(root, "v2", content="complete vectors")
+    with open(os.path.join(v2, "index.faiss"), "w") as f:
+        f.write("partial")
+    assert not reloader.reload_now()
+    assert not reloader.reload_now()  # backing off
+
+    with open(os.path.join(v2, "index.faiss"), "w") as f:
+        f.write("complete vectors")
+    write_manifest(v2, "v2")
+    os.utime(os.path.join(v2, MANIFEST_FILE), ns=(1, 1))
+    assert reloader.reload_now()
+    assert reloader.current_snapshot().version == "v2"
+
+
+def test_failed_version_is_retried_after_the_backoff(tmp_path):
+    root = str(tmp_path)
+    publish(root, "v1")
+    attempts = []
+
+    def loader(version, version_dir):
+        attempts.append(version)
+        if attempts == ["v1", "v2"]:
+            raise OSError("truncated index")
+        return SimpleNamespace(version=version)
+
+    reloader = IndexReloader(root, loader, retry_delay=0.0)
+    reloader.current_snapshot()
+    publish(root, "v2")
+    with pytest.raises(OSError):
+        reloader.reload_now()
+
+    assert reloader.reload_now()
+    assert attempts == ["v1", "v2", "v2"]
+
+
+def test_closing_a_reloader_stops_its_watcher(tmp_path, monkeypatch):
+    monkeypatch.setenv("INDEX_WATCH_INTERVAL", "0.01")
+    root = str(tmp_path)
+    publish(root, "v1")
+    reloader = get_index_reloader(root, lambda version, version_dir: SimpleNamespace(version=version))
+    assert reloader._watcher.is_alive()
+
+    close_index_reloader(root)
+    reloader._watcher.join(1)
+    assert not reloader._watcher.is_alive()
+    assert get_index_reloader(root, lambda version, version_dir: None) is not reloader
+    close_index_reloader(root)
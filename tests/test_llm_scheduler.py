@@ -0,0 +1,21 @@
+import time
+from types import SimpleNamespace
+from llm_scheduler import LLMScheduler
+
+
+def test_models_without_limits_are_not_throttled():
+    scheduler = LLMScheduler(limits={"gpt-4o-mini": {"rpm": 1, "tpm": 100000}})
+    start = time.monotonic()
+    for _ in range(20):
+        response = scheduler.submit("gpt-4o", lambda: SimpleNamespace(usage=SimpleNamespace(total_tokens=10)), 40000)
+    assert response.usage.total_tokens == 10
+    assert time.monotonic() - start < 1.0
+
+
+def test_configured_limits_still_throttle():
+    scheduler = LLMScheduler(limits={"gpt-4o": {"rpm": 60, "tpm": 1000000}})
+    # The request bucket starts full: drain it, then the next call waits for one request's refill (1s)
+    scheduler._model_buckets("gpt-4o")[0].tokens = 0
+    start = time.monotonic()
+    scheduler.submit("gpt-4o", lambda: None, 10)
+    assert time.monotonic() - start >= 0.5
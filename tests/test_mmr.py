@@ -0,0 +1,29 @@
+import numpy as np
+from mmr import mmr_select
+
+
+def test_pure_relevance_ranks_by_similarity(embeddings):
+    texts = ["capsular tension ring sizes", "capsular tension ring", "intraocular lens power", "toric lens"]
+    vectors = np.array(embeddings.embed_documents(texts))
+    query = np.array(embeddings.embed_query("capsular tension ring sizes"))
+    picks = mmr_select(query, vectors, k=4, lambda_mult=1.0)
+    assert picks == list(np.argsort(-(vectors @ query), kind="stable"))
+
+
+def test_diversity_skips_near_duplicates(embeddings):
+    texts = ["capsular tension ring implantation", "capsular tension ring implantation", "ring implantation steps"]
+    vectors = np.array(embeddings.embed_documents(texts))
+    query = np.array(embeddings.embed_query("capsular tension ring implantation"))
+    assert mmr_select(query, vectors, k=2, lambda_mult=0.3) == [0, 2]
+
+
+def test_max_per_source_caps_picks():
+    vectors = np.eye(4, dtype=np.float32)
+    query = np.array([1.0, 0.9, 0.8, 0.7], dtype=np.float32)
+    picks = mmr_select(query, vectors, k=4, lambda_mult=1.0, sources=["a", "a", "b", "a"], max_per_source=1)
+    assert picks == [0, 2]
+
+
+def test_empty_and_zero_k():
+    assert mmr_select(np.ones(3), np.zeros((0, 3)), k=2) == []
+    assert mmr_select(np.ones(3), np.eye(3), k=0) == []
@@ -0,0 +1,96 @@
+import threading
+import time
+import pytest
+import llm_scheduler
+import model_router
+from llm_scheduler import LLMScheduler, configure_scheduler
+from model_router import coalesced_chat_completion
+
+
+def run_concurrently(monkeypatch, requests):
+    """Start every request while the first underlying call is still in flight; return the calls made"""
+    calls = []
+    release = threading.Event()
+
+    def complete(client, stage, model, fallback, **kwargs):
+        calls.append(kwargs["messages"])
+        release.wait(5)
+        return kwargs["messages"]
+
+    monkeypatch.setattr(model_router, "_complete", complete)
+    threads = [threading.Thread(target=coalesced_chat_completion, args=(None, "rag"), kwargs=request)
+               for request in requests]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+    return calls
+
+
+def messages(question, system="You are a helpful ophthalmology assistant."):
+    return [{"role": "system", "content": system}, {"role": "user", "content": question}]
+
+
+def test_identical_requests_share_one_call(monkeypatch):
+    request = {"messages": messages("What is the Precizon NVA?"), "temperature": 0.3}
+    assert len(run_concurrently(monkeypatch, [request, dict(request)])) == 1
+
+
+def test_requests_differing_in_case_or_prompt_do_not_share(monkeypatch):
+    requests = [
+        {"messages": messages("What is the Precizon NVA?"), "temperature": 0.3},
+        {"messages": messages("What is the PRECIZON NVA?"), "temperature": 0.3},
+        {"messages": messages("What is the Precizon NVA?", system="You are a sales assistant."), "temperature": 0.3},
+        {"messages": messages("What is the Precizon NVA?"), "temperature": 0}
+    ]
+    assert len(run_concurrently(monkeypatch, requests)) == 4
+
+
+def test_router_keeps_its_latency_feed_when_the_scheduler_is_replaced(monkeypatch):
+    monkeypatch.setattr(llm_scheduler, "_scheduler", LLMScheduler())
+    monkeypatch.setattr(model_router, "_router", None)
+    monkeypatch.setattr(model_router, "_observing", False)
+    model_router.get_router()
+
+    replacement = configure_scheduler(LLMScheduler())
+
+    assert llm_scheduler.get_scheduler() is replacement
+    assert model_router._observe in replacement._observers
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def fail_primary_with(monkeypatch, error):
+    models = []
+
+    def complete(client, model, **kwargs):
+        models.append(model)
+        if model == "primary":
+            raise error
+        return model
+
+    monkeypatch.setattr(model_router, "chat_completion", complete)
+    monkeypatch.setattr(model_router, "_router", model_router.ModelRouter({"rag": {"model": "primary",
+                                                                                   "fallback": "secondary"}}))
+    return models
+
+
+def test_retryable_errors_fall_back(monkeypatch):
+    for error in (StatusError(503), StatusError(429), TimeoutError("read timed out")):
+        models = fail_primary_with(monkeypatch, error)
+        assert model_router.routed_chat_completion(None, "rag", messages=[]) == "secondary"
+        assert models == ["primary", "secondary"]
+
+
+def test_invalid_requests_are_not_sent_twice(monkeypatch):
+    for status in (400, 401, 403):
+        models = fail_primary_with(monkeypatch, StatusError(status))
+        with pytest.raises(StatusError):
+            model_router.routed_chat_completion(None, "rag", messages=[])
+        assert models == ["primary"]
@@ -0,0 +1,51 @@
+import rewrite_cache
+from rewrite_cache import RewriteCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rewrite_cache, "time", clock)
+    cache = RewriteCache(ttl_seconds=60)
+    cache.set("key", "rewritten")
+    clock.now += 59
+    assert cache.get("key") == "rewritten"
+    clock.now += 2
+    assert cache.get("key") is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = RewriteCache(max_entries=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.get("a")
+    cache.set("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1" and cache.get("c") == "3"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_key_depends_on_last_exchange_only():
+    cache = RewriteCache()
+    history = [{"role": "user", "content": "old"}, {"role": "user", "content": "q"},
+               {"role": "assistant", "content": "a"}]
+    assert cache.make_key("And the sizes?", "ctr", history) == cache.make_key("And the sizes?", "ctr", history[-2:])
+    assert cache.make_key("And the sizes?", "ctr", history) != cache.make_key("And the sizes?", "iols", history)
+
+
+def test_persistent_store_survives_a_new_cache(tmp_path):
+    db_path = str(tmp_path / "rewrites.db")
+    RewriteCache(db_path=db_path).set("key", "rewritten")
+    cache = RewriteCache(db_path=db_path)
+    assert cache.get("key") == "rewritten"
+    assert cache.stats()["store_hits"] == 1
+    cache.discard(["key"])
+    assert RewriteCache(db_path=db_path).get("key") is None
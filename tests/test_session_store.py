@@ -0,0 +1,33 @@
+import time
+from session_store import SessionStore
+
+
+def age(store, session_id, seconds):
+    """Pretend the session was last active seconds ago"""
+    store._db.execute("UPDATE sessions SET updated_at = ? WHERE session_id = ?", (time.time() - seconds, session_id))
+    store._db.commit()
+
+
+def test_appending_keeps_an_active_conversation_from_being_pruned(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.db"))
+    active, idle = store.create_session(mode="CTR"), store.create_session(mode="CTR")
+    for session_id in (active, idle):
+        age(store, session_id, 7200)
+    store.append_message(active, "user", "What sizes does the CTR come in?")
+    store.append_history(active, "ctr", "user", "What sizes does the CTR come in?")
+
+    assert store.prune(3600) == 1
+    assert store.load_session(active) == {"mode": "CTR"}
+    assert store.load_session(idle) is None
+    assert store.load_histories(idle) == {} and store.count_messages(idle) == 0
+
+
+def test_store_prunes_idle_sessions_when_opened(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    store = SessionStore(path)
+    idle, recent = store.create_session(), store.create_session()
+    age(store, idle, 7200)
+
+    reopened = SessionStore(path, max_age_seconds=3600)
+    assert reopened.load_session(idle) is None
+    assert reopened.load_session(recent) == {}
@@ -0,0 +1,67 @@
+import threading
+import time
+import pytest
+from llm_scheduler import call_context
+from pipeline_budget import DeadlineExceeded
+from single_flight import SingleFlight
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def test_leader_error_reaches_every_waiter():
+    group = SingleFlight()
+    release = threading.Event()
+    waiter_calls = []
+    errors = []
+
+    def leader():
+        release.wait(5)
+        raise RuntimeError("upstream failed")
+
+    def call(fn):
+        try:
+            group.do(("rag", "q"), fn)
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call, args=(leader,))]
+    threads[0].start()
+    wait_for(lambda: group.in_flight() == 1)
+    for _ in range(3):
+        threads.append(threading.Thread(target=call, args=(lambda: waiter_calls.append(1),)))
+        threads[-1].start()
+    wait_for(lambda: group.stats()["shared"] == 3)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(errors) == 4 and all(e is errors[0] for e in errors)
+    assert waiter_calls == []
+    assert group.stats()["errors"] == 1 and group.in_flight() == 0
+
+
+def test_key_is_released_after_an_error():
+    group = SingleFlight()
+    with pytest.raises(ValueError):
+        group.do(("rewrite", "q"), lambda: (_ for _ in ()).throw(ValueError("boom")))
+    assert group.do(("rewrite", "q"), lambda: "ok") == "ok"
+
+
+def test_waiter_keeps_its_own_deadline():
+    group = SingleFlight()
+    release = threading.Event()
+    leader = threading.Thread(target=group.do, args=(("rag", "q"), lambda: release.wait(5)))
+    leader.start()
+    wait_for(lambda: group.in_flight() == 1)
+    try:
+        with call_context(expires_at=time.monotonic() + 0.05):
+            with pytest.raises(DeadlineExceeded):
+                group.do(("rag", "q"), lambda: None)
+    finally:
+        release.set()
+        leader.join(5)
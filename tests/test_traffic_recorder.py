@@ -0,0 +1,16 @@
+from traffic_recorder import is_redacted, redact
+
+
+def test_redact_replaces_personal_data():
+    text = ("Dr. Jane Smith asked about patient John Doe, 67 year old, seen 03/04/2024. "
+            "Mail jane@example.org, call +31 20 123 4567, record 12345678, see https://example.org/x")
+    assert redact(text) == ("[NAME] asked about patient [NAME], [AGE], seen [DATE]. "
+                            "Mail [EMAIL], call [NUMBER], record [NUMBER], see [URL]")
+    assert is_redacted(redact(text))
+
+
+def test_redact_leaves_clinical_questions_alone():
+    text = "Which CTR size for a 12.5 mm capsular bag with 3 clock hours of zonular loss?"
+    assert redact(text) == text
+    assert not is_redacted(text)
+    assert redact("") == "" and redact(None) is None
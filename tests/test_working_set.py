@@ -0,0 +1,47 @@
+import numpy as np
+from working_set import WorkingSet
+
+SCOPE = ("v1", "ctr")
+
+
+def candidates(embeddings, texts, first_id=0):
+    vectors = np.array(embeddings.embed_documents(texts), dtype=np.float32)
+    return [(text, 0.0, vector, first_id + i) for i, (text, vector) in enumerate(zip(texts, vectors))]
+
+
+def test_search_returns_squared_l2_distances_closest_first(embeddings):
+    working_set = WorkingSet()
+    added = candidates(embeddings, ["capsular tension ring sizes", "toric lens axis", "ring implantation"])
+    working_set.add(SCOPE, added)
+    query = np.array(embeddings.embed_query("ring sizes"), dtype=np.float32)
+
+    results = working_set.search(SCOPE, query)
+    expected = sorted(((doc, float(np.sum((vector - query) ** 2)), index_id) for doc, _, vector, index_id in added),
+                      key=lambda item: item[1])
+    assert [doc for doc, _, _, _ in results] == [doc for doc, _, _ in expected]
+    assert np.allclose([distance for _, distance, _, _ in results], [distance for _, distance, _ in expected],
+                       atol=1e-5)
+    assert [index_id for _, _, _, index_id in results] == [index_id for _, _, index_id in expected]
+
+
+def test_other_scope_starts_afresh(embeddings):
+    working_set = WorkingSet()
+    working_set.add(SCOPE, candidates(embeddings, ["capsular tension ring"]))
+    query = np.array(embeddings.embed_query("ring"), dtype=np.float32)
+    assert working_set.search(("v2", "ctr"), query) == []
+    working_set.add(("v1", "iols"), candidates(embeddings, ["toric lens"], first_id=10))
+    assert [index_id for _, _, _, index_id in working_set.search(("v1", "iols"), query)] == [10]
+    assert working_set.search(SCOPE, query) == []
+
+
+def test_newest_first_deduplicated_and_capped(embeddings):
+    working_set = WorkingSet(capacity=3)
+    working_set.add(SCOPE, candidates(embeddings, ["a one", "b two", "c three"]))
+    again, new = candidates(embeddings, ["b two", "d four"], first_id=1)
+    working_set.add(SCOPE, [again, new[:3] + (3,)])
+    # "b two" is kept once; the oldest remaining entry, "c three", no longer fits
+    query = np.array(embeddings.embed_query("x"), dtype=np.float32)
+    assert sorted(doc for doc, _, _, _ in working_set.search(SCOPE, query)) == ["a one", "b two", "d four"]
+    assert len(working_set) == 3
+    working_set.clear()
+    assert len(working_set) == 0 and working_set.search(SCOPE, query) == []
@@ -0,0 +1,185 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from logging.handlers import RotatingFileHandler
+from llm_scheduler import get_scheduler
+
+# Replaced before anything is written; order matters (emails before long digit runs etc.)
+PII_PATTERNS = [
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"), "[EMAIL]"),
+    (re.compile(r"https?://\S+"), "[URL]"),
+    (re.compile(r"\b\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}\b"), "[DATE]"),
+    (re.compile(r"\+?\d[\d\s().-]{7,}\d"), "[NUMBER]"),
+    (re.compile(r"\b\d{6,}\b"), "[NUMBER]"),
+    (re.compile(r"\b(?:Mr|Mrs|Ms|Miss|Dr|Prof)\.?\s+[A-Z][a-z]+(?:\s+[A-Z][a-z]+)?"), "[NAME]"),
+    (re.compile(r"\b([Pp]atient|[Pp]t\.?)(\s+(?:named|called)?\s*)[A-Z][a-z]+(?:\s+[A-Z][a-z]+)?"), r"\1\2[NAME]"),
+    (re.compile(r"\b(?:age[ds]?\s+|)\d{1,3}(?:-| )?(?:year|yr)s?(?:-| )?old\b", re.IGNORECASE), "[AGE]")
+]
+
+
+_PLACEHOLDER = re.compile(r"\[(?:EMAIL|URL|DATE|NUMBER|NAME|AGE)\]")
+
+
+def is_redacted(text: str) -> bool:
+    """Whether redact() changed this text (its retrieval can't be reproduced exactly)"""
+    return bool(text and _PLACEHOLDER.search(text))
+
+
+def redact(text: str) -> str:
+    """Strip emails, URLs, dates, phone/record numbers, names after titles and ages"""
+    if not text:
+        return text
+    for pattern, replacement in PII_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def chunk_id(doc) -> str:
+    """Build-independent chunk identity: source file plus a hash of the chunk text"""
+    source = doc.metadata.get("filename") or os.path.basename(doc.metadata.get("source", "")) or "?"
+    return f"{source}#{hashlib.sha256(doc.page_content.encode('utf-8')).hexdigest()[:12]}"
+
+
+class RequestUsage:
+    """Scheduler observer collecting model, tokens and call time per stage of each request.
+
+    Requests are identified by the "request" key of the call context; pop()
+    returns and forgets one request's usage. Calls that finish after that (a
+    discarded speculation still running) are not collected.
+    """
+
+    def __init__(self, remember_popped: int = 4096):
+        self._lock = threading.Lock()
+        self._requests = defaultdict(dict)
+        # Recently popped request ids: the deque keeps their order, the set answers membership
+        self._popped = deque(maxlen=remember_popped)
+        self._popped_ids = set()
+
+    def observe(self, event: dict):
+        request_id = (event.get("context") or {}).get("request")
+        if request_id is None:
+            return
+        usage = getattr(event.get("response"), "usage", None)
+        stage = event["context"].get("stage", "unknown")
+        with self._lock:
+            if request_id in self._popped_ids:
+                return
+            totals = self._requests[request_id].setdefault(stage, {
+                "model": event["model"], "calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "seconds": 0.0
+            })
+            totals["calls"] += 1
+            totals["seconds"] = round(totals["seconds"] + (event.get("latency") or 0.0), 3)
+            if usage is not None:
+                totals["prompt_tokens"] += usage.prompt_tokens or 0
+                totals["completion_tokens"] += getattr(usage, "completion_tokens", None) or 0
+            elif event.get("kind") == "embedding" and event.get("error") is None:
+                totals["prompt_tokens"] += event.get("estimated_tokens") or 0
+
+    def pop(self, request_id: str) -> dict:
+        with self._lock:
+            if request_id not in self._popped_ids:
+                if len(self._popped) == self._popped.maxlen:
+                    self._popped_ids.discard(self._popped[0])
+                self._popped.append(request_id)
+                self._popped_ids.add(request_id)
+            return self._requests.pop(request_id, {})
+
+
+_request_usage = None
+_request_usage_lock = threading.Lock()
+
+
+def get_request_usage() -> RequestUsage:
+    """Process-wide per-request usage collector, fed by the shared scheduler"""
+    global _request_usage
+    with _request_usage_lock:
+        if _request_usage is None:
+            _request_usage = RequestUsage()
+            get_scheduler().add_observer(_request_usage.observe)
+        return _request_usage
+
+
+class TrafficRecorder:
+    """Appends one JSON line per answered query to a size-rotated log (path, path.1, ...).
+
+    Query text is redacted before it is written and answers are not kept, only
+    their length; sessions are stored as a salted hash so a conversation can be
+    replayed in order without storing who had it.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 50 * 2 ** 20, backups: int = 5):
+        self.path = path
+        self._salt = os.urandom(8).hex()
+        self._handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+        self._handler.setFormatter(logging.Formatter("%(message)s"))
+        self._logger = logging.Logger(f"traffic_recorder:{path}")
+        self._logger.propagate = False
+        self._logger.addHandler(self._handler)
+
+    def session_key(self, session_id: str) -> str:
+        return hashlib.sha256(f"{self._salt}:{session_id}".encode("utf-8")).hexdigest()[:16]
+
+    def write(self, record: dict):
+        record = dict(record, session=self.session_key(record.get("session", "")))
+        self._logger.info(json.dumps(record, ensure_ascii=False))
+
+    def close(self):
+        self._handler.close()
+
+
+def build_record(request_id: str, session: str, query: str, rewritten_query: str, category: str, role: str,
+                 index_version: str, retrieval: list, trace: dict, usage: dict, response: str) -> dict:
+    """One traffic log entry; query texts are redacted here"""
+    return {
+        "request_id": request_id,
+        "timestamp": time.time(),
+        "session": session,
+        "query": redact(query),
+        "rewritten_query": redact(rewritten_query),
+        "category": category,
+        "role": role,
+        "index_version": index_version,
+        "retrieval": [{"chunk": chunk_id(doc), "score": round(float(score), 4)} for doc, score in retrieval],
+        "stages": trace.get("stages", []),
+        "degradations": trace.get("degradations", []),
+        "speculations": trace.get("speculations", []),
+        "elapsed_seconds": trace.get("elapsed_seconds"),
+        "usage": usage,
+        "response_chars": len(response or "")
+    }
+
+
+_recorders = {}
+_recorders_lock = threading.Lock()
+
+
+def get_traffic_recorder():
+    """Process-wide recorder for TRAFFIC_LOG, or None when recording is off (the default)"""
+    path = os.getenv("TRAFFIC_LOG")
+    if not path:
+        return None
+    path = os.path.abspath(path)
+    with _recorders_lock:
+        if path not in _recorders:
+            _recorders[path] = TrafficRecorder(
+                path,
+                max_bytes=int(float(os.getenv("TRAFFIC_LOG_MAX_MB", 50)) * 2 ** 20),
+                backups=int(os.getenv("TRAFFIC_LOG_BACKUPS", 5))
+            )
+        return _recorders[path]
+
+
+def read_traffic_log(path: str) -> list:
+    """Records from a log and its rotated files, oldest first"""
+    files = [path] + glob.glob(f"{glob.escape(path)}.[0-9]*")
+    records = []
+    for file_path in files:
+        with open(file_path, encoding="utf-8") as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    return sorted(records, key=lambda record: record["timestamp"])
@@ -0,0 +1,427 @@
+import argparse
+import csv
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from llm_scheduler import get_scheduler
+
+# USD per million tokens (override or extend with LLM_PRICES, same shape)
+DEFAULT_PRICES = {
+    "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+    "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+    "text-embedding-3-small": {"input": 0.02},
+    "text-embedding-3-large": {"input": 0.13},
+    "text-embedding-ada-002": {"input": 0.10}
+}
+
+USAGE_FIELDS = ["timestamp", "model", "kind", "stage", "session", "role", "category", "prompt_tokens",
+                "cached_tokens", "completion_tokens", "total_tokens", "cost_usd", "latency", "wait", "error"]
+NUMERIC_FIELDS = ("prompt_tokens", "cached_tokens", "completion_tokens", "total_tokens", "cost_usd", "latency", "wait")
+DIMENSIONS = ("stage", "session", "role", "category", "model", "kind")
+# Session ids would explode Prometheus label cardinality
+PROMETHEUS_LABELS = ("stage", "model", "role", "category")
+
+
+class BudgetExceeded(Exception):
+    """Raised when a session has used up its token or cost budget"""
+
+
+def load_prices() -> dict:
+    prices = {model: dict(price) for model, price in DEFAULT_PRICES.items()}
+    override = os.getenv("LLM_PRICES")
+    if override:
+        for model, price in json.loads(override).items():
+            prices.setdefault(model, {}).update(price)
+    return prices
+
+
+def call_cost(prices: dict, model: str, prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> float:
+    price = prices.get(model)
+    if price is None:
+        return 0.0
+    uncached = prompt_tokens - cached_tokens
+    return (uncached * price.get("input", 0.0)
+            + cached_tokens * price.get("cached_input", price.get("input", 0.0))
+            + completion_tokens * price.get("output", 0.0)) / 1e6
+
+
+def _empty_totals() -> dict:
+    return {"calls": 0, "errors": 0, **{field: 0 for field in NUMERIC_FIELDS}}
+
+
+def _add(totals: dict, record: dict):
+    totals["calls"] += 1
+    totals["errors"] += 1 if record["error"] else 0
+    for field in NUMERIC_FIELDS:
+        totals[field] += record[field]
+
+
+def aggregate(records, by=("stage",)) -> dict:
+    """{(values of by...): totals} over usage records; wall_seconds = latency + queue wait"""
+    groups = defaultdict(_empty_totals)
+    for record in records:
+        _add(groups[tuple(record[key] for key in by)], record)
+    for totals in groups.values():
+        totals["wall_seconds"] = totals["latency"] + totals["wait"]
+    return dict(groups)
+
+
+class UsageTracker:
+    """Scheduler observer recording tokens, cost and time of every LLM and embedding call.
+
+    Calls are attributed to the stage, session, role and category of their call
+    context. Recent records (window_seconds, at most max_records) are kept for
+    rolling aggregation, cumulative totals per session back the session budgets,
+    and with log_path every record is also appended to a CSV usage log (see the
+    report command). Session totals idle for longer than the window are
+    forgotten, unless the session was tracked with a SessionStore that keeps
+    them. The Prometheus textfile is rewritten every prometheus_interval seconds
+    from a background thread. Calls shared through request coalescing are
+    counted once, for the session that made them.
+    """
+
+    def __init__(self, window_seconds: float = 3600, log_path: str = None, prices: dict = None,
+                 session_max_tokens: int = None, session_max_cost: float = None, prometheus_path: str = None,
+                 max_records: int = 20000, prometheus_interval: float = 15.0):
+        self.window_seconds = window_seconds
+        self.log_path = log_path
+        self.prices = prices if prices is not None else load_prices()
+        self.prometheus_path = prometheus_path
+        self.prometheus_interval = prometheus_interval
+        self.default_budget = {"max_tokens": session_max_tokens, "max_cost": session_max_cost}
+        self._lock = threading.Lock()
+        self._records = deque(maxlen=max_records)
+        self._totals = defaultdict(_empty_totals)  # cumulative, by PROMETHEUS_LABELS
+        # session -> {"totals", "store", "last_seen"}, least recently active first
+        self._sessions = OrderedDict()
+        self._budgets = {}
+        self._over_budget = set()
+        self._budget_hooks = []
+        self._unpriced = set()
+        self._dirty = threading.Event()
+        self._flusher = None
+
+    def track_session(self, session_id: str, store=None):
+        """Keep a session's totals in store (a SessionStore), restoring what it saved before"""
+        if store is None:
+            return
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None and entry["store"] is store:
+                return
+        saved = store.load_usage(session_id)
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = self._touch(session_id, time.time())
+                if saved:
+                    entry["totals"].update(saved)
+                if self._exceeds(session_id, entry["totals"]):
+                    # Already reported before the restart
+                    self._over_budget.add(session_id)
+            entry["store"] = store
+
+    def _touch(self, session_id: str, now: float) -> dict:
+        """The session's entry, created if needed and marked as the most recently active"""
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            entry = self._sessions[session_id] = {"totals": _empty_totals(), "store": None, "last_seen": now}
+        entry["last_seen"] = now
+        self._sessions.move_to_end(session_id)
+        return entry
+
+    def _evict_idle(self, now: float):
+        cutoff = now - self.window_seconds
+        while self._sessions:
+            session_id, entry = next(iter(self._sessions.items()))
+            if entry["last_seen"] >= cutoff:
+                break
+            del self._sessions[session_id]
+            self._over_budget.discard(session_id)
+
+    def observe(self, event: dict):
+        context = event.get("context") or {}
+        usage = getattr(event.get("response"), "usage", None)
+        if usage is not None:
+            details = getattr(usage, "prompt_tokens_details", None)
+            prompt_tokens = usage.prompt_tokens or 0
+            cached_tokens = getattr(details, "cached_tokens", None) or 0
+            completion_tokens = usage.completion_tokens or 0
+        elif event.get("kind") == "embedding" and event.get("error") is None:
+            # Embedding responses carry no usage; the scheduler's estimate is an exact tiktoken count
+            prompt_tokens, cached_tokens, completion_tokens = event.get("estimated_tokens") or 0, 0, 0
+        else:
+            prompt_tokens = cached_tokens = completion_tokens = 0
+        model = event["model"]
+        category = context.get("category", "")
+        record = {
+            "timestamp": time.time(),
+            "model": model,
+            "kind": event.get("kind", "chat"),
+            "stage": context.get("stage", "unknown"),
+            "session": context.get("session", ""),
+            "role": context.get("role", ""),
+            "category": "general" if category is None else category,
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "cost_usd": call_cost(self.prices, model, prompt_tokens, cached_tokens, completion_tokens),
+            "latency": event.get("latency") or 0.0,
+            "wait": event.get("wait") or 0.0,
+            "error": type(event["error"]).__name__ if event.get("error") is not None else ""
+        }
+
+        crossed = persist = None
+        with self._lock:
+            if model not in self.prices and model not in self._unpriced:
+                self._unpriced.add(model)
+                print(f"⚠️ No price for {model}; its calls are counted at $0 (set LLM_PRICES)")
+            self._records.append(record)
+            cutoff = record["timestamp"] - self.window_seconds
+            while self._records and self._records[0]["timestamp"] < cutoff:
+                self._records.popleft()
+            _add(self._totals[tuple(record[key] for key in PROMETHEUS_LABELS)], record)
+            self._evict_idle(record["timestamp"])
+            if record["session"]:
+                entry = self._touch(record["session"], record["timestamp"])
+                session_totals = entry["totals"]
+                _add(session_totals, record)
+                if entry["store"] is not None:
+                    persist = (entry["store"], record["session"], dict(session_totals))
+                if record["session"] not in self._over_budget and self._exceeds(record["session"], session_totals):
+                    self._over_budget.add(record["session"])
+                    crossed = (record["session"], dict(session_totals), self.budget_for(record["session"]))
+            if self.log_path:
+                self._append_log(record)
+
+        if persist:
+            try:
+                persist[0].save_usage(persist[1], persist[2])
+            except Exception as e:
+                print(f"Could not save usage of session {persist[1]}: {e}")
+        if self.prometheus_path:
+            self._dirty.set()
+            self._start_flusher()
+        if crossed:
+            print(f"💸 Session {crossed[0]} is over its budget ({crossed[1]['total_tokens']} tokens, "
+                  f"${crossed[1]['cost_usd']:.4f})")
+            for hook in list(self._budget_hooks):
+                try:
+                    hook(*crossed)
+                except Exception as e:
+                    print(f"Budget hook failed: {e}")
+
+    def _start_flusher(self):
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True, name="usage-prometheus")
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            self._dirty.wait()
+            self._dirty.clear()
+            try:
+                self.write_prometheus(self.prometheus_path)
+            except Exception as e:
+                print(f"Could not write {self.prometheus_path}: {e}")
+            time.sleep(self.prometheus_interval)
+
+    def _append_log(self, record: dict):
+        new_file = not os.path.exists(self.log_path)
+        with open(self.log_path, "a", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=USAGE_FIELDS)
+            if new_file:
+                writer.writeheader()
+            writer.writerow(record)
+
+    # Budgets
+
+    def set_session_budget(self, session_id: str, max_tokens: int = None, max_cost: float = None):
+        with self._lock:
+            self._budgets[session_id] = {"max_tokens": max_tokens, "max_cost": max_cost}
+            if not self._exceeds(session_id, self._totals_of(session_id)):
+                self._over_budget.discard(session_id)
+
+    def budget_for(self, session_id: str) -> dict:
+        return self._budgets.get(session_id, self.default_budget)
+
+    def _exceeds(self, session_id: str, totals: dict) -> bool:
+        budget = self.budget_for(session_id)
+        return ((budget["max_tokens"] is not None and totals["total_tokens"] >= budget["max_tokens"])
+                or (budget["max_cost"] is not None and totals["cost_usd"] >= budget["max_cost"]))
+
+    def _totals_of(self, session_id: str) -> dict:
+        entry = self._sessions.get(session_id)
+        return entry["totals"] if entry is not None else _empty_totals()
+
+    def add_budget_hook(self, hook):
+        """hook(session_id, usage totals, budget) runs once when a session goes over its budget"""
+        self._budget_hooks.append(hook)
+
+    def check_budget(self, session_id: str):
+        """Raise BudgetExceeded if the session has no budget left"""
+        with self._lock:
+            totals = self._totals_of(session_id)
+            if self._exceeds(session_id, totals):
+                raise BudgetExceeded(
+                    f"Session {session_id} used {totals['total_tokens']} tokens (${totals['cost_usd']:.4f}) "
+                    f"of its budget {self.budget_for(session_id)}"
+                )
+
+    def session_usage(self, session_id: str) -> dict:
+        with self._lock:
+            return dict(self._totals_of(session_id))
+
+    # Aggregation and export
+
+    def aggregate(self, by=("stage",), window_seconds: float = None) -> dict:
+        """Totals over the last window_seconds (default: the whole rolling window), grouped by dimensions"""
+        cutoff = time.time() - (window_seconds if window_seconds is not None else self.window_seconds)
+        with self._lock:
+            records = [record for record in self._records if record["timestamp"] >= cutoff]
+        return aggregate(records, by)
+
+    def records(self) -> list:
+        with self._lock:
+            return list(self._records)
+
+    def export_csv(self, path: str):
+        """Write the records in the rolling window to a CSV file"""
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=USAGE_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.records())
+
+    def prometheus_text(self) -> str:
+        with self._lock:
+            totals = {labels: dict(values) for labels, values in self._totals.items()}
+        return prometheus_text(totals)
+
+    def write_prometheus(self, path: str):
+        """Atomically write the cumulative counters for a node_exporter textfile collector"""
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+
+def prometheus_text(totals: dict) -> str:
+    """Prometheus exposition text for {(stage, model, role, category): totals}"""
+    metrics = [
+        ("llm_calls_total", "LLM and embedding API calls", lambda t: [({}, t["calls"])]),
+        ("llm_errors_total", "Failed LLM and embedding API calls", lambda t: [({}, t["errors"])]),
+        ("llm_tokens_total", "Tokens used", lambda t: [({"type": "prompt"}, t["prompt_tokens"]),
+                                                       ({"type": "cached"}, t["cached_tokens"]),
+                                                       ({"type": "completion"}, t["completion_tokens"])]),
+        ("llm_cost_usd_total", "Estimated cost in USD", lambda t: [({}, t["cost_usd"])]),
+        ("llm_call_seconds_total", "Time spent in API calls", lambda t: [({}, t["latency"])]),
+        ("llm_wait_seconds_total", "Time spent queued for rate limits", lambda t: [({}, t["wait"])])
+    ]
+    lines = []
+    for name, help_text, samples in metrics:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for labels, values in sorted(totals.items()):
+            for extra, value in samples(values):
+                label_text = ",".join(f'{key}="{value}"' for key, value in
+                                      list(zip(PROMETHEUS_LABELS, labels)) + list(extra.items()))
+                lines.append(f"{name}{{{label_text}}} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def read_usage_log(path: str, since: float = None) -> list:
+    records = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            for field in NUMERIC_FIELDS + ("timestamp",):
+                row[field] = float(row[field] or 0)
+            if since is None or row["timestamp"] >= since:
+                records.append(row)
+    return records
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_usage_tracker() -> UsageTracker:
+    """Process-wide usage tracker, fed by the shared scheduler.
+
+    USAGE_LOG appends every call to a CSV file, USAGE_PROM_FILE keeps a
+    Prometheus textfile up to date (every USAGE_PROM_INTERVAL seconds),
+    USAGE_MAX_RECORDS caps the rolling window, and SESSION_TOKEN_BUDGET /
+    SESSION_COST_BUDGET (USD) set the default per-session budget.
+    """
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            max_tokens = os.getenv("SESSION_TOKEN_BUDGET")
+            max_cost = os.getenv("SESSION_COST_BUDGET")
+            _tracker = UsageTracker(
+                window_seconds=float(os.getenv("USAGE_WINDOW_SECONDS", 3600)),
+                log_path=os.getenv("USAGE_LOG") or None,
+                prometheus_path=os.getenv("USAGE_PROM_FILE") or None,
+                max_records=int(os.getenv("USAGE_MAX_RECORDS", "20000")),
+                prometheus_interval=float(os.getenv("USAGE_PROM_INTERVAL", "15")),
+                session_max_tokens=int(max_tokens) if max_tokens else None,
+                session_max_cost=float(max_cost) if max_cost else None
+            )
+            get_scheduler().add_observer(_tracker.observe)
+        return _tracker
+
+
+def print_ranking(groups: dict, by: tuple, key: str, title: str):
+    total = sum(values[key] for values in groups.values()) or 1
+    print(f"\n{title}")
+    print(f"{'/'.join(by):<32}{'calls':>7}{'tokens':>10}{'cost $':>10}{'wall s':>9}{'share':>8}")
+    for labels, values in sorted(groups.items(), key=lambda item: item[1][key], reverse=True):
+        print(f"{'/'.join(str(label) or '-' for label in labels):<32}{values['calls']:>7}"
+              f"{int(values['total_tokens']):>10}{values['cost_usd']:>10.4f}{values['wall_seconds']:>9.1f}"
+              f"{values[key] / total:>8.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Token, cost and time usage of LLM calls")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report_parser = subparsers.add_parser("report", help="Rank stages (or other dimensions) by tokens and time")
+    report_parser.add_argument("--by", nargs="+", choices=DIMENSIONS, default=["stage"])
+    export_parser = subparsers.add_parser("export", help="Export the usage log as CSV or Prometheus text")
+    export_parser.add_argument("--format", choices=["csv", "prometheus"], default="prometheus")
+    export_parser.add_argument("--output", help="Output file (default: stdout for Prometheus)")
+    for sub in (report_parser, export_parser):
+        sub.add_argument("--log", default=os.getenv("USAGE_LOG", "usage.csv"), help="CSV usage log (USAGE_LOG)")
+        sub.add_argument("--since-hours", type=float, help="Only calls from the last N hours")
+    args = parser.parse_args()
+
+    since = time.time() - args.since_hours * 3600 if args.since_hours else None
+    records = read_usage_log(args.log, since)
+    if args.command == "report":
+        by = tuple(args.by)
+        groups = aggregate(records, by)
+        print(f"{len(records)} calls, {int(sum(r['total_tokens'] for r in records))} tokens, "
+              f"${sum(r['cost_usd'] for r in records):.4f}")
+        print_ranking(groups, by, "total_tokens", "By tokens")
+        print_ranking(groups, by, "wall_seconds", "By wall-clock time (API latency + queue wait)")
+    elif args.format == "prometheus":
+        text = prometheus_text(aggregate(records, PROMETHEUS_LABELS))
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                f.write(text)
+        else:
+            print(text, end="")
+    else:
+        if not args.output:
+            raise SystemExit("--output is required for CSV export")
+        with open(args.output, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=USAGE_FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+
+
+if __name__ == "__main__":
+    main()
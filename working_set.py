@@ -0,0 +1,81 @@
+import threading
+import numpy as np
+
+
+class WorkingSetStats:
+    """How often follow-up retrievals were answered from a session's working set"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # hit: answered locally; far: nothing close enough; empty: nothing retrieved yet in this scope
+        self._stats = {"lookups": 0, "hits": 0, "far": 0, "empty": 0}
+
+    def record(self, outcome: str):
+        with self._lock:
+            self._stats["lookups"] += 1
+            self._stats[outcome] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            follow_ups = self._stats["hits"] + self._stats["far"]
+            return dict(self._stats,
+                        hit_rate=self._stats["hits"] / self._stats["lookups"] if self._stats["lookups"] else 0.0,
+                        follow_up_hit_rate=self._stats["hits"] / follow_ups if follow_ups else 0.0)
+
+
+_stats = WorkingSetStats()
+
+
+def get_working_set_stats() -> WorkingSetStats:
+    """Process-wide working set counters shared by every session"""
+    return _stats
+
+
+class WorkingSet:
+    """Chunks one session retrieved recently, with their vectors, to answer follow-ups without an index search.
+
+    Scoped to one (index version, category); adding or searching in another
+    scope starts afresh. Distances are squared L2 like the FAISS indexes, from
+    one matrix-vector product over at most capacity chunks.
+    """
+
+    def __init__(self, capacity: int = 48):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._scope = None
+        # (index id, document, vector), most recently retrieved first
+        self._entries = []
+        self._vectors = None
+        self._squared_norms = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._scope = None
+            self._entries = []
+            self._vectors = self._squared_norms = None
+
+    def add(self, scope: tuple, candidates: list):
+        """Remember (document, distance, vector, index id) candidates of a full search"""
+        with self._lock:
+            if scope != self._scope:
+                self._scope, self._entries = scope, []
+            seen = {index_id for _, _, _, index_id in candidates}
+            entries = [(index_id, doc, vector) for doc, _, vector, index_id in candidates]
+            entries += [entry for entry in self._entries if entry[0] not in seen]
+            self._entries = entries[:self.capacity]
+            if self._entries:
+                self._vectors = np.vstack([vector for _, _, vector in self._entries]).astype(np.float32)
+                self._squared_norms = np.einsum("ij,ij->i", self._vectors, self._vectors)
+
+    def search(self, scope: tuple, query_vector: np.ndarray) -> list:
+        """All remembered chunks as (document, distance, vector, index id), closest first"""
+        with self._lock:
+            if scope != self._scope or not self._entries:
+                return []
+            entries, vectors, squared_norms = self._entries, self._vectors, self._squared_norms
+        distances = squared_norms - 2.0 * (vectors @ query_vector) + float(query_vector @ query_vector)
+        order = np.argsort(distances, kind="stable")
+        return [(entries[i][1], float(max(distances[i], 0.0)), entries[i][2], entries[i][0]) for i in order]